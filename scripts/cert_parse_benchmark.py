@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Time CertificateDirectory.list() for directories of 10 to 2000
+entitlement certificates: cold and parsed one at a time, cold and
+parsed by a pool of workers, and warm from the certificate index.
+
+With --memory, report the peak RSS of listing the certificates and
+checking their validity and order from a warm index instead, with and without decoding every content set.
+
+Run from the top of a source checkout:
+
+    python scripts/cert_parse_benchmark.py [--workers N] [--memory] [COUNT ...]
+"""
+
+import multiprocessing
+import optparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'test'))
+
+import certdata
+from subscription_manager import certdirectory
+
+DEFAULT_COUNTS = [10, 100, 500, 1000, 2000]
+
+
+def make_cert_dir(count):
+    path = tempfile.mkdtemp(prefix='cert-bench-')
+    for i in range(count):
+        f = open(os.path.join(path, '%s.pem' % i), 'w')
+        f.write(certdata.ENTITLEMENT_CERT_V3_0)
+        f.close()
+    return path
+
+
+def time_listing(cert_dir_path, index_path, workers):
+
+    class BenchCertificateDirectory(certdirectory.CertificateDirectory):
+        INDEX_PATH = index_path
+
+    cert_dir = BenchCertificateDirectory(cert_dir_path)
+    cert_dir.parse_workers = workers
+    start = time.time()
+    cert_dir.list()
+    return time.time() - start
+
+
+def run(count, workers):
+    cert_dir_path = make_cert_dir(count)
+    index_dir = tempfile.mkdtemp(prefix='cert-bench-index-')
+    try:
+        serial_index = os.path.join(index_dir, 'serial.json')
+        parallel_index = os.path.join(index_dir, 'parallel.json')
+        cold_serial = time_listing(cert_dir_path, serial_index, 0)
+        cold_parallel = time_listing(cert_dir_path, parallel_index, workers)
+        warm = time_listing(cert_dir_path, serial_index, 0)
+    finally:
+        shutil.rmtree(cert_dir_path)
+        shutil.rmtree(index_dir)
+    return cold_serial, cold_parallel, warm
+
+
+def _peak_rss(cert_dir_path, index_path, decode, result):
+    # Runs in a child process so each case starts from a clean heap.
+
+    class BenchCertificateDirectory(certdirectory.CertificateDirectory):
+        INDEX_PATH = index_path
+
+    # The sample certificate has expired, so look at everything rather
+    # than list_valid():
+    for cert in BenchCertificateDirectory(cert_dir_path).list():
+        cert.is_valid()
+        cert.order.sku
+        if decode:
+            cert.content
+    result.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def peak_rss(cert_dir_path, index_path, decode):
+    result = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_peak_rss,
+            args=(cert_dir_path, index_path, decode, result))
+    child.start()
+    rss = result.get()
+    child.join()
+    return rss
+
+
+def run_memory(count):
+    cert_dir_path = make_cert_dir(count)
+    index_dir = tempfile.mkdtemp(prefix='cert-bench-index-')
+    try:
+        index_path = os.path.join(index_dir, 'index.json')
+        time_listing(cert_dir_path, index_path, 0)
+        lazy = peak_rss(cert_dir_path, index_path, False)
+        decoded = peak_rss(cert_dir_path, index_path, True)
+    finally:
+        shutil.rmtree(cert_dir_path)
+        shutil.rmtree(index_dir)
+    return lazy, decoded
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [--workers N] [--memory] [COUNT ...]")
+    parser.add_option("--workers", type="int", default=multiprocessing.cpu_count(),
+                      help="worker processes for the parallel run (default: %default)")
+    parser.add_option("--memory", action="store_true", default=False,
+                      help="compare peak RSS with and without decoding content sets")
+    (options, args) = parser.parse_args()
+    counts = [int(arg) for arg in args] or DEFAULT_COUNTS
+
+    if options.memory:
+        print "%8s %14s %14s" % ("certs", "lazy KiB", "decoded KiB")
+        for count in counts:
+            lazy, decoded = run_memory(count)
+            print "%8d %14d %14d" % (count, lazy, decoded)
+        return
+
+    # Always use the pool, even for the smallest directories:
+    certdirectory.PARALLEL_PARSE_MIN = 1
+
+    print "%8s %14s %18s %10s %8s" % ("certs", "cold serial",
+                                      "cold %d workers" % options.workers,
+                                      "warm", "speedup")
+    for count in counts:
+        cold_serial, cold_parallel, warm = run(count, options.workers)
+        print "%8d %13.3fs %17.3fs %9.3fs %7.1fx" % (count, cold_serial,
+                cold_parallel, warm, cold_serial / cold_parallel)
+
+
+if __name__ == "__main__":
+    main()
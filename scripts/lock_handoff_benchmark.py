@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Time how long the action lock takes to pass from one process to another
+when two processes compete for it, each taking it ROUNDS times and
+holding it for --hold milliseconds.
+
+Reports the hand-off latency, from one process releasing the lock to
+the other having it, and how often a process took the lock straight
+back while the other was waiting. --polling does the same with the
+lock file polled every 0.5s, the way the lock used to wait.
+
+Run from the top of a source checkout:
+
+    python scripts/lock_handoff_benchmark.py [--hold MS] [--polling] [ROUNDS]
+"""
+
+import multiprocessing
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from subscription_manager import lock
+
+DEFAULT_ROUNDS = 50
+
+
+class PollingLock(object):
+    """ The lock file polled every 0.5s while another process has it. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def acquire(self):
+        while True:
+            f = lock.LockFile(self.path)
+            f.fp = lock.open_locked(self.path)
+            try:
+                if f.getpid() is None or not f.valid():
+                    f.setpid()
+                    return
+            finally:
+                f.close()
+            time.sleep(0.5)
+
+    def release(self):
+        f = lock.LockFile(self.path)
+        f.fp = lock.open_locked(self.path)
+        try:
+            f.clearpid()
+        finally:
+            f.close()
+
+
+def compete(path, rounds, hold, polling, start, result):
+    if polling:
+        action_lock = PollingLock(path)
+    else:
+        action_lock = lock.Lock(path)
+    times = []
+    start.wait()
+    for i in range(rounds):
+        action_lock.acquire()
+        acquired = time.time()
+        time.sleep(hold)
+        released = time.time()
+        action_lock.release()
+        times.append((acquired, released, os.getpid()))
+        # Give the other process the chance to queue up before we
+        # try again:
+        time.sleep(hold)
+    result.put(times)
+
+
+def run(rounds, hold, polling):
+    lock_dir = tempfile.mkdtemp(prefix='lock-bench-')
+    path = os.path.join(lock_dir, 'cert.pid')
+    start = multiprocessing.Event()
+    result = multiprocessing.Queue()
+    try:
+        processes = [multiprocessing.Process(target=compete,
+                     args=(path, rounds, hold, polling, start, result))
+                     for i in range(2)]
+        for process in processes:
+            process.start()
+        start.set()
+        times = result.get() + result.get()
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(lock_dir)
+
+    times.sort()
+    handoffs = []
+    retakes = 0
+    for (previous, current) in zip(times, times[1:]):
+        if previous[2] != current[2]:
+            handoffs.append(current[0] - previous[1])
+        else:
+            retakes += 1
+    return handoffs, retakes
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [--hold MS] [--polling] [ROUNDS]")
+    parser.add_option("--hold", type="float", default=5,
+                      help="milliseconds each process holds the lock (default: %default)")
+    parser.add_option("--polling", action="store_true", default=False,
+                      help="poll the lock file every 0.5s instead of waiting on it")
+    (options, args) = parser.parse_args()
+    rounds = args and int(args[0]) or DEFAULT_ROUNDS
+
+    handoffs, retakes = run(rounds, options.hold / 1000.0, options.polling)
+    handoffs.sort()
+    if not handoffs:
+        print "no hand-offs in %d rounds" % rounds
+        return
+    print "%10s %10s %10s %10s %10s" % ("hand-offs", "mean ms", "median ms",
+                                        "max ms", "retakes")
+    print "%10d %10.2f %10.2f %10.2f %10d" % (len(handoffs),
+            1000 * sum(handoffs) / len(handoffs),
+            1000 * handoffs[len(handoffs) // 2],
+            1000 * handoffs[-1], retakes)
+
+
+if __name__ == "__main__":
+    main()
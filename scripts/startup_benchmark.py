@@ -0,0 +1,585 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Time the start of each entry point: subscription-manager, rct,
+rhsm-debug, rhsmcertd-worker and the config_hook and posttrans_hook of
+the yum plugins.
+
+Every run is a process of its own, working on a fixture tree with a
+consumer identity, --certs entitlement certificates, product
+certificates and an rhsm.conf pointing at a StandInServer. The process
+runs as if by root, with the paths root would use moved into the tree.
+Cold runs get a fresh copy of the tree, without caches or certificate
+indexes, and with --drop-caches (root only) an empty page cache. Warm
+runs reuse a tree which a first run of the same entry point left
+behind.
+
+Reports the median over --runs of the time spent importing modules, the
+time from starting the process to its first output, the total time, the
+peak RSS and the number of modules loaded. --save writes the results to
+a file, --baseline compares them with such a file and exits with 1 if
+any of them grew by more than --threshold percent.
+
+Run from the top of a source checkout:
+
+    python scripts/startup_benchmark.py [--runs N] [--certs N] [--drop-caches]
+        [--save FILE] [--baseline FILE] [--threshold PERCENT] [ENTRY ...]
+
+where ENTRY selects the entry points whose names contain it.
+"""
+
+# Only what every entry point imports anyway, the runs of the entry
+# points start by loading this module:
+import os
+import sys
+import time
+import types
+
+TOP = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+sys.path.insert(0, os.path.join(TOP, 'src'))
+sys.path.insert(0, os.path.join(TOP, 'test'))
+
+CHILD = '--run-entry'
+
+# (name, kind, path, arguments), %(tree)s in the arguments is the
+# fixture tree:
+ENTRIES = [
+    ('subscription-manager --help', 'script', 'bin/subscription-manager', ['--help']),
+    ('subscription-manager version', 'script', 'bin/subscription-manager', ['version']),
+    ('subscription-manager identity', 'script', 'bin/subscription-manager', ['identity']),
+    ('subscription-manager status', 'script', 'bin/subscription-manager', ['status']),
+    ('subscription-manager list --consumed', 'script', 'bin/subscription-manager',
+     ['list', '--consumed']),
+    ('rct cat-cert', 'script', 'bin/rct', ['cat-cert', '%(tree)s/etc/pki/entitlement/0.pem']),
+    ('rhsm-debug --help', 'script', 'bin/rhsm-debug', ['--help']),
+    ('rhsmcertd-worker', 'script', 'src/daemons/rhsmcertd-worker.py', []),
+    ('yum config_hook', 'plugin', 'src/plugins/subscription-manager.py', ['config_hook']),
+    ('yum posttrans_hook', 'plugin', 'src/plugins/product-id.py', ['posttrans_hook']),
+]
+
+# Paths the entry points use as root, moved into the fixture tree:
+RELOCATED = ['/etc/pki', '/etc/rhsm', '/etc/rhsm-host', '/etc/yum.repos.d',
+             '/var/lib/rhsm', '/var/log/rhsm', '/var/run/rhsm']
+
+TREE_DIRS = ['etc/pki/consumer', 'etc/pki/entitlement', 'etc/pki/product',
+             'etc/rhsm/ca', 'etc/rhsm/facts', 'etc/rhsm/pluginconf.d',
+             'etc/yum.repos.d', 'usr/share/rhsm-plugins',
+             'var/lib/rhsm/cache', 'var/lib/rhsm/facts', 'var/lib/rhsm/packages',
+             'var/log/rhsm', 'var/run/rhsm']
+
+DEFAULT_CERTS = 20
+DEFAULT_RUNS = 5
+DEFAULT_THRESHOLD = 20
+
+
+class EntryHarness(object):
+    """
+    Runs in the process of an entry point. Adds up the time spent in
+    imports, and moves the paths in RELOCATED into the fixture tree in
+    the modules of subscription_manager and rhsm as they are imported.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.import_time = 0.0
+        self._depth = 0
+        self._configured = False
+        self._known = set(sys.modules)
+        self._initial_modules = len(self._known)
+        self._import = None
+
+    def install(self):
+        import __builtin__
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def _timed_import(self, *args, **kwargs):
+        self._depth += 1
+        start = time.time()
+        try:
+            return self._import(*args, **kwargs)
+        finally:
+            self._depth -= 1
+            if not self._configured:
+                self._configure()
+            if self._depth == 0:
+                self.import_time += time.time() - start
+                # Only once the outermost import is done are all the
+                # modules it loaded done loading too:
+                self._fix_new_modules()
+
+    def _configure(self):
+        # The first initConfig() may well come before the outermost
+        # import is done, rhsm.config has its paths moved as soon as it
+        # has defined initConfig, which it does last:
+        config = sys.modules.get('rhsm.config')
+        if config is not None and hasattr(config, 'initConfig'):
+            self._relocate(config)
+            self._configured = True
+
+    def _fix_new_modules(self):
+        if len(sys.modules) == len(self._known):
+            return
+        for name in set(sys.modules) - self._known:
+            module = sys.modules[name]
+            if module is None or name.split('.')[0] not in ('subscription_manager', 'rhsm'):
+                continue
+            self._relocate(module)
+            if name == 'rhsm.connection':
+                # As StandInServer does, the stand-in speaks plain HTTP:
+                module.httplib.HTTPSConnection = plain_connection(module.httplib)
+        self._known = set(sys.modules)
+
+    def _moved(self, value):
+        # Relative paths are relative to certdirectory.Path.ROOT, '/':
+        path = os.path.join('/', value)
+        for prefix in RELOCATED:
+            if path == prefix or path.startswith(prefix + '/'):
+                return self.tree + path
+        return None
+
+    def _relocate(self, module):
+        for (name, value) in vars(module).items():
+            if isinstance(value, str):
+                moved = self._moved(value)
+                if moved:
+                    setattr(module, name, moved)
+            elif isinstance(value, (type, types.ClassType)) and \
+                    value.__module__ == module.__name__:
+                for (attr, attr_value) in vars(value).items():
+                    if isinstance(attr_value, str) and self._moved(attr_value):
+                        setattr(value, attr, self._moved(attr_value))
+
+    def write_result(self, path):
+        f = open(path, 'w')
+        f.write("%f %d\n" % (self.import_time, len(sys.modules) - self._initial_modules))
+        f.close()
+
+
+def plain_connection(httplib):
+
+    class PlainConnection(httplib.HTTPConnection):
+
+        def __init__(self, host, port=None, context=None, **kwargs):
+            httplib.HTTPConnection.__init__(self, host, port, **kwargs)
+
+    return PlainConnection
+
+
+class _Nothing(object):
+    """ No packages installed, none available and no repos enabled. """
+
+    def returnPackages(self):
+        return []
+
+    def searchNevra(self, **kwargs):
+        return []
+
+    def listEnabled(self):
+        return []
+
+
+class BenchYumBase(object):
+    """ As much of a YumBase as ProductManager.update() uses. """
+
+    def __init__(self):
+        self.pkgSack = _Nothing()
+        self.rpmdb = _Nothing()
+        self.repos = _Nothing()
+
+
+class BenchConduit(object):
+    """ A yum plugin conduit writing its messages to stdout and stderr. """
+
+    def __init__(self):
+        self._base = BenchYumBase()
+
+    def info(self, level, msg):
+        sys.stdout.write(msg + '\n')
+
+    def error(self, level, msg):
+        sys.stderr.write(msg + '\n')
+
+    def registerPackageName(self, name):
+        pass
+
+
+def run_child(args):
+    (result_path, tree, kind, path) = args[:4]
+    entry_args = args[4:]
+
+    harness = EntryHarness(tree)
+    harness.install()
+    os.getuid = lambda: 0
+    os.geteuid = lambda: 0
+    try:
+        if kind == 'script':
+            sys.argv = [path] + entry_args
+            execfile(path, {'__name__': '__main__', '__file__': path})
+        else:
+            import imp
+            name = os.path.splitext(os.path.basename(path))[0]
+            plugin = imp.load_source(name, path)
+            getattr(plugin, entry_args[0])(BenchConduit())
+    finally:
+        harness.write_result(result_path)
+
+
+OPENSSL_CONFIG = """
+[req]
+prompt = no
+distinguished_name = subject
+x509_extensions = identity
+
+[subject]
+CN = %s
+
+[identity]
+subjectAltName = DNS:startup-bench
+"""
+
+
+def openssl_identity(tree, uuid):
+    """ A consumer certificate for uuid and its key, made with openssl. """
+    import subprocess
+    consumer_dir = os.path.join(tree, 'etc/pki/consumer')
+    cert_path = os.path.join(consumer_dir, 'cert.pem')
+    key_path = os.path.join(consumer_dir, 'key.pem')
+    config_path = os.path.join(tree, 'openssl.cnf')
+    write_file(config_path, OPENSSL_CONFIG % uuid)
+    devnull = open(os.devnull, 'w')
+    try:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                               '-nodes', '-days', '365', '-config', config_path,
+                               '-keyout', key_path, '-out', cert_path],
+                              stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+        os.unlink(config_path)
+    f = open(key_path)
+    key = f.read()
+    f.close()
+    return key
+
+
+def write_file(path, content):
+    f = open(path, 'w')
+    f.write(content)
+    f.close()
+
+
+def write_config(tree, server):
+    import re
+    server_options = {'hostname': '127.0.0.1', 'port': str(server.port),
+                      'prefix': server.HANDLER, 'insecure': '1'}
+    lines = []
+    f = open(os.path.join(TOP, 'etc-conf', 'rhsm.conf'))
+    for line in f:
+        match = re.match(r'(\w+)\s*=\s*(.*)$', line)
+        if match and match.group(1) in server_options:
+            line = "%s = %s\n" % (match.group(1), server_options[match.group(1)])
+        elif match and match.group(2).startswith('/'):
+            line = "%s = %s%s\n" % (match.group(1), tree, match.group(2))
+        lines.append(line)
+    f.close()
+    write_file(os.path.join(tree, 'etc/rhsm/rhsm.conf'), ''.join(lines))
+
+
+def make_fixture(server, cert_count):
+    """
+    A fixture tree registered to server, with cert_count entitlement
+    certificates, two product certificates and no caches.
+    """
+    import tempfile
+    import uuid
+    import certdata
+    from rhsm.certificate import create_from_pem
+
+    tree = tempfile.mkdtemp(prefix='startup-bench-')
+    for path in TREE_DIRS:
+        os.makedirs(os.path.join(tree, path))
+    write_config(tree, server)
+
+    consumer_uuid = str(uuid.uuid4())
+    key = openssl_identity(tree, consumer_uuid)
+
+    ent_dir = os.path.join(tree, 'etc/pki/entitlement')
+    for i in range(cert_count):
+        write_file(os.path.join(ent_dir, '%d.pem' % i), certdata.ENTITLEMENT_CERT_V3_0)
+        write_file(os.path.join(ent_dir, '%d-key.pem' % i), key)
+    serial = create_from_pem(certdata.ENTITLEMENT_CERT_V3_0).serial
+
+    for pem in (certdata.PRODUCT_CERT_V1_0, certdata.PRODUCT_CERT_WITH_OS_NAME_V1_0):
+        product_id = create_from_pem(pem).products[0].id
+        write_file(os.path.join(tree, 'etc/pki/product', '%s.pem' % product_id), pem)
+
+    owner = {'key': 'admin', 'displayName': 'Admin Owner'}
+    consumer_path = '/consumers/%s' % consumer_uuid
+    server.put('/', [{'rel': rel, 'href': '/%s' % rel}
+                     for rel in ('consumers', 'owners', 'pools', 'status')])
+    server.put('/status', {'version': '0.9.40', 'release': '1', 'result': True,
+                           'managerCapabilities': []})
+    server.put(consumer_path, {'uuid': consumer_uuid, 'name': 'startup-bench',
+                               'owner': owner, 'type': {'label': 'system'},
+                               'releaseVer': {'releaseVer': None},
+                               'serviceLevel': '', 'autoheal': True,
+                               'installedProducts': [], 'facts': {}})
+    server.put(consumer_path + '/owner', owner)
+    server.put(consumer_path + '/compliance',
+               {'status': 'valid', 'compliant': True, 'reasons': [],
+                'nonCompliantProducts': [], 'compliantProducts': {},
+                'partiallyCompliantProducts': {}, 'partialStacks': {},
+                'compliantUntil': None})
+    server.put(consumer_path + '/certificates/serials', [{'serial': serial}])
+    server.put(consumer_path + '/content_overrides', [])
+    server.put(consumer_path + '/release', {'releaseVer': None})
+    server.put(consumer_path + '/entitlements', [])
+    return tree
+
+
+def drop_caches():
+    import subprocess
+    subprocess.call(['sync'])
+    write_file('/proc/sys/vm/drop_caches', '3\n')
+
+
+def interpreter_options(path):
+    """ The python options on the #! line of the script at path, like -S. """
+    f = open(path)
+    first_line = f.readline()
+    f.close()
+    if not first_line.startswith('#!'):
+        return []
+    return [word for word in first_line[2:].split()[1:] if word.startswith('-')]
+
+
+def run_entry(entry, tree, work_dir):
+    """ Run entry once in a process of its own, and time it. """
+    import select
+    import subprocess
+
+    (name, kind, path, args) = entry
+    result_path = os.path.join(work_dir, 'result')
+    if os.path.exists(result_path):
+        os.unlink(result_path)
+    options = []
+    if kind == 'script':
+        options = interpreter_options(os.path.join(TOP, path))
+    # Unbuffered, for the first output to arrive when it is written:
+    command = [sys.executable, '-u'] + options + [os.path.abspath(__file__), CHILD,
+               result_path, tree, kind, os.path.join(TOP, path)] + \
+              [arg % {'tree': tree} for arg in args]
+
+    devnull = open(os.devnull)
+    start = time.time()
+    proc = subprocess.Popen(command, stdin=devnull, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, close_fds=True)
+    first_output = None
+    errors = []
+    pipes = [proc.stdout, proc.stderr]
+    while pipes:
+        (readable, writable, failed) = select.select(pipes, [], [])
+        for pipe in readable:
+            data = os.read(pipe.fileno(), 4096)
+            if not data:
+                pipes.remove(pipe)
+                continue
+            if first_output is None:
+                first_output = time.time() - start
+            if pipe is proc.stderr:
+                errors.append(data)
+    (pid, status, usage) = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    # Reaped already:
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    devnull.close()
+
+    result = {'imports': None, 'modules': None}
+    if os.path.exists(result_path):
+        f = open(result_path)
+        (imports, modules) = f.read().split()
+        f.close()
+        result = {'imports': float(imports), 'modules': int(modules)}
+    result.update({'first_output': first_output, 'wall': wall,
+                   'rss': usage.ru_maxrss, 'exit': proc.returncode,
+                   'errors': ''.join(errors)})
+    return result
+
+
+def median(results):
+    summary = {}
+    for key in ('imports', 'first_output', 'wall', 'rss', 'modules'):
+        values = sorted([result[key] for result in results
+                         if result[key] is not None])
+        summary[key] = None
+        if values:
+            summary[key] = values[len(values) / 2]
+    summary['exit'] = max([result['exit'] for result in results])
+    return summary
+
+
+def run(entry, fixture, runs, dropping_caches, work_dir):
+    """ The cold and warm results of entry, from runs runs each. """
+    import shutil
+
+    cold = []
+    for i in range(runs):
+        tree = os.path.join(work_dir, 'cold')
+        shutil.copytree(fixture, tree)
+        if dropping_caches:
+            drop_caches()
+        cold.append(run_entry(entry, tree, work_dir))
+        shutil.rmtree(tree)
+
+    tree = os.path.join(work_dir, 'warm')
+    shutil.copytree(fixture, tree)
+    run_entry(entry, tree, work_dir)
+    warm = [run_entry(entry, tree, work_dir) for i in range(runs)]
+    shutil.rmtree(tree)
+
+    if cold[-1]['exit']:
+        sys.stderr.write("%s exited with %d:\n%s\n" % (entry[0], cold[-1]['exit'],
+                                                      cold[-1]['errors']))
+    return {'cold': median(cold), 'warm': median(warm)}
+
+
+def format_time(seconds):
+    if seconds is None:
+        return '-'
+    return "%.1fms" % (seconds * 1000)
+
+
+def format_rss(kilobytes):
+    return "%.1fMB" % (kilobytes / 1024.0)
+
+
+def report(results):
+    print "%-38s %-5s %9s %11s %9s %9s %8s" % ('entry point', 'case', 'imports',
+            'first out', 'total', 'peak RSS', 'modules')
+    for (name, kind, path, args) in ENTRIES:
+        if name not in results:
+            continue
+        for case in ('cold', 'warm'):
+            result = results[name][case]
+            line = "%-38s %-5s %9s %11s %9s %9s %8s" % (name, case,
+                    format_time(result['imports']),
+                    format_time(result['first_output']),
+                    format_time(result['wall']), format_rss(result['rss']),
+                    result['modules'] is None and '-' or result['modules'])
+            if result['exit']:
+                line += "  (exit %d)" % result['exit']
+            print line
+
+
+# Results compared with a baseline, the least growth of each which is
+# more than noise, and how to show them:
+COMPARED = [('imports', 0.005, format_time), ('first_output', 0.005, format_time),
+            ('wall', 0.005, format_time), ('rss', 1024, format_rss)]
+
+
+def regressions(results, baseline, threshold):
+    """ Descriptions of the results which grew by more than threshold percent. """
+    found = []
+    for (name, cases) in sorted(results.items()):
+        for (case, result) in sorted(cases.items()):
+            old = baseline.get(name, {}).get(case)
+            if not old:
+                continue
+            for (key, noise, formatter) in COMPARED:
+                if result[key] is None or old.get(key) is None:
+                    continue
+                if result[key] > old[key] * (1 + threshold / 100.0) and \
+                        result[key] - old[key] > noise:
+                    found.append("%s, %s: %s went from %s to %s" %
+                                 (name, case, key, formatter(old[key]),
+                                  formatter(result[key])))
+    return found
+
+
+def main():
+    import compileall
+    import optparse
+    import shutil
+    import tempfile
+    from rhsm import ourjson as json
+    from standin import StandInServer
+
+    parser = optparse.OptionParser(usage="%prog [options] [ENTRY ...]")
+    parser.add_option("--runs", type="int", default=DEFAULT_RUNS,
+                      help="runs of each entry point, cold and warm (default %d)" %
+                      DEFAULT_RUNS)
+    parser.add_option("--certs", type="int", default=DEFAULT_CERTS,
+                      help="entitlement certificates in the fixture tree (default %d)" %
+                      DEFAULT_CERTS)
+    parser.add_option("--drop-caches", action="store_true", default=False,
+                      help="drop the page cache before each cold run, as root")
+    parser.add_option("--save", help="write the results to this file")
+    parser.add_option("--baseline", help="compare the results with this file from --save")
+    parser.add_option("--threshold", type="float", default=DEFAULT_THRESHOLD,
+                      help="percent a result may grow by over the baseline (default %d)" %
+                      DEFAULT_THRESHOLD)
+    (options, args) = parser.parse_args()
+    if options.drop_caches and os.getuid() != 0:
+        parser.error("--drop-caches needs root")
+    entries = [entry for entry in ENTRIES
+               if not args or [arg for arg in args if arg in entry[0]]]
+    if not entries:
+        parser.error("no entry point matches %s" % ' '.join(args))
+
+    # Compiled once, for cold runs to be cold starts rather than compiles:
+    compileall.compile_dir(os.path.join(TOP, 'src'), quiet=1)
+
+    server = StandInServer()
+    server.start()
+    fixture = make_fixture(server, options.certs)
+    work_dir = tempfile.mkdtemp(prefix='startup-bench-runs-')
+    results = {}
+    try:
+        for entry in entries:
+            results[entry[0]] = run(entry, fixture, options.runs,
+                                    options.drop_caches, work_dir)
+    finally:
+        server.stop()
+        shutil.rmtree(fixture)
+        shutil.rmtree(work_dir)
+
+    report(results)
+
+    if options.save:
+        f = open(options.save, 'w')
+        f.write(json.dumps(results, indent=2))
+        f.close()
+    if options.baseline:
+        f = open(options.baseline)
+        baseline = json.loads(f.read())
+        f.close()
+        found = regressions(results, baseline, options.threshold)
+        for regression in found:
+            print "Regression: %s" % regression
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == CHILD:
+        run_child(sys.argv[2:])
+    else:
+        main()
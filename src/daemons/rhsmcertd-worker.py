@@ -22,14 +22,12 @@ import logging
 from subscription_manager import logutil
 logutil.init_logger()
 
-from rhsm import connection
-
 from subscription_manager.injectioninit import init_dep_injection
 init_dep_injection()
 
-from subscription_manager import action_client
-from subscription_manager import managerlib
-from subscription_manager.identity import ConsumerIdentity
+from subscription_manager import worker
+from subscription_manager.exceptions import LOCK_TIMEOUT_MESSAGE
+from subscription_manager.lock import LockTimeout
 from subscription_manager.i18n_optparse import OptionParser, \
     WrappedIndentedHelpFormatter, USAGE
 
@@ -38,36 +36,12 @@ _ = gettext.gettext
 
 
 def main(options, log):
-    if not ConsumerIdentity.existsAndValid():
-        log.error('Either the consumer is not registered or the certificates' +
-                  ' are corrupted. Certificate update using daemon failed.')
-        sys.exit(-1)
-    print _('Updating entitlement certificates & repositories')
-
-    try:
-        if options.autoheal:
-            actionclient = action_client.HealingActionClient()
-        else:
-            actionclient = action_client.ActionClient()
-
-        actionclient.update(options.autoheal)
+    if options.resident:
+        worker.ResidentWorker().serve()
+        return
 
-        for update_report in actionclient.update_reports:
-            # FIXME: make sure we don't get None reports
-            if update_report:
-                print update_report
-
-    except connection.ExpiredIdentityCertException, e:
-        log.critical(_("Your identity certificate has expired"))
-        raise e
-    except connection.GoneException, ge:
-        uuid = ConsumerIdentity.read().getConsumerId()
-        if ge.deleted_id == uuid:
-            log.critical(_("This consumer's profile has been deleted from the server. Its local certificates will now be archived"))
-            managerlib.clean_all_data()
-            log.critical(_("Certificates archived to '/etc/pki/consumer.old'. Contact your system administrator if you need more information."))
-
-        raise ge
+    if not worker.update(options.autoheal, options.interval):
+        sys.exit(-1)
 
 
 if __name__ == '__main__':
@@ -79,6 +53,10 @@ if __name__ == '__main__':
                           formatter=WrappedIndentedHelpFormatter())
     parser.add_option("--autoheal", dest="autoheal", action="store_true",
             default=False, help="perform an autoheal check")
+    parser.add_option("--interval", dest="interval", type="int",
+            default=None, help="seconds rhsmcertd waits between updates of this kind")
+    parser.add_option("--resident", dest="resident", action="store_true",
+            default=False, help="keep running, and update whenever rhsmcertd asks")
     (options, args) = parser.parse_args()
     try:
         main(options, log)
@@ -89,6 +67,10 @@ if __name__ == '__main__':
         # exit with failure to the caller. Otherwise, we will exit with 0
         if se.code:
             sys.exit(-1)
+    except LockTimeout, e:
+        log.error(e)
+        print LOCK_TIMEOUT_MESSAGE
+        sys.exit(-1)
     except Exception, e:
         log.error("Error while updating certificates using daemon")
         print _('Unable to update entitlement certificates and repositories')
@@ -16,6 +16,9 @@
 */
 
 #include <sys/file.h>
+#include <sys/socket.h>
+#include <sys/types.h>
+#include <sys/un.h>
 #include <stdlib.h>
 #include <signal.h>
 #include <stdio.h>
@@ -35,6 +38,9 @@
 #define UPDATEFILE "/var/run/rhsm/update"
 #define WORKER "/usr/libexec/rhsmcertd-worker"
 #define WORKER_NAME WORKER
+#define WORKER_SOCKET "/var/run/rhsm/rhsmcertd-worker.sock"
+#define NEXT_RUN_FILE "/var/run/rhsm/next_%s"
+#define MAX_DELAY_SECONDS (G_MAXINT / 1000)
 #define INITIAL_DELAY_SECONDS 120;
 #define DEFAULT_CERT_INTERVAL_SECONDS 14400	/* 4 hours */
 #define DEFAULT_HEAL_INTERVAL_SECONDS 86400	/* 24 hours */
@@ -49,6 +55,10 @@ static gboolean show_debug = FALSE;
 static gboolean run_now = FALSE;
 static gint arg_cert_interval_minutes = -1;
 static gint arg_heal_interval_minutes = -1;
+static gboolean resident_worker = FALSE;
+static pid_t resident_worker_pid = -1;
+static int cert_interval_seconds = DEFAULT_CERT_INTERVAL_SECONDS;
+static int heal_interval_seconds = DEFAULT_HEAL_INTERVAL_SECONDS;
 
 static GOptionEntry entries[] = {
     /* marked deprecated as of 02-19-2013, needs to be removed...? */
@@ -76,6 +86,7 @@ static GOptionEntry entries[] = {
 typedef struct _Config {
 	int heal_interval_seconds;
 	int cert_interval_seconds;
+	int resident_worker;
 } Config;
 
 const char *
@@ -157,6 +168,9 @@ void
 signal_handler(int signo) {
 	if (signo == SIGTERM) {
 		info ("rhsmcertd is shutting down...");
+		if (resident_worker_pid > 0) {
+			kill (resident_worker_pid, SIGTERM);
+		}
 		signal (signo, SIG_DFL);
 		raise (signo);
 	}
@@ -176,26 +190,125 @@ get_lock ()
 	return 0;
 }
 
-static gboolean
-cert_check (gboolean heal)
+static void
+start_resident_worker ()
 {
-	int status = 0;
-
 	int pid = fork ();
 	if (pid < 0) {
-		error ("fork failed");
-		exit (EXIT_FAILURE);
+		warn ("fork failed, unable to start resident worker");
+		return;
 	}
 	if (pid == 0) {
-		if (heal) {
-			execl (WORKER, WORKER_NAME, "--autoheal", NULL);
-		} else {
-			execl (WORKER, WORKER_NAME, NULL);
-		}
+		execl (WORKER, WORKER_NAME, "--resident", NULL);
 		_exit (errno);
 	}
-	waitpid (pid, &status, 0);
-	status = WEXITSTATUS (status);
+	resident_worker_pid = pid;
+	info ("Started resident worker (pid %d)", pid);
+}
+
+/*
+ * Ask the resident worker to run the update, and put the status it
+ * answers with in status. Returns FALSE if the worker could not be
+ * reached, in which case it is restarted if it exited.
+ */
+static gboolean
+resident_cert_check (gboolean heal, int *status)
+{
+	if (resident_worker_pid > 0
+	    && waitpid (resident_worker_pid, NULL, WNOHANG) == resident_worker_pid) {
+		warn ("Resident worker exited, starting a new one");
+		resident_worker_pid = -1;
+	}
+	if (resident_worker_pid <= 0) {
+		start_resident_worker ();
+		return FALSE;
+	}
+
+	int sock = socket (AF_UNIX, SOCK_STREAM, 0);
+	if (sock < 0) {
+		warn ("unable to create socket: %s", strerror (errno));
+		return FALSE;
+	}
+	struct sockaddr_un addr;
+	memset (&addr, 0, sizeof (addr));
+	addr.sun_family = AF_UNIX;
+	strncpy (addr.sun_path, WORKER_SOCKET, sizeof (addr.sun_path) - 1);
+	if (connect (sock, (struct sockaddr *) &addr, sizeof (addr)) == -1) {
+		debug ("unable to reach resident worker: %s", strerror (errno));
+		close (sock);
+		return FALSE;
+	}
+
+	FILE *conn = fdopen (sock, "r+");
+	if (conn == NULL) {
+		close (sock);
+		return FALSE;
+	}
+	char buf[BUF_MAX];
+	bool answered = fprintf (conn, "%s %d\n", heal ? "autoheal" : "update",
+				 heal ? heal_interval_seconds : cert_interval_seconds) > 0
+		&& fflush (conn) == 0 && fgets (buf, BUF_MAX, conn) != NULL;
+	fclose (conn);
+	if (!answered) {
+		warn ("no answer from resident worker");
+		return FALSE;
+	}
+	*status = atoi (buf);
+	return TRUE;
+}
+
+/*
+ * Seconds until the next update of this kind, as the worker wrote after
+ * the update it just ran, or 0 if it did not.
+ */
+static int
+read_next_delay (gboolean heal)
+{
+	char path[BUF_MAX];
+	snprintf (path, BUF_MAX, NEXT_RUN_FILE, heal ? "auto_attach" : "cert_check");
+	FILE *next_run_file = fopen (path, "r");
+	if (next_run_file == NULL) {
+		return 0;
+	}
+	int delay = 0;
+	if (fscanf (next_run_file, "%d", &delay) != 1 || delay < 0) {
+		delay = 0;
+	}
+	fclose (next_run_file);
+	unlink (path);
+	if (delay > MAX_DELAY_SECONDS) {
+		delay = MAX_DELAY_SECONDS;
+	}
+	return delay;
+}
+
+static gboolean
+cert_check (gboolean heal)
+{
+	int status = 0;
+	int interval = heal ? heal_interval_seconds : cert_interval_seconds;
+
+	if (!resident_worker || !resident_cert_check (heal, &status)) {
+		char interval_arg[BUF_MAX];
+		snprintf (interval_arg, BUF_MAX, "%d", interval);
+		int pid = fork ();
+		if (pid < 0) {
+			error ("fork failed");
+			exit (EXIT_FAILURE);
+		}
+		if (pid == 0) {
+			if (heal) {
+				execl (WORKER, WORKER_NAME, "--autoheal",
+				       "--interval", interval_arg, NULL);
+			} else {
+				execl (WORKER, WORKER_NAME,
+				       "--interval", interval_arg, NULL);
+			}
+			_exit (errno);
+		}
+		waitpid (pid, &status, 0);
+		status = WEXITSTATUS (status);
+	}
 
 	char *action = "Cert Check";
 	if (heal) {
@@ -208,8 +321,23 @@ cert_check (gboolean heal)
 		warn ("(%s) Update failed (%d), retry will occur on next run.",
 		      action, status);
 	}
-	//returning FALSE will unregister the timer, always return TRUE
-	return TRUE;
+
+	// With the adaptive schedule the worker tells us when to run next,
+	// otherwise it is the configured interval:
+	int delay = read_next_delay (heal);
+	if (delay <= 0) {
+		delay = interval;
+	}
+	debug ("(%s) Next run in %d second(s)", action, delay);
+	g_timeout_add (delay * 1000, (GSourceFunc) cert_check, GINT_TO_POINTER (heal));
+	// NB: we only use the cert check when calculating the next update
+	// time. This works for most users, since the cert_interval aligns with
+	// runs of heal_interval (i.e., heal_interval % cert_interval = 0)
+	if (!heal) {
+		log_update (delay);
+	}
+	//returning FALSE unregisters this timer, the next run has its own
+	return FALSE;
 }
 
 static gboolean
@@ -300,6 +428,9 @@ key_file_init_config (Config * config, GKeyFile * key_file)
 	else if (heal_frequency > 0) {
 		config->heal_interval_seconds = heal_frequency * 60;
     }
+
+	config->resident_worker = get_int_from_config_file (key_file, "rhsmcertd",
+						       "residentWorker");
 }
 
 void
@@ -342,6 +473,7 @@ get_config (int argc, char *argv[])
 	// Set the default values
 	config->cert_interval_seconds = DEFAULT_CERT_INTERVAL_SECONDS;
 	config->heal_interval_seconds = DEFAULT_HEAL_INTERVAL_SECONDS;
+	config->resident_worker = 0;
 
 	// Load configuration values from the configuration file
 	// which, if defined, will overwrite the current defaults.
@@ -422,8 +554,9 @@ main (int argc, char *argv[])
 
 	// Pull values from the config object so that we can free
 	// up its resources more reliably in case of error.
-	int cert_interval_seconds = config->cert_interval_seconds;
-	int heal_interval_seconds = config->heal_interval_seconds;
+	cert_interval_seconds = config->cert_interval_seconds;
+	heal_interval_seconds = config->heal_interval_seconds;
+	resident_worker = config->resident_worker > 0;
 	free (config);
 
 	daemon (0, 0);
@@ -438,6 +571,10 @@ main (int argc, char *argv[])
 	info ("Cert check interval: %.1f minute(s) [%d second(s)]",
 	      cert_interval_seconds / 60.0, cert_interval_seconds);
 
+	if (resident_worker) {
+		start_resident_worker ();
+	}
+
 	// note that we call the function directly first, before assigning a timer
 	// to it. Otherwise, it would only get executed when the timer went off, and
 	// not at startup.
@@ -454,25 +591,17 @@ main (int argc, char *argv[])
 				initial_delay, initial_delay / 60.0);
 	}
 
+	// Each check puts the next one of its kind on a timer when done, see
+	// cert_check.
 	bool heal = true;
 	g_timeout_add (initial_delay * 1000,
 		       (GSourceFunc) initial_cert_check, (gpointer) heal);
-	g_timeout_add (heal_interval_seconds * 1000,
-		       (GSourceFunc) cert_check, (gpointer) heal);
 
 	heal = false;
 	g_timeout_add (initial_delay * 1000,
 		       (GSourceFunc) initial_cert_check, (gpointer) heal);
-	g_timeout_add (cert_interval_seconds * 1000,
-		       (GSourceFunc) cert_check, (gpointer) heal);
 
-	// NB: we only use cert_interval_seconds when calculating the next update
-	// time. This works for most users, since the cert_interval aligns with
-	// runs of heal_interval (i.e., heal_interval % cert_interval = 0)
-	log_update (cert_interval_seconds);
-	g_timeout_add (cert_interval_seconds * 1000,
-		       (GSourceFunc) log_update,
-		       GINT_TO_POINTER (cert_interval_seconds));
+	log_update (initial_delay);
 
 	GMainLoop *main_loop = g_main_loop_new (NULL, FALSE);
 	g_main_loop_run (main_loop);
@@ -46,15 +46,19 @@ class ActionClient(base_action_client.BaseActionClient):
         self.installedprodlib = InstalledProductsActionInvoker()
         self.idcertlib = IdentityCertActionInvoker()
 
-        # WARNING: order is important here, we need to update a number
-        # of things before attempting to autoheal, and we need to autoheal
-        # before attempting to fetch our certificates:
+        # The reports come back in this order, the libs run at the same
+        # time as far as _get_dependencies() allows:
         lib_set = [self.entcertlib, self.idcertlib, self.content_client,
                    self.factlib, self.profilelib,
                    self.installedprodlib]
 
         return lib_set
 
+    def _get_dependencies(self):
+        # Repos can only be updated once we have the entitlement certs
+        # for them, the rest does not depend on each other:
+        return {self.content_client: [self.entcertlib]}
+
 
 class HealingActionClient(base_action_client.BaseActionClient):
     def _get_libset(self):
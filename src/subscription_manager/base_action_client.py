@@ -14,8 +14,14 @@
 # in this software or its documentation.
 #
 import logging
+import Queue
+import sys
+import threading
 
+from subscription_manager import certlib
 from subscription_manager import injection as inj
+from subscription_manager import instrumentation
+from subscription_manager import logutil
 
 from rhsm.connection import GoneException, ExpiredIdentityCertException
 
@@ -25,8 +31,24 @@ log = logging.getLogger('rhsm-app.' + __name__)
 class BaseActionClient(object):
     """
     An object used to update the certficates, yum repos, and facts for the system.
+
+    The libs of the libset run one at a time, in order, unless the
+    subclass says which of them depend on each other with
+    _get_dependencies(). Then libs run as soon as the libs they depend
+    on are done, up to max_workers at the same time.
     """
 
+    max_workers = 4
+    # Seconds between checks for a KeyboardInterrupt while libs run:
+    finished_poll = 0.5
+
+    # Injected singletons the libs share. Resolved before the libs run on
+    # several threads, so each of them is only created once:
+    shared_features = [inj.IDENTITY, inj.CP_PROVIDER, inj.PLUGIN_MANAGER,
+                       inj.ENT_DIR, inj.PROD_DIR, inj.ENTITLEMENT_STATUS_CACHE,
+                       inj.PROD_STATUS_CACHE, inj.OVERRIDE_STATUS_CACHE,
+                       inj.PROFILE_MANAGER, inj.INSTALLED_PRODUCTS_MANAGER]
+
     # can we inject both of these?
     def __init__(self, facts=None):
 
@@ -36,10 +58,20 @@ class BaseActionClient(object):
         self.lock = inj.require(inj.ACTION_LOCK)
         self.report = None
         self.update_reports = []
+        # The RunTiming of the last update, if timed:
+        self.timing = None
 
     def _get_libset(self):
         return []
 
+    def _get_dependencies(self):
+        """
+        Map of each lib in the libset to the libs it has to run after.
+        Libs which are not in it can run at any time. None runs the
+        libset in order.
+        """
+        return None
+
     def update(self, autoheal=False):
         """
         Update I{entitlement} certificates and corresponding
@@ -47,20 +79,30 @@ class BaseActionClient(object):
         @return: A list of update reports
         @rtype: list
         """
-        lock = self.lock
-
-        # TODO: move to using a lock context manager
+        self.timing = instrumentation.start_run(self.__class__.__name__)
+        # The libs join the hold on the lock we take here, rather than
+        # taking it again, see lock.LockSession:
+        locker = certlib.Locker(self.__class__.__name__, lock=self.lock)
         try:
-            lock.acquire()
-            self.update_reports = self._run_updates(autoheal)
+            self.update_reports = locker.run(lambda: self._run_updates(autoheal))
         finally:
-            lock.release()
+            if locker.wait_time is not None:
+                log.info("%s waited %.3fs for the action lock, held it %.3fs" %
+                         (self.__class__.__name__, locker.wait_time,
+                          locker.hold_time))
+            if self.timing:
+                self.timing.finish(locker.wait_time, locker.hold_time)
 
     def _run_update(self, lib):
         update_report = None
 
         try:
-            update_report = lib.update()
+            if self.timing:
+                (update_report, lib_timing) = self.timing.time_lib(lib, lib.update)
+                if isinstance(update_report, certlib.ActionReport):
+                    update_report.timing = lib_timing
+            else:
+                update_report = lib.update()
         # see bz#852706, reraise GoneException so that
         # consumer cert deletion works
         except GoneException, e:
@@ -78,6 +120,9 @@ class BaseActionClient(object):
         return update_report
 
     def _run_updates(self, autoheal):
+        dependencies = self._get_dependencies()
+        if dependencies is not None:
+            return self._run_concurrent_updates(list(self._libset), dependencies)
 
         update_reports = []
 
@@ -89,3 +134,101 @@ class BaseActionClient(object):
             update_reports.append(update_report)
 
         return update_reports
+
+    def _prepare_concurrent_updates(self):
+        """
+        Set up what the libs share in this thread, before they run on
+        others: the injected singletons, and the listings of the
+        certificate directories.
+        """
+        for feature in self.shared_features:
+            inj.require(feature)
+        inj.require(inj.ENT_DIR).list()
+        inj.require(inj.PROD_DIR).list()
+
+    def _run_concurrent_updates(self, libs, dependencies):
+        """
+        Run libs on up to max_workers threads, each once the libs it
+        depends on are done. Returns the reports in the order of libs.
+
+        GoneException and ExpiredIdentityCertException stop any more
+        libs from starting, and are raised once the running ones are
+        done.
+
+        What the libs log is logged from this thread, as each of them
+        finishes, see logutil.DeferredThreadLogging.
+        """
+        self._prepare_concurrent_updates()
+        deferred_logging = logutil.DeferredThreadLogging()
+        deferred_logging.start()
+        try:
+            return self._run_threads(libs, dependencies, deferred_logging)
+        finally:
+            deferred_logging.stop()
+
+    def _run_threads(self, libs, dependencies, deferred_logging):
+        positions = dict((id(lib), position) for (position, lib) in enumerate(libs))
+        waiting_for = []
+        for lib in libs:
+            waiting_for.append(set(positions[id(dependency)]
+                                   for dependency in dependencies.get(lib, [])
+                                   if id(dependency) in positions))
+
+        update_reports = [None] * len(libs)
+        pending = range(len(libs))
+        done = set()
+        running = {}
+        errors = []
+        finished = Queue.Queue()
+
+        def run(position):
+            try:
+                finished.put((position, self._run_update(libs[position]), None))
+            except Exception:
+                finished.put((position, None, sys.exc_info()))
+
+        while True:
+            if not errors:
+                for position in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    if waiting_for[position] <= done:
+                        pending.remove(position)
+                        log.debug("running lib: %s" % libs[position])
+                        thread = threading.Thread(target=run, args=(position,),
+                                name="ActionClient-%s" % position)
+                        thread.setDaemon(True)
+                        running[position] = thread
+                        deferred_logging.add_thread(thread)
+                        thread.start()
+            if not running:
+                break
+
+            (position, update_report, exc_info) = self._next_finished(finished)
+            running.pop(position).join()
+            deferred_logging.flush()
+            if exc_info:
+                errors.append((position, exc_info))
+            else:
+                update_reports[position] = update_report
+                done.add(position)
+
+        if errors:
+            exc_info = min(errors)[1]
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if pending:
+            log.warning("Not running libs with circular dependencies: %s" %
+                        [libs[waiting] for waiting in pending])
+        return update_reports
+
+    def _next_finished(self, finished):
+        """
+        Wait for the next lib to finish. A get() without a timeout can't
+        be interrupted on python 2, and would hold off a KeyboardInterrupt
+        until every lib is done.
+        """
+        while True:
+            try:
+                return finished.get(True, self.finished_poll)
+            except Queue.Empty:
+                pass
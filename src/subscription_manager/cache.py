@@ -19,16 +19,25 @@ this with the current state, and perform an update on the server if
 necessary.
 """
 
+import atexit
+import copy
 import gettext
+import hashlib
 import logging
 import os
 import socket
+from StringIO import StringIO
 import threading
+import time
 from M2Crypto import SSL
 
 from rhsm.config import initConfig
 import rhsm.connection as connection
 from rhsm.profile import get_profile, RPMProfile
+from subscription_manager import cachestore
+from subscription_manager.cachestore import DIGEST_SUFFIX, RPMDB_SUFFIX, \
+        VALIDATORS_SUFFIX
+from subscription_manager.cp_provider import response_request
 import subscription_manager.injection as inj
 from subscription_manager.jsonwrapper import PoolWrapper
 from rhsm import ourjson as json
@@ -37,9 +46,268 @@ _ = gettext.gettext
 log = logging.getLogger('rhsm-app.' + __name__)
 
 PACKAGES_RESOURCE = "packages"
+# Servers listing this resource accept package profile deltas, see
+# update_package_profile_delta():
+PACKAGES_DELTA_RESOURCE = "packages_delta"
 
 cfg = initConfig()
 
+# Seconds to wait after a cache write is queued before writing it out, so
+# writes of the same cache in quick succession only hit the disk once:
+WRITE_DELAY = 1
+
+RPMDB_DIR = "/var/lib/rpm"
+
+
+def content_digest(data):
+    """
+    SHA-256 of data as JSON with sorted keys, so equal data always has
+    the same digest.
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True)).hexdigest()
+
+
+def rpmdb_fingerprint(rpmdb_dir=RPMDB_DIR):
+    """
+    Cheap fingerprint of the rpmdb, from the size and mtime of its files,
+    which changes whenever packages are installed, updated or removed.
+    Returns None if there is no rpmdb to look at.
+    """
+    try:
+        names = os.listdir(rpmdb_dir)
+    except OSError:
+        return None
+
+    entries = []
+    for name in sorted(names):
+        # The Berkeley DB environment and sqlite shared memory files
+        # change on every read:
+        if name.startswith('__db.') or name.endswith('-shm') or \
+                name.startswith('.'):
+            continue
+        try:
+            file_stat = os.stat(os.path.join(rpmdb_dir, name))
+        except OSError:
+            continue
+        entries.append([name, file_stat.st_ino, file_stat.st_size,
+                        file_stat.st_mtime])
+    if not entries:
+        return None
+    return content_digest(entries)
+
+
+def package_profile_delta(old_packages, new_packages):
+    """
+    Packages added and removed between two lists of package dicts, as
+    returned by RPMProfile.collect().
+    """
+    old = dict((json.dumps(pkg, sort_keys=True), pkg) for pkg in old_packages)
+    new = dict((json.dumps(pkg, sort_keys=True), pkg) for pkg in new_packages)
+    added = [new[key] for key in sorted(set(new) - set(old))]
+    removed = [old[key] for key in sorted(set(old) - set(new))]
+    return (added, removed)
+
+
+def update_package_profile_delta(uep, consumer_uuid, added, removed):
+    """
+    Apply the packages added and removed since the last upload to the
+    consumer's package profile on the server.
+    """
+    method = "/consumers/%s/packages/delta" % uep.sanitize(consumer_uuid)
+    return uep.conn.request_post(method, {'added': added, 'removed': removed})
+
+
+# Response headers identifying a version of a resource, and the request
+# headers to send them back in:
+VALIDATOR_HEADERS = {
+    'etag': 'If-None-Match',
+    'last-modified': 'If-Modified-Since',
+}
+
+
+def supports_conditional_get(uep):
+    """
+    Whether conditional_get() can be used with the connection of uep.
+    Older versions of python-rhsm do not send extra request headers or
+    expose response headers.
+    """
+    return response_request(getattr(uep, 'conn', None)) is not None
+
+
+def conditional_get(uep, method, validators=None):
+    """
+    GET method from the server through the connection of uep, sending
+    the validators of an earlier response for the same resource so the
+    server can answer 304 Not Modified if it has not changed.
+
+    Returns (modified, content, validators), where content is the parsed
+    response body, or None if the resource was not modified, and
+    validators those to send the next time.
+    """
+    headers = {}
+    for (name, header) in VALIDATOR_HEADERS.items():
+        if validators and validators.get(name):
+            headers[header] = validators[name]
+
+    # Through the connection, so a response the ResponseCache holds
+    # answers it and CallStats counts it:
+    response = response_request(uep.conn)("GET", method, headers=headers)
+    response_headers = dict((name.lower(), value) for (name, value)
+                            in (response.get('headers') or {}).items())
+    new_validators = dict((name, response_headers[name])
+                          for name in VALIDATOR_HEADERS
+                          if response_headers.get(name))
+
+    if str(response['status']) == "304":
+        return (False, None, new_validators or validators)
+
+    content = None
+    if response['content']:
+        content = json.loads(response['content'])
+    return (True, content, new_validators)
+
+
+class CacheWriter(object):
+    """
+    Write-behind writer shared by all the CacheManagers.
+
+    Writes are queued by path and written out to the cache store by a
+    single background thread shortly after, all together. Writing the same cache again before that only
+    replaces the queued data. Anything still queued is written when the
+    process exits.
+    """
+
+    def __init__(self, delay=WRITE_DELAY):
+        self.delay = delay
+        self._pending = {}
+        self._pending_lock = threading.Condition()
+        # Held while writing, so flush() for a path waits for the
+        # background thread if it is in the middle of writing it:
+        self._write_lock = threading.RLock()
+        self._thread = None
+
+    def write(self, path, data, sidecars=None):
+        """
+        Queue data to be written to path as JSON. sidecars maps suffixes
+        from cachestore.SIDECAR_SUFFIXES to what to store next to it, ie.
+        the digest.
+        """
+        # Serialize now, so errors go to the caller and later changes
+        # to data don't end up in the cache:
+        contents = json.dumps(data)
+        self._pending_lock.acquire()
+        try:
+            self._pending[path] = (contents, sidecars or {})
+            if self._thread is None or not self._thread.isAlive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="CacheWriter")
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._pending_lock.notify()
+        finally:
+            self._pending_lock.release()
+
+    def is_pending(self, path):
+        return path in self._pending
+
+    def discard(self, path):
+        """
+        Drop any queued write for path, ie. when the cache is deleted.
+        """
+        self._write_lock.acquire()
+        try:
+            self._pending_lock.acquire()
+            try:
+                self._pending.pop(path, None)
+            finally:
+                self._pending_lock.release()
+        finally:
+            self._write_lock.release()
+
+    def flush(self, path=None, debug=True):
+        """
+        Write out anything queued for path, or everything if path is None.
+        """
+        self._write_lock.acquire()
+        try:
+            self._pending_lock.acquire()
+            try:
+                if path is None:
+                    writes = self._pending.items()
+                    self._pending = {}
+                elif path in self._pending:
+                    writes = [(path, self._pending.pop(path))]
+                else:
+                    writes = []
+            finally:
+                self._pending_lock.release()
+
+            if not writes:
+                return
+            failed = cachestore.get_store().write_many(
+                    [(cache_path, contents, sidecars)
+                     for (cache_path, (contents, sidecars)) in writes])
+            if debug:
+                failed_paths = [cache_path for (cache_path, e) in failed]
+                for (cache_path, pending) in writes:
+                    if cache_path not in failed_paths:
+                        log.debug("Wrote cache: %s" % cache_path)
+                for (cache_path, e) in failed:
+                    log.error("Unable to write cache: %s" % cache_path)
+                    log.exception(e)
+        finally:
+            self._write_lock.release()
+
+    def _run(self):
+        while True:
+            self._pending_lock.acquire()
+            try:
+                while not self._pending:
+                    self._pending_lock.wait()
+            finally:
+                self._pending_lock.release()
+            time.sleep(self.delay)
+            # Logging in this thread can cause a segfault, BZ 988861 and 988430
+            self.flush(debug=False)
+
+
+cache_writer = CacheWriter()
+atexit.register(cache_writer.flush)
+
+# Threads refreshing a StatusCache in the background, see
+# StatusCache._revalidate():
+_revalidations = set()
+_revalidations_lock = threading.Lock()
+
+# Seconds finish_revalidations() waits for them in all:
+REVALIDATION_EXIT_TIMEOUT = 5
+
+
+def finish_revalidations(timeout=REVALIDATION_EXIT_TIMEOUT):
+    """
+    Wait for the status caches being refreshed in the background. A
+    command which used a stale cache usually exits long before the
+    refresh would finish on its own, so this is done at exit.
+
+    Refreshes still running after timeout seconds, say because the
+    server does not answer, are abandoned and the caches left stale.
+    """
+    _revalidations_lock.acquire()
+    try:
+        threads = list(_revalidations)
+    finally:
+        _revalidations_lock.release()
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+        if thread.isAlive():
+            log.warn("Gave up waiting for %s to refresh the status cache" %
+                     thread.getName())
+
+# Registered after cache_writer.flush so it runs before it, and the
+# refreshed caches get written out:
+atexit.register(finish_revalidations)
+
 
 class CacheManager(object):
     """
@@ -52,6 +320,10 @@ class CacheManager(object):
     # Fields the subclass must override:
     CACHE_FILE = None
 
+    # Subclasses which set this store a digest of their data next to the
+    # cache, so has_changed() can tell without reading the cache back:
+    STORE_DIGEST = False
+
     def to_dict(self):
         """
         Returns the data for this collection as a dict to be serialized
@@ -79,51 +351,103 @@ class CacheManager(object):
         """
         raise NotImplementedError
 
+    def _digest_data(self, data):
+        """
+        The part of data that counts as a change, for digest().
+        """
+        return data
+
+    def digest(self, data):
+        """
+        Digest of data, as stored next to the cache.
+        """
+        return content_digest(self._digest_data(data))
+
+    def _sidecars(self, data):
+        """
+        What to store next to the cache when writing data, by suffix.
+        """
+        if self.STORE_DIGEST:
+            return {DIGEST_SUFFIX: self.digest(data)}
+        return {}
+
+    def _read_digest(self):
+        """
+        The digest stored with the cache, or None if there is none.
+        """
+        return self._read_sidecar(DIGEST_SUFFIX)
+
+    def _read_sidecar(self, suffix):
+        cache_writer.flush(self.CACHE_FILE)
+        try:
+            return cachestore.get_store().read_sidecar(self.CACHE_FILE, suffix)
+        except IOError:
+            return None
+
+    def _changed_from_digest(self, data, compare):
+        """
+        Check if data differs from the cache by comparing digests, without
+        reading the cache itself.
+
+        compare() is the full comparison against the cache, only used for
+        caches written before digests were stored. The digest is stored
+        alongside if nothing changed, so this only happens once.
+        """
+        digest = self.digest(data)
+        cached_digest = self._read_digest()
+        if cached_digest is not None:
+            return cached_digest != digest
+
+        changed = compare()
+        if not changed:
+            store = cachestore.get_store()
+            try:
+                if store.exists(self.CACHE_FILE):
+                    store.write_sidecar(self.CACHE_FILE, DIGEST_SUFFIX, digest)
+            except (IOError, OSError), e:
+                log.debug("Unable to write cache digest: %s" % e)
+        return changed
+
     @classmethod
     def delete_cache(cls):
         """ Delete the cache for this collection from disk. """
-        if os.path.exists(cls.CACHE_FILE):
+        cache_writer.discard(cls.CACHE_FILE)
+        if cachestore.get_store().delete(cls.CACHE_FILE):
             log.info("Deleting cache: %s" % cls.CACHE_FILE)
-            os.remove(cls.CACHE_FILE)
 
     def _cache_exists(self):
-        return os.path.exists(self.CACHE_FILE)
+        return cache_writer.is_pending(self.CACHE_FILE) or \
+                cachestore.get_store().exists(self.CACHE_FILE)
 
     def write_cache(self, debug=True):
         """
-        Write the current cache to disk. Should only be done after
-        successful communication with the server.
+        Queue the current cache to be written to disk. Should only be done
+        after successful communication with the server.
 
         The update_check method will call this for you if an update was
         required, but the method is exposed as some system data can be
         bundled up with the registration request, after which we need to
         manually write to disk.
+
+        The write happens in the background, see CacheWriter. Reading
+        the cache back through this class always sees it.
         """
-        # Logging in this method (when threaded) can cause a segfault, BZ 988861 and 988430
-        try:
-            if not os.access(os.path.dirname(self.CACHE_FILE), os.R_OK):
-                os.makedirs(os.path.dirname(self.CACHE_FILE))
-            f = open(self.CACHE_FILE, "w+")
-            json.dump(self.to_dict(), f)
-            f.close()
-            if debug:
-                log.debug("Wrote cache: %s" % self.CACHE_FILE)
-        except IOError, e:
-            if debug:
-                log.error("Unable to write cache: %s" %
-                        self.CACHE_FILE)
-                log.exception(e)
+        data = self.to_dict()
+        cache_writer.write(self.CACHE_FILE, data, self._sidecars(data))
+        if debug:
+            log.debug("Queued cache write: %s" % self.CACHE_FILE)
 
     def _read_cache(self):
         """
         Load the last data we sent to the server.
         Returns none if no cache file exists.
         """
+        cache_writer.flush(self.CACHE_FILE)
         try:
-            f = open(self.CACHE_FILE)
-            data = self._load_data(f)
-            f.close()
-            return data
+            contents = cachestore.get_store().read(self.CACHE_FILE)
+            if contents is None:
+                raise IOError("No cache: %s" % self.CACHE_FILE)
+            return self._load_data(StringIO(contents))
         except IOError:
             log.error("Unable to read cache: %s" % self.CACHE_FILE)
         except ValueError:
@@ -160,15 +484,185 @@ class StatusCache(CacheManager):
     """
     Unlike other cache managers, this one gets info from the server rather
     than sending it.
+
+    The cache on disk is used without asking the server while it is
+    younger than the TTL_OPTION setting, in seconds. For another
+    STALE_OPTION seconds after that it is still used, but refreshed from
+    the server in the background, or at the latest when the process
+    exits. Both default to 0, ie. always ask the server.
+
+    When asking the server, the ETag and Last-Modified of the response
+    the cache holds are sent along, so the server only has to send the
+    status again if it changed.
     """
+    # rhsm.conf options for the freshness window of the subclass:
+    TTL_OPTION = None
+    STALE_OPTION = None
+
     def __init__(self):
         self.server_status = None
         self.last_error = None
+        self.ttl = self._get_seconds(self.TTL_OPTION)
+        self.stale = self._get_seconds(self.STALE_OPTION)
+        # Validators of the response server_status came from:
+        self._validators = None
+        self._revalidating = None
+        # Bumped by expire() and by fetching from the server, so a
+        # background refresh started before does not write back what it
+        # fetched:
+        self._generation = 0
+        # Guards the state above against the background refresh:
+        self._lock = threading.RLock()
+
+    def _get_seconds(self, option):
+        if option and cfg.has_option('rhsm', option):
+            try:
+                return max(0, cfg.get_int('rhsm', option) or 0)
+            except ValueError:
+                log.warn("Ignoring invalid %s setting" % option)
+        return 0
+
+    def _cache_age(self):
+        """
+        Seconds since the cache was last written, or None if there is
+        no cache.
+        """
+        if cache_writer.is_pending(self.CACHE_FILE):
+            return 0
+        try:
+            mtime = cachestore.get_store().mtime(self.CACHE_FILE)
+        except IOError:
+            return None
+        if mtime is None:
+            return None
+        return time.time() - mtime
+
+    def expire(self):
+        """
+        Make the next load_status() ask the server, in this process or
+        any other. The cache is kept as a fallback while disconnected.
+        """
+        self._lock.acquire()
+        try:
+            self._generation += 1
+        finally:
+            self._lock.release()
+        cache_writer.flush(self.CACHE_FILE)
+        try:
+            cachestore.get_store().set_mtime(self.CACHE_FILE, 0)
+        except (IOError, OSError), e:
+            log.error("Unable to expire cache: %s" % self.CACHE_FILE)
+            log.exception(e)
+
+    def _sidecars(self, data):
+        sidecars = super(StatusCache, self)._sidecars(data)
+        if self._validators:
+            sidecars[VALIDATORS_SUFFIX] = json.dumps(self._validators)
+        return sidecars
+
+    def _read_validators(self):
+        validators = self._read_sidecar(VALIDATORS_SUFFIX)
+        if validators is None:
+            return None
+        try:
+            return json.loads(validators)
+        except ValueError:
+            return None
 
-    def load_status(self, uep, uuid):
+    def _conditional_get(self, uep, method, get):
+        """
+        Fetch the status at method from the server, only downloading it
+        if it changed since the response in the cache.
+
+        get() fetches it the normal way, for connections which cannot
+        send conditional requests.
+
+        Returns (modified, status). If the server did not send it again,
+        status is the one in the cache.
+        """
+        if not supports_conditional_get(uep):
+            self._validators = None
+            return (True, get())
+
+        (modified, status, self._validators) = conditional_get(uep, method,
+                self._read_validators())
+        if not modified:
+            status = super(StatusCache, self)._read_cache()
+            if status is None:
+                # The cache went away since we read the validators:
+                (modified, status, self._validators) = \
+                        conditional_get(uep, method)
+        return (modified, status)
+
+    def _revalidate(self, uep, uuid):
+        """
+        Refresh the cache from the server in a background thread,
+        finished by finish_revalidations() at the latest.
+        """
+        self._lock.acquire()
+        try:
+            if self._revalidating is not None and \
+                    self._revalidating.isAlive():
+                return
+            self._revalidating = threading.Thread(
+                    target=self._run_revalidate,
+                    args=(uep, uuid, self._generation),
+                    name="%sRevalidate" % self.__class__.__name__)
+            self._revalidating.setDaemon(True)
+        finally:
+            self._lock.release()
+        _revalidations_lock.acquire()
+        try:
+            _revalidations.add(self._revalidating)
+        finally:
+            _revalidations_lock.release()
+        self._revalidating.start()
+
+    def _run_revalidate(self, uep, uuid, generation):
+        # Logging in this thread can cause a segfault, BZ 988861 and 988430
+        try:
+            # Fetch into a copy, so the status the main thread is using
+            # only changes below, under the lock:
+            fresh = copy.copy(self)
+            fresh._sync_with_server(uep, uuid)
+            self._lock.acquire()
+            try:
+                if generation == self._generation:
+                    self.server_status = fresh.server_status
+                    self._validators = fresh._validators
+                    self.write_cache(debug=False)
+            finally:
+                self._lock.release()
+        except Exception, e:
+            self.last_error = e
+        _revalidations_lock.acquire()
+        try:
+            _revalidations.discard(threading.currentThread())
+        finally:
+            _revalidations_lock.release()
+
+    def _load_fresh(self, uep, uuid):
+        """
+        The cached status if it is fresh enough to use without waiting
+        for the server, otherwise None.
+        """
+        age = self._cache_age()
+        if age is None or age >= self.ttl + self.stale:
+            return None
+        status = self._read_cache()
+        if status is None:
+            return None
+        if age >= self.ttl:
+            self._revalidate(uep, uuid)
+        return status
+
+    def load_status(self, uep, uuid, force=False):
         """
         Load status from wherever is appropriate.
 
+        If the cache is within its freshness window, return it without
+        contacting the server, unless force is True.
+
         If server is reachable, return it's response
         and cache the results to disk.
 
@@ -177,11 +671,22 @@ class StatusCache(CacheManager):
 
         Returns None if we cannot reach the server, or use the cache.
         """
+        if not force and (self.ttl or self.stale):
+            status = self._load_fresh(uep, uuid)
+            if status is not None:
+                self.last_error = False
+                return status
+
         try:
-            self._sync_with_server(uep, uuid)
-            self.write_cache()
-            self.last_error = False
-            return self.server_status
+            self._lock.acquire()
+            try:
+                self._generation += 1
+                self._sync_with_server(uep, uuid)
+                self.write_cache()
+                self.last_error = False
+                return self.server_status
+            finally:
+                self._lock.release()
         except SSL.SSLError, ex:
             log.exception(ex)
             self.last_error = ex
@@ -237,9 +742,13 @@ class StatusCache(CacheManager):
         Prefer in memory cache to avoid io.  If it doesn't exist, save
         the disk cache to the in-memory cache to avoid reading again.
         """
-        if not self.server_status:
-            self.server_status = super(StatusCache, self)._read_cache()
-        return self.server_status
+        self._lock.acquire()
+        try:
+            if not self.server_status:
+                self.server_status = super(StatusCache, self)._read_cache()
+            return self.server_status
+        finally:
+            self._lock.release()
 
     def _cache_exists(self):
         """
@@ -250,18 +759,14 @@ class StatusCache(CacheManager):
             return True
         return super(StatusCache, self)._cache_exists()
 
-    def write_cache(self):
-        """
-        This is threaded because it should never block in runtime.
-        Writing to disk means it will be read from memory for the rest of this run.
-        """
-        threading.Thread(target=super(StatusCache, self).write_cache, args=[False], name="WriteCache%s" % self.__class__.__name__).start()
-        log.debug("Started thread to write cache: %s" % self.CACHE_FILE)
-
     # we override a @classmethod with an instance method in the sub class?
     def delete_cache(self):
         super(StatusCache, self).delete_cache()
-        self.server_status = None
+        self._lock.acquire()
+        try:
+            self.server_status = None
+        finally:
+            self._lock.release()
 
 
 class EntitlementStatusCache(StatusCache):
@@ -271,9 +776,13 @@ class EntitlementStatusCache(StatusCache):
     than sending it.
     """
     CACHE_FILE = "/var/lib/rhsm/cache/entitlement_status.json"
+    TTL_OPTION = "entitlement_status_cache_ttl"
+    STALE_OPTION = "entitlement_status_cache_stale"
 
     def _sync_with_server(self, uep, uuid):
-        self.server_status = uep.getCompliance(uuid)
+        method = "/consumers/%s/compliance" % uep.sanitize(uuid)
+        (modified, self.server_status) = self._conditional_get(uep, method,
+                lambda: uep.getCompliance(uuid))
 
 
 class ProductStatusCache(StatusCache):
@@ -281,11 +790,18 @@ class ProductStatusCache(StatusCache):
     Manages the system cache of installed product valid date ranges.
     """
     CACHE_FILE = "/var/lib/rhsm/cache/product_status.json"
+    TTL_OPTION = "product_status_cache_ttl"
+    STALE_OPTION = "product_status_cache_stale"
 
     def _sync_with_server(self, uep, uuid):
-        consumer_data = uep.getConsumer(uuid)
-
-        if 'installedProducts' not in consumer_data:
+        method = "/consumers/%s" % uep.sanitize(uuid)
+        (modified, consumer_data) = self._conditional_get(uep, method,
+                lambda: uep.getConsumer(uuid))
+
+        if not modified:
+            # The cache holds the installed products already:
+            self.server_status = consumer_data
+        elif 'installedProducts' not in consumer_data:
             log.warn("Server does not support product date ranges.")
         else:
             self.server_status = consumer_data['installedProducts']
@@ -296,9 +812,13 @@ class OverrideStatusCache(StatusCache):
     Manages the cache of yum repo overrides set on the server.
     """
     CACHE_FILE = "/var/lib/rhsm/cache/content_overrides.json"
+    TTL_OPTION = "content_overrides_cache_ttl"
+    STALE_OPTION = "content_overrides_cache_stale"
 
     def _sync_with_server(self, uep, consumer_uuid):
-        self.server_status = uep.getContentOverrides(consumer_uuid)
+        method = "/consumers/%s/content_overrides" % uep.sanitize(consumer_uuid)
+        (modified, self.server_status) = self._conditional_get(uep, method,
+                lambda: uep.getContentOverrides(consumer_uuid))
 
 
 # this is injected normally
@@ -307,6 +827,7 @@ class ProfileManager(CacheManager):
     Manages the profile of packages installed on this system.
     """
     CACHE_FILE = "/var/lib/rhsm/packages/packages.json"
+    STORE_DIGEST = True
 
     def __init__(self, current_profile=None):
 
@@ -314,6 +835,19 @@ class ProfileManager(CacheManager):
         # we're sure we actually need the data.
         self._current_profile = current_profile
         self._report_package_profile = cfg.get_int('rhsm', 'report_package_profile')
+        self._delta_upload = self._get_delta_upload()
+        self._delta_allowed = False
+        # Fingerprint of the rpmdb when the current profile was read:
+        self._rpmdb_fingerprint = None
+
+    def _get_delta_upload(self):
+        if not cfg.has_option('rhsm', 'package_profile_delta'):
+            return True
+        try:
+            return bool(cfg.get_int('rhsm', 'package_profile_delta'))
+        except ValueError, e:
+            log.warn(e)
+            return True
 
     # give tests a chance to use something other than RPMProfile
     def _get_profile(self, profile_type):
@@ -322,6 +856,9 @@ class ProfileManager(CacheManager):
     def _get_current_profile(self):
         # If we weren't given a profile, load the current systems packages:
         if not self._current_profile:
+            # Taken first, so a change while reading the rpmdb is
+            # noticed next time:
+            self._rpmdb_fingerprint = rpmdb_fingerprint()
             self._current_profile = self._get_profile('rpm')
         return self._current_profile
 
@@ -353,20 +890,77 @@ class ProfileManager(CacheManager):
             log.info("Skipping package profile upload due to report_package_profile setting.")
             return 0
 
+        # A forced update is for when the server may not have what we
+        # last sent, so the full profile has to go:
+        self._delta_allowed = not force
         return CacheManager.update_check(self, uep, consumer_uuid, force)
 
+    def _sidecars(self, data):
+        sidecars = super(ProfileManager, self)._sidecars(data)
+        if self._rpmdb_fingerprint is not None:
+            sidecars[RPMDB_SUFFIX] = self._rpmdb_fingerprint
+        return sidecars
+
+    def rpmdb_unchanged(self):
+        """
+        True if the rpmdb has not changed since the cached profile was
+        read from it, so there is no need to read it again.
+        """
+        fingerprint = rpmdb_fingerprint()
+        if fingerprint is None:
+            return False
+        return fingerprint == self._read_sidecar(RPMDB_SUFFIX)
+
+    def _digest_data(self, data):
+        # Package order doesn't matter, same as RPMProfile.__eq__:
+        return sorted(data, key=lambda pkg: json.dumps(pkg, sort_keys=True))
+
     def has_changed(self):
         if not self._cache_exists():
             log.info("Cache does not exist")
             return True
 
-        cached_profile = self._read_cache()
-        return not cached_profile == self.current_profile
+        def compare():
+            cached_profile = self._read_cache()
+            return not cached_profile == self.current_profile
+        return self._changed_from_digest(self.to_dict(), compare)
 
     def _sync_with_server(self, uep, consumer_uuid):
+        if self._delta_upload and self._delta_allowed and \
+                uep.supports_resource(PACKAGES_DELTA_RESOURCE):
+            if self._sync_delta(uep, consumer_uuid):
+                return
         uep.updatePackageProfile(consumer_uuid,
                 self.current_profile.collect())
 
+    def _sync_delta(self, uep, consumer_uuid):
+        """
+        Upload only the packages added and removed since the cached
+        profile. Returns False if the full profile needs to be uploaded
+        instead.
+        """
+        if not self._cache_exists():
+            return False
+        cached_profile = self._read_cache()
+        if cached_profile is None:
+            return False
+
+        packages = self.current_profile.collect()
+        (added, removed) = package_profile_delta(cached_profile.collect(),
+                                                 packages)
+        if len(added) + len(removed) >= len(packages):
+            return False
+
+        try:
+            update_package_profile_delta(uep, consumer_uuid, added, removed)
+        except connection.RestlibException, e:
+            log.warn("Unable to upload package profile changes, uploading "
+                     "the full profile: %s" % e)
+            return False
+        log.info("Uploaded package profile changes: %s added, %s removed" %
+                 (len(added), len(removed)))
+        return True
+
 
 class InstalledProductsManager(CacheManager):
     """
@@ -374,6 +968,7 @@ class InstalledProductsManager(CacheManager):
     last sent to the server.
     """
     CACHE_FILE = "/var/lib/rhsm/cache/installed_products.json"
+    STORE_DIGEST = True
 
     def __init__(self):
         self._installed = None
@@ -407,16 +1002,17 @@ class InstalledProductsManager(CacheManager):
             log.info("Cache does not exist")
             return True
 
-        cached = self._read_cache()
-
         self._setup_installed()
 
-        if len(cached.keys()) != len(self.installed.keys()):
-            return True
+        def compare():
+            cached = self._read_cache()
+            if len(cached.keys()) != len(self.installed.keys()):
+                return True
 
-        if cached != self.installed:
-            return True
-        return False
+            if cached != self.installed:
+                return True
+            return False
+        return self._changed_from_digest(self.installed, compare)
 
     def _setup_installed(self):
         """
@@ -447,47 +1043,125 @@ class InstalledProductsManager(CacheManager):
                 installed_products=self.format_for_server())
 
 
-class PoolTypeCache(object):
+class PoolTypeCache(CacheManager):
+    """
+    Types of the pools attached to this system, shown when listing
+    consumed subscriptions.
+
+    Kept on disk, so only pools attached since the last run have to be
+    looked up on the server. Pools which are no longer attached are
+    dropped on update().
+    """
+    CACHE_FILE = "/var/lib/rhsm/cache/pool_types.json"
+
+    # Up to this many missing pools are looked up one at a time, for
+    # more the whole entitlement list is fetched instead:
+    POOL_LOOKUP_LIMIT = 5
 
     def __init__(self):
         self.identity = inj.require(inj.IDENTITY)
         self.cp_provider = inj.require(inj.CP_PROVIDER)
         self.ent_dir = inj.require(inj.ENT_DIR)
         self.pooltype_map = {}
+        if self._cache_exists():
+            self.pooltype_map = self._read_cache() or {}
+        # Validators of the entitlement list pooltype_map was filled
+        # from, by request:
+        self._validators = {}
         self.update()
 
+    def to_dict(self):
+        return self.pooltype_map
+
+    def _load_data(self, open_file):
+        return json.loads(open_file.read()) or {}
+
     def get(self, pool_id):
         return self.pooltype_map.get(pool_id, '')
 
     def update(self):
-        if self.requires_update():
-            self._do_update()
+        attached_pool_ids = self._attached_pool_ids()
+        evicted = [pool_id for pool_id in self.pooltype_map
+                   if pool_id not in attached_pool_ids]
+        for pool_id in evicted:
+            del self.pooltype_map[pool_id]
 
-    def requires_update(self):
-        attached_pool_ids = set([ent.pool.id for ent in self.ent_dir.list()
-            if ent.pool and ent.pool.id])
         missing_types = attached_pool_ids - set(self.pooltype_map)
+        if missing_types:
+            self._do_update(missing_types)
+        if evicted or missing_types:
+            self.write_cache(debug=False)
+
+    def _attached_pool_ids(self):
+        return set([ent.pool.id for ent in self.ent_dir.list()
+            if ent.pool and ent.pool.id])
+
+    def requires_update(self):
+        missing_types = self._attached_pool_ids() - set(self.pooltype_map)
         return bool(missing_types)
 
-    def _do_update(self):
+    def _do_update(self, pool_ids=None):
+        """
+        Look up the types of pool_ids on the server, or of all attached
+        pools if None.
+        """
         result = {}
         if self.identity.is_valid():
             cp = self.cp_provider.get_consumer_auth_cp()
-            entitlement_list = []
-            try:
-                entitlement_list = cp.getEntitlementList(self.identity.uuid)
-            except Exception, e:
-                # In this case, return an empty map.  We just won't populate the field
-                log.debug('Problem attmepting to get entitlements from the server')
-                log.debug(e)
-
-            for ent in entitlement_list:
-                pool = PoolWrapper(ent.get('pool', {}))
+            if pool_ids is not None and len(pool_ids) <= self.POOL_LOOKUP_LIMIT:
+                pools = self._get_pools(cp, pool_ids)
+            else:
+                pools = [ent.get('pool', {})
+                         for ent in self._get_entitlements(cp)]
+
+            for pool_json in pools:
+                pool = PoolWrapper(pool_json)
                 pool_type = pool.get_pool_type()
                 result[pool.get_id()] = pool_type
 
         self.pooltype_map.update(result)
 
+    def _get_pools(self, cp, pool_ids):
+        pools = []
+        for pool_id in sorted(pool_ids):
+            try:
+                # The consumer is needed for the calculated attributes:
+                pools.append(cp.getPool(pool_id, self.identity.uuid))
+            except Exception, e:
+                # We just won't populate the field for this one
+                log.debug('Problem attempting to get pool %s from the server' %
+                          pool_id)
+                log.debug(e)
+        return pools
+
+    def _get_entitlements(self, cp):
+        try:
+            return self._get_entitlement_list(cp)
+        except Exception, e:
+            # In this case, return an empty map.  We just won't populate the field
+            log.debug('Problem attmepting to get entitlements from the server')
+            log.debug(e)
+            return []
+
+    def _get_entitlement_list(self, cp):
+        """
+        The entitlements of this system, or an empty list if they did
+        not change since the last time we got them.
+        """
+        if not supports_conditional_get(cp):
+            return cp.getEntitlementList(self.identity.uuid)
+
+        # Same request as getEntitlementList():
+        method = "/consumers/%s/entitlements" \
+                "?exclude=certificates.key&exclude=certificates.cert" % \
+                cp.sanitize(self.identity.uuid)
+        (modified, entitlement_list, self._validators[method]) = \
+                conditional_get(cp, method, self._validators.get(method))
+        if not modified:
+            # pooltype_map already has what the server would have sent
+            return []
+        return entitlement_list or []
+
     def update_from_pools(self, pool_map):
         # pool_map maps pool ids to pool json
         for pool_id in pool_map:
@@ -495,6 +1169,12 @@ class PoolTypeCache(object):
 
     def clear(self):
         self.pooltype_map = {}
+        self._validators = {}
+
+    # Like the status caches, the in memory map has to go as well:
+    def delete_cache(self):
+        super(PoolTypeCache, self).delete_cache()
+        self.clear()
 
 
 class WrittenOverrideCache(CacheManager):
@@ -522,3 +1202,23 @@ class WrittenOverrideCache(CacheManager):
             # ignore json file parse errors, we are going to generate
             # a new as if it didn't exist
             pass
+
+
+class UpdateRunCache(CacheManager):
+    """
+    When rhsmcertd last ran each kind of update, and what the certificate
+    directories looked like afterwards, see worker.UpdateSchedule.
+    """
+
+    CACHE_FILE = "/var/lib/rhsm/cache/rhsmcertd_runs.json"
+
+    def __init__(self):
+        self.runs = {}
+        if self._cache_exists():
+            self.runs = self._read_cache() or {}
+
+    def to_dict(self):
+        return self.runs
+
+    def _load_data(self, open_file):
+        return json.loads(open_file.read()) or {}
@@ -0,0 +1,449 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Storage backends for the local caches.
+
+Caches are named by the path of the JSON file they have always been
+written to, and hold the serialized JSON, plus small "sidecar" values
+stored next to it, ie. the digest of the data.
+
+FileStore keeps each cache in its own file, as before. SqliteStore keeps
+all of them in a single sqlite database instead, so several caches can
+be replaced in one transaction. It picks up the JSON files of any cache
+it does not have yet the first time that cache is used.
+
+The backend is chosen with cache_backend in the [rhsm] section of
+rhsm.conf.
+"""
+
+import logging
+import os
+import tempfile
+import time
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from rhsm.config import initConfig
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+cfg = initConfig()
+
+# Appended to the path of a cache for the files stored next to it, with
+# the digest of the data, the fingerprint of the rpmdb the package
+# profile was collected from, and the HTTP validators (ETag and
+# Last-Modified) of the server response a status cache holds:
+DIGEST_SUFFIX = ".digest"
+RPMDB_SUFFIX = ".rpmdb"
+VALIDATORS_SUFFIX = ".validators"
+SIDECAR_SUFFIXES = (DIGEST_SUFFIX, RPMDB_SUFFIX, VALIDATORS_SUFFIX)
+
+FILE_BACKEND = "json"
+SQLITE_BACKEND = "sqlite"
+
+CACHE_DB = "/var/lib/rhsm/cache.db"
+
+# Seconds to wait for another process to finish writing the database:
+LOCK_TIMEOUT = 30
+
+
+def write_atomically(path, contents):
+    """
+    Write contents to path via a temporary file renamed into place, so
+    readers (or a crash) never see a partially written file.
+    """
+    cache_dir = os.path.dirname(path)
+    if not os.access(cache_dir, os.R_OK):
+        os.makedirs(cache_dir)
+    mode = 0644
+    if os.path.exists(path):
+        mode = os.stat(path).st_mode & 0777
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s' % os.path.basename(path),
+                                    dir=cache_dir)
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            f.write(contents)
+            # Otherwise a crash can leave the renamed file empty:
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    _fsync_dir(cache_dir)
+
+
+def _fsync_dir(path):
+    """
+    Make a rename in directory path survive a crash.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError, e:
+        log.debug("Unable to open %s to sync it: %s" % (path, e))
+        return
+    try:
+        os.fsync(fd)
+    except OSError, e:
+        # Not every filesystem can sync a directory.
+        log.debug("Unable to sync %s: %s" % (path, e))
+    finally:
+        os.close(fd)
+
+
+def _read_file(path):
+    try:
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except IOError:
+        return None
+
+
+class FileStore(object):
+    """
+    Every cache in its own JSON file, with its sidecars in files next
+    to it.
+    """
+
+    def read(self, path):
+        """
+        The contents of the cache at path, or None if there is none.
+        """
+        return _read_file(path)
+
+    def read_sidecar(self, path, suffix):
+        contents = _read_file(path + suffix)
+        if contents is None:
+            return None
+        return contents.strip() or None
+
+    def write_sidecar(self, path, suffix, contents):
+        write_atomically(path + suffix, contents)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def mtime(self, path):
+        """
+        When the cache was last written, or None if there is none.
+        """
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def set_mtime(self, path, mtime):
+        if os.path.exists(path):
+            os.utime(path, (mtime, mtime))
+
+    def delete(self, path):
+        """
+        Delete the cache and its sidecars. Returns True if it existed.
+        """
+        existed = os.path.exists(path)
+        for file_path in [path] + [path + suffix for suffix in SIDECAR_SUFFIXES]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        return existed
+
+    def write(self, path, contents, sidecars=None):
+        """
+        Replace the cache at path with contents, and its sidecars with
+        sidecars, a dict keyed by suffix.
+        """
+        # Never leave a digest or fingerprint next to data it does not
+        # match:
+        for suffix in SIDECAR_SUFFIXES:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        write_atomically(path, contents)
+        for (suffix, sidecar) in (sidecars or {}).items():
+            write_atomically(path + suffix, sidecar)
+
+    def write_many(self, writes):
+        """
+        Write several (path, contents, sidecars) at once. Returns the
+        (path, error) of any that failed, the others are still written.
+        """
+        failed = []
+        for (path, contents, sidecars) in writes:
+            try:
+                self.write(path, contents, sidecars)
+            except (IOError, OSError), e:
+                failed.append((path, e))
+        return failed
+
+
+def _sqlite_errors(method):
+    """
+    Report sqlite errors as IOError, like the same failure in FileStore.
+    """
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except sqlite3.Error, e:
+            raise IOError(str(e))
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class SqliteStore(object):
+    """
+    All caches in one sqlite database.
+
+    Each write replaces the cache and its sidecars in a single
+    transaction. A connection is opened per operation, so the store can
+    be used from the CacheWriter thread and by several processes at once.
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS caches ("
+        "path TEXT PRIMARY KEY, contents TEXT NOT NULL, mtime REAL NOT NULL)",
+        # Held a row per top level key of each cache, no longer used:
+        "DROP TABLE IF EXISTS items",
+        "CREATE TABLE IF NOT EXISTS sidecars ("
+        "path TEXT NOT NULL, suffix TEXT NOT NULL, contents TEXT NOT NULL, "
+        "PRIMARY KEY (path, suffix))",
+    ]
+
+    def __init__(self, db_path=CACHE_DB):
+        self.db_path = db_path
+        self._files = FileStore()
+        self._created = False
+
+    def _connect(self):
+        if not self._created:
+            db_dir = os.path.dirname(self.db_path)
+            if not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+        conn = sqlite3.connect(self.db_path, timeout=LOCK_TIMEOUT)
+        conn.text_factory = str
+        if not self._created:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._created = True
+        return conn
+
+    def _has_cache(self, conn, path):
+        row = conn.execute("SELECT 1 FROM caches WHERE path = ?",
+                           (path,)).fetchone()
+        if row is not None:
+            return True
+        return self._migrate(conn, path)
+
+    def _migrate(self, conn, path):
+        """
+        Move the JSON file of a cache, and its sidecars, into the
+        database. Returns True if there was one.
+        """
+        contents = self._files.read(path)
+        if contents is None:
+            return False
+
+        sidecars = {}
+        for suffix in SIDECAR_SUFFIXES:
+            sidecar = self._files.read_sidecar(path, suffix)
+            if sidecar is not None:
+                sidecars[suffix] = sidecar
+        mtime = self._files.mtime(path) or time.time()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Someone else may have just done the same:
+            if conn.execute("SELECT 1 FROM caches WHERE path = ?",
+                            (path,)).fetchone() is None:
+                self._put(conn, path, contents, sidecars, mtime)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        log.info("Moved cache into %s: %s" % (self.db_path, path))
+        try:
+            self._files.delete(path)
+        except OSError, e:
+            log.debug("Unable to remove migrated cache %s: %s" % (path, e))
+        return True
+
+    def _put(self, conn, path, contents, sidecars, mtime):
+        conn.execute("DELETE FROM sidecars WHERE path = ?", (path,))
+        conn.execute("INSERT OR REPLACE INTO caches (path, contents, mtime) "
+                     "VALUES (?, ?, ?)", (path, contents, mtime))
+        conn.executemany("INSERT INTO sidecars (path, suffix, contents) "
+                         "VALUES (?, ?, ?)",
+                         [(path, suffix, sidecar)
+                          for (suffix, sidecar) in sidecars.items()])
+
+    @_sqlite_errors
+    def read(self, path):
+        """
+        The contents of the cache at path, or None if there is none.
+        """
+        conn = self._connect()
+        try:
+            if not self._has_cache(conn, path):
+                return None
+            row = conn.execute("SELECT contents FROM caches WHERE path = ?",
+                               (path,)).fetchone()
+            return row and row[0]
+        finally:
+            conn.close()
+
+    @_sqlite_errors
+    def read_sidecar(self, path, suffix):
+        conn = self._connect()
+        try:
+            if not self._has_cache(conn, path):
+                return None
+            row = conn.execute("SELECT contents FROM sidecars "
+                               "WHERE path = ? AND suffix = ?",
+                               (path, suffix)).fetchone()
+            return row and row[0]
+        finally:
+            conn.close()
+
+    @_sqlite_errors
+    def write_sidecar(self, path, suffix, contents):
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO sidecars (path, suffix, contents) "
+                         "VALUES (?, ?, ?)", (path, suffix, contents))
+            conn.commit()
+        finally:
+            conn.close()
+
+    @_sqlite_errors
+    def exists(self, path):
+        conn = self._connect()
+        try:
+            return self._has_cache(conn, path)
+        finally:
+            conn.close()
+
+    @_sqlite_errors
+    def mtime(self, path):
+        """
+        When the cache was last written, or None if there is none.
+        """
+        conn = self._connect()
+        try:
+            if not self._has_cache(conn, path):
+                return None
+            row = conn.execute("SELECT mtime FROM caches WHERE path = ?",
+                               (path,)).fetchone()
+            return row and row[0]
+        finally:
+            conn.close()
+
+    @_sqlite_errors
+    def set_mtime(self, path, mtime):
+        conn = self._connect()
+        try:
+            if self._has_cache(conn, path):
+                conn.execute("UPDATE caches SET mtime = ? WHERE path = ?",
+                             (mtime, path))
+                conn.commit()
+        finally:
+            conn.close()
+
+    @_sqlite_errors
+    def delete(self, path):
+        """
+        Delete the cache and its sidecars. Returns True if it existed.
+        """
+        # Also drop a JSON file we never got around to migrating:
+        existed = self._files.delete(path)
+        conn = self._connect()
+        try:
+            cursor = conn.execute("DELETE FROM caches WHERE path = ?", (path,))
+            existed = existed or cursor.rowcount > 0
+            conn.execute("DELETE FROM sidecars WHERE path = ?", (path,))
+            conn.commit()
+        finally:
+            conn.close()
+        return existed
+
+    def write(self, path, contents, sidecars=None):
+        """
+        Replace the cache at path with contents, and its sidecars with
+        sidecars, a dict keyed by suffix.
+        """
+        failed = self.write_many([(path, contents, sidecars)])
+        if failed:
+            raise failed[0][1]
+
+    def write_many(self, writes):
+        """
+        Write several (path, contents, sidecars) in one transaction.
+        Returns the (path, error) of every write if it failed.
+        """
+        try:
+            conn = self._connect()
+            try:
+                mtime = time.time()
+                try:
+                    for (path, contents, sidecars) in writes:
+                        self._put(conn, path, contents, sidecars or {}, mtime)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            finally:
+                conn.close()
+        except (sqlite3.Error, IOError, OSError), e:
+            return [(path, IOError(str(e))) for (path, contents, sidecars) in writes]
+        return []
+
+
+_store = None
+
+
+def _create_store():
+    backend = FILE_BACKEND
+    if cfg.has_option('rhsm', 'cache_backend'):
+        backend = cfg.get('rhsm', 'cache_backend').strip() or FILE_BACKEND
+
+    if backend == SQLITE_BACKEND:
+        if sqlite3 is not None:
+            return SqliteStore()
+        log.warn("sqlite3 is not available, storing caches as JSON files.")
+    elif backend != FILE_BACKEND:
+        log.warn("Unknown cache_backend %s, storing caches as JSON files." %
+                 backend)
+    return FileStore()
+
+
+def get_store():
+    """
+    The cache store configured in rhsm.conf.
+    """
+    global _store
+    if _store is None:
+        _store = _create_store()
+    return _store
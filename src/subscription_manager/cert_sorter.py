@@ -13,10 +13,8 @@
 #
 
 from copy import copy
-from datetime import datetime
 import logging
 
-from rhsm.certificate import GMT
 from rhsm.connection import RestlibException
 import subscription_manager.injection as inj
 
@@ -108,6 +106,9 @@ class ComplianceManager(object):
 
         self.valid_entitlement_certs = []
 
+        # DateRangeIndex of the entitlement certs scanned for status:
+        self._date_index = None
+
         self._parse_server_status()
 
     def get_compliance_status(self):
@@ -211,30 +212,24 @@ class ComplianceManager(object):
         unknown_products = dict((k, v) for (k, v) in self.installed_products.items()
                                 if k not in self.valid_products.keys()
                                 and k not in self.partially_valid_products.keys())
-        ent_certs = self.entitlement_dir.list()
-
-        on_date = datetime.now(GMT())
-        for ent_cert in ent_certs:
-
-            # Builds the list of valid entitlement certs today:
-            if ent_cert.is_valid():
-                self.valid_entitlement_certs.append(ent_cert)
-
-            for product in ent_cert.products:
-                if product.id in unknown_products.keys():
-                    # If the entitlement starts after the date we're checking, we
-                    # consider this a future entitlement. Technically it could be
-                    # partially stacked on that date, but we cannot determine that
-                    # without recursively cert sorting again on that date.
-                    if ent_cert.valid_range.begin() > on_date:
-                        product_dict = self.future_products
-                    # Check if entitlement has already expired:
-                    elif ent_cert.valid_range.end() < on_date:
-                        product_dict = self.expired_products
-                    else:
-                        continue
-
-                    product_dict.setdefault(product.id, []).append(ent_cert)
+        date_index = self.entitlement_dir.get_date_index()
+        self._date_index = date_index
+
+        # Builds the list of valid entitlement certs on the date we're
+        # checking:
+        self.valid_entitlement_certs = date_index.valid(self.on_date)
+
+        # If the entitlement starts after the date we're checking, we
+        # consider this a future entitlement. Technically it could be
+        # partially stacked on that date, but we cannot determine that
+        # without recursively cert sorting again on that date.
+        for (product_dict, ent_certs) in \
+                ((self.future_products, date_index.future(self.on_date)),
+                 (self.expired_products, date_index.expired(self.on_date))):
+            for ent_cert in ent_certs:
+                for product in ent_cert.products:
+                    if product.id in unknown_products:
+                        product_dict.setdefault(product.id, []).append(ent_cert)
 
     def get_system_status(self):
         return STATUS_MAP.get(self.system_status, STATUS_MAP['unknown'])
@@ -274,10 +269,9 @@ class ComplianceManager(object):
             return UNKNOWN
 
     def in_warning_period(self):
-        for entitlement in self.valid_entitlement_certs:
-            if entitlement.is_expiring():
-                return True
-        return False
+        if self._date_index is None:
+            return False
+        return len(self._date_index.in_warning_period(self.on_date)) > 0
 
     # Assumes classic and identity validity have been tested
     def get_status_for_icon(self):
@@ -368,11 +362,11 @@ class CertSorter(ComplianceManager):
         self.on_change()
 
     def on_prod_dir_changed(self):
-        self.product_dir.refresh()
+        self.product_dir.refresh(incremental=True)
         self.update_product_manager()
 
     def on_ent_dir_changed(self):
-        self.entitlement_dir.refresh()
+        self.entitlement_dir.refresh(incremental=True)
 
     def on_identity_changed(self):
         self.identity.reload()
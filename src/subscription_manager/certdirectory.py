@@ -18,9 +18,13 @@
 import gettext
 import logging
 import os
+import threading
 
 from rhsm.certificate import Key, create_from_file
 from rhsm.config import initConfig
+from subscription_manager.certindex import CertificateIndex, file_stat_key, \
+        locked, parse_cert_files
+from subscription_manager.dateindex import DateRangeIndex
 from subscription_manager.injection import require, ENT_DIR
 
 log = logging.getLogger('rhsm-app.' + __name__)
@@ -29,6 +33,23 @@ _ = gettext.gettext
 
 cfg = initConfig()
 
+# Don't bother starting worker processes for less certificates than this:
+PARALLEL_PARSE_MIN = 20
+
+
+def get_parse_workers():
+    """
+    Number of processes to parse certificates with when there are many
+    not yet in the certificate index. 0 or 1 parses them one at a time.
+    """
+    if not cfg.has_option('rhsm', 'cert_parse_workers'):
+        return 0
+    try:
+        return cfg.get_int('rhsm', 'cert_parse_workers') or 0
+    except ValueError, e:
+        log.warn(e)
+        return 0
+
 
 class Directory(object):
 
@@ -99,77 +120,205 @@ class CertificateDirectory(Directory):
 
     KEY = 'key.pem'
 
+    # File to keep the parsed certificate index in, or None to always
+    # parse every certificate:
+    INDEX_PATH = None
+
     def __init__(self, path):
         super(CertificateDirectory, self).__init__(path)
         self.create()
         self._listing = None
+        # Maps the path of each listed certificate to the stat key it
+        # had when loaded, and the certificate itself:
+        self._loaded = {}
+        # Held while the listing is (re)built, the libs of an action
+        # client can use the directory from several threads:
+        self._lock = threading.RLock()
+        # (listing, product map, stacking id map), see _get_lookup_maps:
+        self._lookup_maps = None
+        # (listing, serial map), see get_serial_map:
+        self._serial_map = None
+        # Validity index for the current listing, see get_date_index:
+        self._date_index = None
+        self._index = None
+        if self.INDEX_PATH:
+            self._index = CertificateIndex(Path.abs(self.INDEX_PATH))
+        self.parse_workers = get_parse_workers()
+
+    @locked
+    def refresh(self, incremental=False):
+        """
+        Invalidate the cached listing.
 
-    def refresh(self):
-        # simply clear the cache. the next list() will reload.
-        self._listing = None
+        By default the next list() reloads every certificate. With
+        incremental, the directory is rescanned right away, and only
+        certificates which were added or changed since the last listing
+        are loaded. Removed certificates are dropped, everything else
+        keeps the certificate object it already had.
+        """
+        if incremental and self._listing is not None:
+            self._listing = self._scan()
+        else:
+            # simply clear the cache. the next list() will reload.
+            self._listing = None
+            self._loaded = {}
 
+    @locked
     def list(self):
-        if self._listing is not None:
-            return self._listing
-        listing = []
+        if self._listing is None:
+            self._listing = self._scan()
+        return self._listing
+
+    def _scan(self):
+        """
+        Build a listing of the certificates in this directory, re-using
+        anything in self._loaded whose file has not changed.
+        """
+        found = []
         for p, fn in Directory.list(self):
             if not fn.endswith('.pem') or fn.endswith(self.KEY):
                 continue
             path = self.abspath(fn)
-            listing.append(create_from_file(path))
-        self._listing = listing
-        return listing
+            try:
+                found.append((path, os.stat(path)))
+            except OSError:
+                # Removed since we listed the directory.
+                continue
 
-    def list_valid(self):
-        valid = []
-        for c in self.list():
-            if c.is_valid():
-                valid.append(c)
-        return valid
+        loaded = {}
+        to_parse = []
+        for path, file_stat in found:
+            stat_key = file_stat_key(file_stat)
+            previous = self._loaded.get(path)
+            if previous is not None and previous[0] == stat_key:
+                loaded[path] = previous
+                continue
+
+            cert = None
+            if self._index:
+                cert = self._index.get(path, file_stat)
+            if cert is None:
+                to_parse.append((path, file_stat))
+            else:
+                loaded[path] = (stat_key, cert)
+
+        parsed = self._parse_certs([path for (path, file_stat) in to_parse])
+        for (path, file_stat), cert in zip(to_parse, parsed):
+            if self._index:
+                self._index.add(path, file_stat, cert)
+            loaded[path] = (file_stat_key(file_stat), cert)
 
-    def list_expired(self):
-        expired = []
-        for c in self.list():
-            if c.is_expired():
-                expired.append(c)
-        return expired
+        if self._index:
+            self._index.prune(loaded.keys())
+            self._index.save()
+
+        self._loaded = loaded
+        return [loaded[path][1] for (path, file_stat) in found]
+
+    def _parse_certs(self, paths):
+        """
+        Parse the certificates at paths, in a pool of worker processes if
+        enabled and there are enough of them to be worth it.
+        """
+        if self.parse_workers > 1 and len(paths) >= PARALLEL_PARSE_MIN:
+            try:
+                return parse_cert_files(paths, self.parse_workers)
+            except (OSError, IOError), e:
+                # ie. no /dev/shm for the pool to use
+                log.warn("Unable to parse certificates in parallel: %s" % e)
+        return [create_from_file(path) for path in paths]
+
+    def list_valid(self, on_date=None):
+        return self.get_date_index().valid(on_date)
+
+    def list_expired(self, on_date=None):
+        return self.get_date_index().expired(on_date)
+
+    def get_date_index(self):
+        """
+        Returns a DateRangeIndex over the current listing, for looking up
+        which certificates are valid, expired or expiring on a date.
+        Like the lookup maps it is built once per listing.
+        """
+        listing = self.list()
+        if listing is not self._listing:
+            return DateRangeIndex(listing)
+        if self._date_index is None or self._date_index.certs is not listing:
+            self._date_index = DateRangeIndex(listing)
+        return self._date_index
 
     def find(self, sn):
-        # TODO: could optimize to just load SERIAL.pem? Maybe not in all cases.
-        for c in self.list():
-            if c.serial == sn:
-                return c
-        return None
+        return self.get_serial_map().get(sn)
+
+    def get_serial_map(self):
+        """
+        Returns a dict mapping serial number to certificate for the
+        current listing. This is shared, callers must not modify it.
+
+        Built once per listing, separately from the product maps: the serials
+        are kept in the certificate index as they are, so unlike the
+        products nothing has to be decoded for them.
+        """
+        listing = self.list()
+        if listing is not self._listing:
+            return self._build_serial_map(listing)
+        if self._serial_map is None or self._serial_map[0] is not listing:
+            self._serial_map = (listing, self._build_serial_map(listing))
+        return self._serial_map[1]
+
+    def _build_serial_map(self, listing):
+        serial_map = {}
+        for cert in listing:
+            serial_map[cert.serial] = cert
+        return serial_map
+
+    def _get_lookup_maps(self):
+        """
+        Return a map of product ID to the certificates providing it, and
+        a map of stacking ID to the certificates in that stack.
+
+        These are built once per listing, a refresh() that changes the
+        listing causes them to be rebuilt on next use.
+        """
+        listing = self.list()
+        if listing is not self._listing:
+            # list() is overridden (ie. in tests) and may change under
+            # us, so there is nothing safe to cache against.
+            return self._build_lookup_maps(listing)
+        if self._lookup_maps is None or self._lookup_maps[0] is not listing:
+            self._lookup_maps = (listing,) + self._build_lookup_maps(listing)
+        return self._lookup_maps[1:]
+
+    def _build_lookup_maps(self, listing):
+        product_map = {}
+        stack_map = {}
+        for cert in listing:
+            for product in cert.products:
+                product_map.setdefault(product.id, []).append(cert)
+            order = getattr(cert, 'order', None)
+            if order and order.stacking_id:
+                stack_map.setdefault(order.stacking_id, []).append(cert)
+        return product_map, stack_map
 
     def find_all_by_product(self, p_hash):
-        certs = set()
+        product_map, stack_map = self._get_lookup_maps()
+        certs = set(product_map.get(p_hash, []))
+
+        # Complete any stacks that provide our product
         providing_stack_ids = set()
-        stack_id_map = {}
-        for c in self.list():
-            for p in c.products:
-                if p.id == p_hash:
-                    certs.add(c)
-                    # Keep track of stacks that provide our product
-                    if (c.order and c.order.stacking_id):
-                        providing_stack_ids.add(c.order.stacking_id)
-
-            # Keep track of stack ids in case we need them later.  avoids another loop
-            if (c.order and c.order.stacking_id):
-                if c.order.stacking_id not in stack_id_map:
-                    stack_id_map[c.order.stacking_id] = set()
-                stack_id_map[c.order.stacking_id].add(c)
-
-        # Complete
+        for c in certs:
+            if c.order and c.order.stacking_id:
+                providing_stack_ids.add(c.order.stacking_id)
         for stack_id in providing_stack_ids:
-            certs |= stack_id_map[stack_id]
+            certs.update(stack_map[stack_id])
 
         return list(certs)
 
     def find_by_product(self, p_hash):
-        for c in self.list():
-            for p in c.products:
-                if p.id == p_hash:
-                    return c
+        product_map = self._get_lookup_maps()[0]
+        certs = product_map.get(p_hash)
+        if certs:
+            return certs[0]
         return None
 
     #Set up an alias for backwards compatibility
@@ -179,6 +328,7 @@ class CertificateDirectory(Directory):
 class ProductDirectory(CertificateDirectory):
 
     PATH = cfg.get('rhsm', 'productCertDir')
+    INDEX_PATH = '/var/lib/rhsm/cache/product_cert_index.json'
 
     def __init__(self):
         super(ProductDirectory, self).__init__(self.PATH)
@@ -208,6 +358,7 @@ class ProductDirectory(CertificateDirectory):
 class EntitlementDirectory(CertificateDirectory):
 
     PATH = cfg.get('rhsm', 'entitlementCertDir')
+    INDEX_PATH = '/var/lib/rhsm/cache/entitlement_cert_index.json'
     PRODUCT = 'product'
 
     @classmethod
@@ -243,17 +394,16 @@ class EntitlementDirectory(CertificateDirectory):
             cert_writer.write(key, cert)
         return True
 
-    def list_valid(self):
+    def list_valid(self, on_date=None):
         valid = []
-        for c in self.list():
+        for c in self.get_date_index().valid(on_date):
 
             # If something is amiss with the key for this certificate, consider
             # it invalid:
             if not self._check_key(c):
                 continue
 
-            if c.is_valid():
-                valid.append(c)
+            valid.append(c)
 
         return valid
 
@@ -262,12 +412,8 @@ class EntitlementDirectory(CertificateDirectory):
         Returns all entitlement certificates providing access to the given
         product ID.
         """
-        entitlements = []
-        for cert in self.list():
-            for cert_product in cert.products:
-                if product_id == cert_product.id:
-                    entitlements.append(cert)
-        return entitlements
+        product_map = self._get_lookup_maps()[0]
+        return list(product_map.get(product_id, []))
 
 
 class Path:
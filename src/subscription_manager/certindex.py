@@ -0,0 +1,442 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Persistent index of parsed certificates.
+
+Parsing a certificate means reading the PEM, walking its x509 extensions
+and, for v3 entitlement certificates, decompressing and decoding the JSON
+payload. CertificateDirectory uses this index to skip all of that for
+files which have not changed since the last time they were parsed.
+
+Entries are keyed on the certificate path, and are only used if the
+inode, size and mtime of the file still match what was recorded.
+
+The products and content sets of a certificate are kept JSON encoded,
+both in the index and on the certificates rebuilt from it, and are only
+decoded the first time they are used. Most callers only look at the
+serial, validity range or order, and the content sets are by far the
+largest part of a v3 entitlement certificate.
+"""
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from rhsm.certificate import create_from_file
+from rhsm.certificate2 import EntitlementCertificate, ProductCertificate, \
+        Product, Order, Content, Pool, Version
+from rhsm import ourjson as json
+
+from subscription_manager.isodate import parse_date
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+# Bump this whenever the layout of an entry changes, older indexes
+# are then thrown away and rebuilt.
+INDEX_VERSION = 2
+
+ENTITLEMENT = "entitlement"
+PRODUCT = "product"
+
+PRODUCT_FIELDS = ('id', 'name', 'version', 'architectures', 'provided_tags',
+                  'brand_type', 'brand_name')
+
+ORDER_FIELDS = ('name', 'number', 'sku', 'subscription', 'quantity',
+                'virt_limit', 'socket_limit', 'contract', 'quantity_used',
+                'warning_period', 'account', 'provides_management',
+                'service_level', 'service_type', 'stacking_id', 'virt_only',
+                'ram_limit', 'core_limit')
+
+CONTENT_FIELDS = ('content_type', 'name', 'label', 'vendor', 'url', 'gpg',
+                  'enabled', 'metadata_expire', 'required_tags', 'arches')
+
+
+def file_stat_key(file_stat):
+    """
+    The part of an os.stat() result we use to decide if a certificate
+    file has changed since it was indexed.
+    """
+    return [file_stat.st_ino, file_stat.st_size, file_stat.st_mtime]
+
+
+def _fields_to_dict(obj, fields):
+    # Only record what this version of python-rhsm actually has, so
+    # the same dict can be fed back into the constructor.
+    return dict((field, getattr(obj, field)) for field in fields
+                if hasattr(obj, field))
+
+
+def _content_to_dict(content):
+    data = _fields_to_dict(content, CONTENT_FIELDS)
+    # Content only accepts 0/1 style values for enabled:
+    data['enabled'] = content.enabled and "1" or "0"
+    return data
+
+
+def _encode_products(products):
+    return json.dumps([_fields_to_dict(p, PRODUCT_FIELDS) for p in products])
+
+
+def _decode_products(encoded):
+    if encoded is None:
+        return []
+    return [Product(**_str_keys(p)) for p in json.loads(encoded)]
+
+
+def _encode_content(content):
+    return json.dumps([_content_to_dict(c) for c in content])
+
+
+def _decode_content(encoded):
+    if encoded is None:
+        return None
+    return [Content(**_str_keys(c)) for c in json.loads(encoded)]
+
+
+def _encoded_field(cert, attr, encode):
+    # Hand back what we were built from if it was never decoded, rather
+    # than decoding it just to encode it again.
+    encoded = cert.__dict__.get('_encoded', {})
+    if attr in encoded:
+        return encoded[attr]
+    value = getattr(cert, attr)
+    if value is None:
+        return None
+    return encode(value)
+
+
+def cert_to_dict(cert):
+    """
+    Flatten a product or entitlement certificate into a JSON friendly
+    dict. Returns None for any other kind of certificate.
+    """
+    if isinstance(cert, EntitlementCertificate):
+        cert_type = ENTITLEMENT
+    elif isinstance(cert, ProductCertificate):
+        cert_type = PRODUCT
+    else:
+        return None
+
+    data = {'type': cert_type,
+            'version': str(cert.version),
+            'serial': cert.serial,
+            'start': cert.valid_range.begin().isoformat(),
+            'end': cert.valid_range.end().isoformat(),
+            'subject': cert.subject,
+            'products': _encoded_field(cert, 'products', _encode_products)}
+
+    if cert_type == ENTITLEMENT:
+        data['order'] = None
+        data['content'] = _encoded_field(cert, 'content', _encode_content)
+        data['pool'] = None
+        if cert.order:
+            data['order'] = _fields_to_dict(cert.order, ORDER_FIELDS)
+        if cert.pool:
+            data['pool'] = {'id': cert.pool.id}
+
+    return data
+
+
+def _str_keys(data):
+    # Keyword arguments can't be unicode on python 2.
+    return dict((str(key), value) for (key, value) in data.items())
+
+
+def cert_from_dict(data, path):
+    """
+    Rebuild a certificate object from a dict created by cert_to_dict.
+    """
+    kwargs = {'path': path,
+              'version': Version(str(data['version'])),
+              'serial': data['serial'],
+              'start': parse_date(data['start']),
+              'end': parse_date(data['end']),
+              'subject': data['subject']}
+
+    if data['type'] == PRODUCT:
+        cert = IndexedProductCertificate(**kwargs)
+    else:
+        order = None
+        pool = None
+        if data['order'] is not None:
+            order = Order(**_str_keys(data['order']))
+        if data['pool'] is not None:
+            pool = Pool(id=data['pool']['id'])
+        cert = IndexedEntitlementCertificate(order=order, pool=pool, **kwargs)
+        _set_encoded(cert, 'content', data['content'])
+
+    _set_encoded(cert, 'products', data['products'])
+    return cert
+
+
+def _set_encoded(cert, attr, encoded):
+    cert.__dict__.setdefault('_encoded', {})[attr] = encoded
+    cert.__dict__.get('_decoded', {}).pop(attr, None)
+
+
+def is_decoded(cert, attr):
+    """
+    True unless attr of an indexed certificate is still waiting to be
+    decoded.
+    """
+    return attr not in cert.__dict__.get('_encoded', {})
+
+
+def _lazy_property(attr, decode):
+    """
+    Property for a field of an indexed certificate which is kept JSON
+    encoded until it is first used.
+    """
+    def getter(self):
+        decoded = self.__dict__.setdefault('_decoded', {})
+        if attr in decoded:
+            return decoded[attr]
+        encoded = self.__dict__.get('_encoded', {})
+        if attr not in encoded and attr in decoded:
+            # Another thread decoded it since we looked.
+            return decoded[attr]
+        # Only drop the encoded value once the decoded one is in place,
+        # so other threads see one or the other. If two threads decode
+        # at once, both use whichever result was stored first:
+        value = decoded.setdefault(attr, decode(encoded.get(attr)))
+        encoded.pop(attr, None)
+        return value
+
+    def setter(self, value):
+        self.__dict__.setdefault('_decoded', {})[attr] = value
+        self.__dict__.get('_encoded', {}).pop(attr, None)
+
+    return property(getter, setter)
+
+
+def _raw_property(attr):
+    """
+    Property for the raw x509 data of an indexed certificate, read back
+    from the certificate file the first time it is asked for.
+    """
+    def getter(self):
+        raw = self.__dict__.setdefault('_raw', {})
+        if attr not in raw:
+            cert = create_from_file(self.path)
+            raw['x509'] = cert.x509
+            raw['pem'] = getattr(cert, 'pem', None)
+            raw['extensions'] = getattr(cert, 'extensions', None)
+        return raw[attr]
+
+    def setter(self, value):
+        # The constructors set these to None, which just means we
+        # have not loaded them yet.
+        if value is not None:
+            self.__dict__.setdefault('_raw', {})[attr] = value
+
+    return property(getter, setter)
+
+
+class IndexedProductCertificate(ProductCertificate):
+    """
+    A product certificate rebuilt from the certificate index.
+    """
+    x509 = _raw_property('x509')
+    pem = _raw_property('pem')
+    products = _lazy_property('products', _decode_products)
+
+
+class IndexedEntitlementCertificate(EntitlementCertificate):
+    """
+    An entitlement certificate rebuilt from the certificate index.
+    """
+    x509 = _raw_property('x509')
+    pem = _raw_property('pem')
+    extensions = _raw_property('extensions')
+    products = _lazy_property('products', _decode_products)
+    content = _lazy_property('content', _decode_content)
+
+
+def _parse_in_worker(path):
+    """
+    Runs in a pool worker process. Certificate objects wrap the C level
+    x509 struct and can't be pickled, so send back the flattened dict
+    instead. Anything that goes wrong is left for the parent to parse,
+    and report, itself.
+    """
+    try:
+        return cert_to_dict(create_from_file(path))
+    except (Exception, SystemExit):
+        return None
+
+
+def parse_cert_files(paths, workers):
+    """
+    Parse the certificate files at paths using a pool of worker
+    processes. Certificates are returned in the same order as paths.
+    """
+    pool = multiprocessing.Pool(workers)
+    try:
+        chunksize = max(1, len(paths) // (workers * 4))
+        results = pool.map(_parse_in_worker, paths, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+    certs = []
+    for path, data in zip(paths, results):
+        if data is None:
+            certs.append(create_from_file(path))
+        else:
+            certs.append(cert_from_dict(data, path))
+    return certs
+
+
+def locked(method):
+    """
+    Hold the _lock of the instance while method runs.
+    """
+    def wrapper(self, *args, **kwargs):
+        self._lock.acquire()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._lock.release()
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class CertificateIndex(object):
+    """
+    On disk index of the decoded certificates in a CertificateDirectory.
+
+    The index file is read lazily, and only written back by save() if
+    something was added or removed. It can be used from several threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            f = open(self.path)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            # Just start over, we'll write a good index on save.
+            log.debug("Ignoring unreadable certificate index %s: %s" %
+                      (self.path, e))
+            self._dirty = True
+            return
+
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+            log.debug("Discarding outdated certificate index: %s" % self.path)
+            self._dirty = True
+            return
+
+        self._entries = data.get('certificates') or {}
+
+    @locked
+    def get(self, cert_path, file_stat):
+        """
+        Return the indexed certificate for cert_path, or None if it is
+        not indexed or the file has changed since.
+        """
+        self._load()
+        entry = self._entries.get(cert_path)
+        if entry is None or entry.get('stat') != file_stat_key(file_stat):
+            return None
+
+        try:
+            return cert_from_dict(entry['cert'], cert_path)
+        except Exception, e:
+            log.debug("Bad certificate index entry for %s: %s" %
+                      (cert_path, e))
+            self.remove(cert_path)
+            return None
+
+    @locked
+    def add(self, cert_path, file_stat, cert):
+        """
+        Record a freshly parsed certificate.
+        """
+        self._load()
+        data = cert_to_dict(cert)
+        if data is None:
+            return
+        self._entries[cert_path] = {'stat': file_stat_key(file_stat),
+                                    'cert': data}
+        self._dirty = True
+
+    @locked
+    def remove(self, cert_path):
+        self._load()
+        if self._entries.pop(cert_path, None) is not None:
+            self._dirty = True
+
+    @locked
+    def prune(self, cert_paths):
+        """
+        Drop entries for any certificate not in cert_paths.
+        """
+        self._load()
+        for cert_path in set(self._entries) - set(cert_paths):
+            self.remove(cert_path)
+
+    @locked
+    def save(self):
+        """
+        Write the index to disk if it has changed.
+
+        The index is only an optimization, so failing to write it is
+        logged and otherwise ignored.
+        """
+        if not self._dirty:
+            return
+
+        index_dir = os.path.dirname(self.path)
+        try:
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            fd, tmp_path = tempfile.mkstemp(prefix='.cert_index', dir=index_dir)
+            f = os.fdopen(fd, 'w')
+            try:
+                json.dump({'version': INDEX_VERSION,
+                           'certificates': self._entries}, f)
+            finally:
+                f.close()
+            os.rename(tmp_path, self.path)
+            self._dirty = False
+        except (IOError, OSError), e:
+            log.debug("Unable to write certificate index %s: %s" %
+                      (self.path, e))
+
+    @locked
+    def delete(self):
+        self._entries = {}
+        self._dirty = False
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,22 +1,44 @@
 
 import logging
+import time
 
 from subscription_manager import injection as inj
+from subscription_manager import instrumentation
 
 log = logging.getLogger('rhsm-app.' + __name__)
 
 
 class Locker(object):
+    """
+    Runs actions holding the action lock.
 
-    def __init__(self):
-        self.lock = self._get_lock()
+    Keeps how long the last action waited for the lock and held it, in
+    seconds, and adds them to the ActionReport the action returns.
+    """
+
+    def __init__(self, name=None, lock=None):
+        self.name = name or "action"
+        self.lock = lock or self._get_lock()
+        self.wait_time = None
+        self.hold_time = None
 
     def run(self, action):
+        start = time.time()
         self.lock.acquire()
+        acquired = time.time()
+        result = None
         try:
-            return action()
+            result = action()
+            return result
         finally:
             self.lock.release()
+            self.wait_time = acquired - start
+            self.hold_time = time.time() - acquired
+            log.debug("%s waited %.3fs for the action lock, held it %.3fs" %
+                      (self.name, self.wait_time, self.hold_time))
+            if isinstance(result, ActionReport):
+                result.lock_wait = self.wait_time
+                result.lock_hold = self.hold_time
 
     def _get_lock(self):
         return inj.require(inj.ACTION_LOCK)
@@ -24,11 +46,23 @@ class Locker(object):
 
 class BaseActionInvoker(object):
     def __init__(self):
-        self.locker = Locker()
+        self.locker = Locker(self.__class__.__name__)
         self.report = None
 
     def update(self):
-        self.report = self.locker.run(self._do_update)
+        # Timed as a run of its own, unless part of an action client's:
+        timing = instrumentation.start_run(self.__class__.__name__)
+        if timing is None:
+            self.report = self.locker.run(self._do_update)
+            return self.report
+
+        try:
+            (self.report, lib_timing) = timing.time_lib(self,
+                    lambda: self.locker.run(self._do_update))
+            if isinstance(self.report, ActionReport):
+                self.report.timing = lib_timing
+        finally:
+            timing.finish(self.locker.wait_time, self.locker.hold_time)
         return self.report
 
     def _do_update(self):
@@ -40,6 +74,14 @@ class ActionReport(object):
     """Base class for cert lib and action reports"""
     name = "Report"
 
+    # Not all reports call __init__, these are set on the report once it
+    # is returned.
+    # Seconds spent waiting for and holding the action lock, see Locker:
+    lock_wait = None
+    lock_hold = None
+    # How long the lib took, see instrumentation.RunTiming:
+    timing = None
+
     def __init__(self):
         self._status = None
         self._exceptions = []
@@ -62,13 +104,27 @@ class ActionReport(object):
         if self._exceptions:
             print self.format_exceptions()
 
+    def format_lock_times(self):
+        if self.lock_wait is None:
+            return ''
+        return "waited %.3fs, held %.3fs" % (self.lock_wait, self.lock_hold)
+
+    def format_timing(self):
+        if self.timing is None:
+            return ''
+        return str(self.timing)
+
     def __str__(self):
         template = """%(report_name)s
         status: %(status)s
         updates: %(updates)s
         exceptions: %(exceptions)s
+        action lock: %(lock_times)s
+        timing: %(timing)s
         """
         return template % {'report_name': self.name,
                            'status': self._status,
                            'updates': self._updates,
-                           'exceptions': self.format_exceptions()}
+                           'exceptions': self.format_exceptions(),
+                           'lock_times': self.format_lock_times(),
+                           'timing': self.format_timing()}
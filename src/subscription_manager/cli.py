@@ -68,23 +68,57 @@ class AbstractCLICommand(object):
         raise NotImplementedError("Commands must implement: _do_command(self)")
 
 
+class LazyCommand(object):
+    """
+    Stands in for a command until it runs. The CLI lists and finds it by
+    the name, aliases, short description and primary flag given here,
+    only running it imports module_name and creates its class_name, so
+    the other commands and what they import are never loaded.
+    """
+    def __init__(self, name, module_name, class_name, shortdesc=None,
+                 primary=False, aliases=None):
+        self.name = name
+        self.module_name = module_name
+        self.class_name = class_name
+        self.shortdesc = shortdesc
+        self.primary = primary
+        self.aliases = aliases or []
+        self._command = None
+
+    def load(self):
+        """ The command itself, created the first time it is needed. """
+        if self._command is None:
+            module = __import__(self.module_name, {}, {}, [self.class_name])
+            self._command = getattr(module, self.class_name)()
+        return self._command
+
+    def main(self, args=None):
+        return self.load().main(args)
+
+
 # taken wholseale from rho...
 class CLI:
 
-    def __init__(self, command_classes=None):
+    def __init__(self, command_classes=None, commands=None):
+        """
+        Commands are either given as command_classes, which are all
+        created up front, or as commands, which can be LazyCommands.
+        """
         command_classes = command_classes or []
         self.cli_commands = {}
         self.cli_aliases = {}
         for clazz in command_classes:
-            cmd = clazz()
-            # ignore the base class
-            if cmd.name != "cli":
-                self.cli_commands[cmd.name] = cmd
-                for alias in cmd.aliases:
-                    self.cli_aliases[alias] = cmd
+            self._add_command(clazz())
+        for cmd in commands or []:
+            self._add_command(cmd)
 
     def _add_command(self, cmd):
+        # ignore the base class
+        if cmd.name == "cli":
+            return
         self.cli_commands[cmd.name] = cmd
+        for alias in cmd.aliases:
+            self.cli_aliases[alias] = cmd
 
     def _default_command(self):
         self._usage()
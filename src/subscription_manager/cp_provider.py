@@ -12,8 +12,178 @@
 # in this software or its documentation.
 #
 
+import copy
+import functools
+import inspect
+import logging
+import threading
+
 from subscription_manager.identity import ConsumerIdentity
+from subscription_manager import instrumentation
 import rhsm.connection as connection
+from rhsm import ourjson as json
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+# Request headers which only make a GET conditional, so an earlier whole
+# response is still an answer to it:
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+
+def response_request(conn):
+    """
+    A function making requests through conn, the Restlib of a
+    UEPConnection, which returns the whole response with its status and
+    headers, rather than just the parsed content like conn._request.
+    None if the python-rhsm in use cannot send extra request headers or
+    return the response headers.
+
+    The function is kept on conn as request_response, so the wrappers
+    put on conn, like those of ResponseCache and CallStats, see these
+    requests too.
+    """
+    base_restlib = getattr(connection, 'BaseRestLib', None)
+    if base_restlib is None or not isinstance(conn, base_restlib):
+        return None
+    if 'request_response' not in conn.__dict__:
+        if 'headers' not in inspect.getargspec(base_restlib._request)[0]:
+            return None
+        conn.request_response = functools.partial(base_restlib._request, conn)
+    return conn.request_response
+
+
+def _content(response):
+    # What Restlib._request makes of a response:
+    if not response['content']:
+        return None
+    return json.loads(response['content'])
+
+
+class ResponseCache(object):
+    """
+    Responses to the GET requests made through the connections of a
+    CPProvider, so reading the same thing from the server more than once
+    in a command or rhsmcertd run only goes to the network the first
+    time. Any other request empties it, as it may change what the server
+    would answer.
+
+    Does nothing until enabled, long running processes like the GUI
+    should keep asking the server.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.hits = 0
+        self._responses = {}
+        # Bumped by every write, so a GET which was already on its way
+        # does not store what the server answered before it:
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._generation += 1
+            self._responses.clear()
+        finally:
+            self._lock.release()
+
+    def wrap(self, conn, name):
+        """
+        Send the requests of conn, the Restlib of a UEPConnection,
+        through this cache. name tells the responses of connections
+        with different authentication apart.
+
+        Plain and conditional GETs share the whole responses, kept for
+        the request_response of conn, see response_request(). Without
+        it only the parsed content of plain GETs is kept.
+        """
+        request_response = response_request(conn)
+        if request_response is not None:
+            conn.request_response = self._caching_response(
+                    request_response, name)
+        conn.request_get = self._caching(conn, conn.request_get, name)
+        for request in ('request_post', 'request_put', 'request_delete'):
+            setattr(conn, request, self._invalidating(getattr(conn, request)))
+
+    def _lookup(self, key):
+        """
+        Returns (response, generation), response None if there is none.
+        """
+        self._lock.acquire()
+        try:
+            if key in self._responses:
+                self.hits += 1
+                log.debug("Reusing response to GET %s" % key[1])
+                return (copy.deepcopy(self._responses[key]), None)
+            return (None, self._generation)
+        finally:
+            self._lock.release()
+
+    def _store(self, key, response, generation):
+        self._lock.acquire()
+        try:
+            if generation == self._generation:
+                self._responses[key] = copy.deepcopy(response)
+        finally:
+            self._lock.release()
+
+    def _caching(self, conn, request_get, name):
+
+        def cached_request_get(method, *args, **kwargs):
+            # Requests with extra headers are left alone:
+            if not self.enabled or args or kwargs:
+                return request_get(method, *args, **kwargs)
+
+            if 'request_response' in conn.__dict__:
+                return _content(conn.request_response("GET", method))
+
+            key = (name, method)
+            (response, generation) = self._lookup(key)
+            if generation is None:
+                return response
+            response = request_get(method)
+            self._store(key, response, generation)
+            return response
+
+        return cached_request_get
+
+    def _caching_response(self, request_response, name):
+        invalidating_request = self._invalidating(request_response)
+
+        def cached_request_response(request_type, method, info=None,
+                                    headers=None):
+            if request_type != "GET":
+                return invalidating_request(request_type, method, info=info,
+                                            headers=headers)
+            if not self.enabled or [header for header in (headers or {})
+                                    if header not in CONDITIONAL_HEADERS]:
+                return request_response(request_type, method, info=info,
+                                        headers=headers)
+
+            key = (name, method)
+            (response, generation) = self._lookup(key)
+            if generation is None:
+                return response
+            response = request_response(request_type, method, info=info,
+                                        headers=headers)
+            # A 304 Not Modified only answers this conditional GET:
+            if str(response['status']) == "200":
+                self._store(key, response, generation)
+            return response
+
+        return cached_request_response
+
+    def _invalidating(self, request):
+
+        def invalidating_request(*args, **kwargs):
+            self.clear()
+            try:
+                return request(*args, **kwargs)
+            finally:
+                self.clear()
+
+        return invalidating_request
 
 
 class CPProvider(object):
@@ -28,6 +198,10 @@ class CPProvider(object):
     basic_auth_cp: also called admin_auth uses a username/password
     no_auth_cp: no authentication
     content_connection: ent cert based auth connection to cdn
+
+    GET responses of the candlepin connections are reused once
+    cache_responses() was called, see ResponseCache. With action timing
+    enabled, call_stats counts and times the requests which are not.
     """
 
     consumer_auth_cp = None
@@ -37,6 +211,10 @@ class CPProvider(object):
 
     # Initialize with default connection info from the config file
     def __init__(self):
+        self.response_cache = ResponseCache()
+        self.call_stats = None
+        if instrumentation.timing_enabled():
+            self.call_stats = instrumentation.CallStats()
         self.set_connection_info()
 
     # Reread the config file and prefer arguments over config values
@@ -72,6 +250,7 @@ class CPProvider(object):
         self.username = username
         self.password = password
         self.basic_auth_cp = None
+        self.response_cache.clear()
 
     # set up info for the connection to the cdn for finding release versions
     def set_content_connection_info(self, cdn_hostname=None, cdn_port=None):
@@ -84,6 +263,22 @@ class CPProvider(object):
         self.consumer_auth_cp = None
         self.basic_auth_cp = None
         self.no_auth_cp = None
+        self.response_cache.clear()
+
+    # Reuse the responses to identical GET requests, up to the next
+    # request which is not a GET, for the rest of this command or
+    # rhsmcertd run.
+    def cache_responses(self):
+        self.response_cache.enabled = True
+
+    def _wrap(self, conn, name):
+        # Set up first, so both wrappers see the requests made with it:
+        response_request(conn)
+        # Timed inside the response cache, so reused responses are not
+        # counted:
+        if self.call_stats:
+            self.call_stats.wrap(conn)
+        self.response_cache.wrap(conn, name)
 
     def get_consumer_auth_cp(self):
         if not self.consumer_auth_cp:
@@ -93,6 +288,7 @@ class CPProvider(object):
                     proxy_user=self.proxy_user,
                     proxy_password=self.proxy_password,
                     cert_file=self.cert_file, key_file=self.key_file)
+            self._wrap(self.consumer_auth_cp.conn, 'consumer_auth')
         return self.consumer_auth_cp
 
     def get_basic_auth_cp(self):
@@ -104,6 +300,7 @@ class CPProvider(object):
                     proxy_password=self.proxy_password,
                     username=self.username,
                     password=self.password)
+            self._wrap(self.basic_auth_cp.conn, 'basic_auth')
         return self.basic_auth_cp
 
     def get_no_auth_cp(self):
@@ -113,6 +310,7 @@ class CPProvider(object):
                     proxy_port=self.proxy_port,
                     proxy_user=self.proxy_user,
                     proxy_password=self.proxy_password)
+            self._wrap(self.no_auth_cp.conn, 'no_auth')
         return self.no_auth_cp
 
     def get_content_connection(self):
@@ -0,0 +1,164 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Index of certificate validity ranges.
+
+Answers which certificates in a listing are valid, expired, not yet
+valid, or close to expiring on a given date. A binary search over one
+of the sorted begin, end or warning period dates narrows a query down
+to the certificates on the right side of that date, only those are
+then checked against the other dates.
+
+Expired, future and expiring certificates are usually few, and so are
+the certificates checked for them. Valid certificates are usually
+most of them, and so a valid() query checks about as many
+certificates as it returns.
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from rhsm.certificate import GMT
+
+
+def _gmt(on_date=None):
+    """
+    The date to check against, the same way Certificate.is_valid()
+    interprets on_date.
+    """
+    if on_date is None:
+        on_date = datetime.utcnow()
+    return on_date.replace(tzinfo=GMT())
+
+
+class _SortedCerts(object):
+    """
+    Certificates sorted on a date, with the dates in a parallel list to
+    bisect on.
+    """
+
+    def __init__(self, entries):
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self.dates = [entry[0] for entry in entries]
+        self.positions = [entry[1] for entry in entries]
+
+    def not_after(self, date):
+        """ Positions of certificates with a date on or before date. """
+        return self.positions[:bisect_right(self.dates, date)]
+
+    def before(self, date):
+        """ Positions of certificates with a date before date. """
+        return self.positions[:bisect_left(self.dates, date)]
+
+    def after(self, date):
+        """ Positions of certificates with a date after date. """
+        return self.positions[bisect_right(self.dates, date):]
+
+    def not_before(self, date):
+        """ Positions of certificates with a date on or after date. """
+        return self.positions[bisect_left(self.dates, date):]
+
+    def between(self, start, end):
+        """ Positions of certificates with start <= date < end. """
+        return self.positions[bisect_left(self.dates, start):
+                              bisect_left(self.dates, end)]
+
+
+class DateRangeIndex(object):
+    """
+    Begin, end and warning period dates of the certificates in a
+    listing, each sorted. A query costs a binary search, plus checking
+    the certificates on one side of its date, see the module docstring.
+
+    Every query returns certificates in the order of the listing the
+    index was built from. on_date defaults to now, and is treated the
+    same as Certificate.is_valid(on_date) treats it.
+    """
+
+    def __init__(self, certs):
+        self.certs = certs
+        # Begin date, end date and warning period start of each cert, by
+        # position in the listing:
+        self._begin_dates = []
+        self._end_dates = []
+        self._warning_dates = []
+        for cert in certs:
+            self._begin_dates.append(cert.valid_range.begin())
+            self._end_dates.append(cert.valid_range.end())
+            warning_date = None
+            order = getattr(cert, 'order', None)
+            if order is not None:
+                # Same as EntitlementCertificate.is_expiring():
+                warning_days = timedelta(days=int(order.warning_period))
+                warning_date = cert.valid_range.end() - warning_days
+            self._warning_dates.append(warning_date)
+
+        positions = range(len(certs))
+        self._begins = _SortedCerts(zip(self._begin_dates, positions))
+        self._ends = _SortedCerts(zip(self._end_dates, positions))
+        self._warnings = _SortedCerts([(warning, position)
+                for (position, warning) in enumerate(self._warning_dates)
+                if warning is not None])
+
+    def _certs_at(self, positions):
+        return [self.certs[position] for position in sorted(positions)]
+
+    def _started(self, positions, date):
+        return [p for p in positions if self._begin_dates[p] <= date]
+
+    def _not_ended(self, positions, date):
+        return [p for p in positions if self._end_dates[p] >= date]
+
+    def valid(self, on_date=None):
+        """
+        Certificates valid on on_date.
+        """
+        date = _gmt(on_date)
+        # Check whichever of not ended and started is fewer:
+        not_ended = self._ends.not_before(date)
+        started = self._begins.not_after(date)
+        if len(not_ended) <= len(started):
+            return self._certs_at(self._started(not_ended, date))
+        return self._certs_at(self._not_ended(started, date))
+
+    def expired(self, on_date=None):
+        """
+        Certificates which ended before on_date.
+        """
+        return self._certs_at(self._ends.before(_gmt(on_date)))
+
+    def future(self, on_date=None):
+        """
+        Certificates which only become valid after on_date.
+        """
+        return self._certs_at(self._begins.after(_gmt(on_date)))
+
+    def expiring_within(self, days, on_date=None):
+        """
+        Certificates valid on on_date which end less than days after it.
+        """
+        date = _gmt(on_date)
+        window = self._ends.between(date, date + timedelta(days=days))
+        return self._certs_at(self._started(window, date))
+
+    def in_warning_period(self, on_date=None):
+        """
+        Entitlement certificates valid on on_date which are inside the
+        warning period of their order, ie. is_expiring(on_date).
+        """
+        date = _gmt(on_date)
+        warned = self._warnings.before(date)
+        return self._certs_at(self._started(self._not_ended(warned, date), date))
@@ -137,7 +137,8 @@ class EntCertUpdateAction(object):
             # the 'attach' cli instead of an ActionClient. So
             # we need to refresh the ent_dir object before calling
             # content updating actions.
-            self.ent_dir.refresh()
+            self.ent_dir.refresh(incremental=True)
+            self.status_hook()
             self.repo_hook()
 
             # NOTE: Since we have the yum repos defined here now
@@ -168,6 +169,11 @@ class EntCertUpdateAction(object):
         brands_installer = rhelentbranding.RHELBrandsInstaller()
         brands_installer.install()
 
+    def status_hook(self):
+        """Make the next status check ask the server about the new certs."""
+        inj.require(inj.ENTITLEMENT_STATUS_CACHE).expire()
+        inj.require(inj.PROD_STATUS_CACHE).expire()
+
     def repo_hook(self):
         """Update content repos."""
         log.debug("entcerlibaction.repo_hook")
@@ -186,6 +192,7 @@ class EntCertUpdateAction(object):
 
     def _find_rogue_serials(self, local, expected):
         """Find serials we have locally but are not on the server."""
+        expected = set(expected)
         rogue = [local[sn] for sn in local if not sn in expected]
         return rogue
 
@@ -205,17 +212,15 @@ class EntCertUpdateAction(object):
                                  (product.name))
 
     def _get_local_serials(self):
-        local = {}
         #certificates in grace period were being renamed everytime.
         #this makes sure we don't try to re-write certificates in
         #grace period
         # XXX since we don't use grace period, this might not be needed
-        self.ent_dir.refresh()
+        self.ent_dir.refresh(incremental=True)
         for valid in self.ent_dir.list():
-            sn = valid.serial
-            self.report.valid.append(sn)
-            local[sn] = valid
-        return local
+            self.report.valid.append(valid.serial)
+        # NOTE: shared with ent_dir, treat as read only
+        return self.ent_dir.get_serial_map()
 
     def get_certificate_serials_list(self):
         """Query RHSM API for list of expected ent cert serial numbers."""
@@ -268,7 +273,7 @@ class EntCertUpdateAction(object):
             print gettext.ngettext("%s local certificate has been deleted.",
                                    "%s local certificates have been deleted.",
                                    rogue_count) % rogue_count
-            self.ent_dir.refresh()
+            self.ent_dir.refresh(incremental=True)
 
 
 class EntitlementCertBundlesInstaller(object):
@@ -379,6 +384,7 @@ class EntCertUpdateReport(certlib.ActionReport):
     name = "Entitlement Cert Updates"
 
     def __init__(self):
+        super(EntCertUpdateReport, self).__init__()
         self.valid = []
         self.expected = []
         self.added = []
@@ -424,4 +430,6 @@ class EntCertUpdateReport(certlib.ActionReport):
         s.append(_('Expected (UEP) serial# %s') % self.expected)
         self.write(s, _('Added (new)'), self.added)
         self.write(s, _('Deleted (rogue):'), self.rogue)
+        if self.timing:
+            s.append('Timing: %s' % self.format_timing())
         return '\n'.join(s)
@@ -23,6 +23,7 @@ _ = gettext.gettext
 from rhsm import connection, utils
 
 from subscription_manager.entcertlib import Disconnected
+from subscription_manager.lock import LockTimeout
 
 SOCKET_MESSAGE = _('Network error, unable to connect to server. Please see /var/log/rhsm/rhsm.log for more information.')
 NETWORK_MESSAGE = _('Network error. Please check the connection details, or see /var/log/rhsm/rhsm.log for more information.')
@@ -37,6 +38,7 @@ PERROR_JUST_SCHEME_MESSAGE = _("Server URL is just a schema. Should include host
 PERROR_NONE_MESSAGE = _("Server URL can not be None")
 PERROR_PORT_MESSAGE = _("Server URL port should be numeric")
 PERROR_SCHEME_MESSAGE = _("Server URL has an invalid scheme. http:// and https:// are supported")
+LOCK_TIMEOUT_MESSAGE = _("Another subscription-manager operation is in progress. Please try again once it has finished.")
 
 
 class ExceptionMapper(object):
@@ -57,6 +59,7 @@ class ExceptionMapper(object):
             utils.ServerUrlParseErrorPort: (PERROR_PORT_MESSAGE, self.format_default),
             utils.ServerUrlParseErrorScheme: (PERROR_SCHEME_MESSAGE, self.format_default),
             SSLError: (SSL_MESSAGE, self.format_ssl_error),
+            LockTimeout: (LOCK_TIMEOUT_MESSAGE, self.format_default),
             # The message template will always be none since the RestlibException's
             # message is already translated server-side.
             connection.RestlibException: (None, self.format_restlib_exception),
@@ -35,7 +35,7 @@ class FactsActionInvoker(object):
     Makes use of the facts module as well.
     """
     def __init__(self):
-        self.locker = Locker()
+        self.locker = Locker(self.__class__.__name__)
 
     def update(self):
         return self.locker.run(self._do_update)
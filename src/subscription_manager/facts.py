@@ -20,7 +20,8 @@ import os
 import rhsm.config
 
 from subscription_manager.injection import PLUGIN_MANAGER, require
-from subscription_manager.cache import CacheManager
+from subscription_manager import cachestore
+from subscription_manager.cache import CacheManager, cache_writer
 import subscription_manager.injection as inj
 from rhsm import ourjson as json
 
@@ -42,6 +43,7 @@ class Facts(CacheManager):
     facts to be loaded from /etc/rhsm/facts/.
     """
     CACHE_FILE = "/var/lib/rhsm/facts/facts.json"
+    STORE_DIGEST = True
 
     def __init__(self, ent_dir=None, prod_dir=None):
         self.facts = {}
@@ -59,8 +61,10 @@ class Facts(CacheManager):
         self.plugin_manager = require(PLUGIN_MANAGER)
 
     def get_last_update(self):
+        cache_writer.flush(self.CACHE_FILE)
         try:
-            return datetime.fromtimestamp(os.stat(self.CACHE_FILE).st_mtime)
+            return datetime.fromtimestamp(
+                    cachestore.get_store().mtime(self.CACHE_FILE))
         except Exception:
             return None
 
@@ -73,14 +77,22 @@ class Facts(CacheManager):
             log.info("Cache %s does not exit" % self.CACHE_FILE)
             return True
 
-        cached_facts = self._read_cache() or {}
         # In order to accurately check for changes, we must refresh local data
         self.facts = self.get_facts(True)
 
-        for key in (set(self.facts) | set(cached_facts)) - set(self.graylist):
-            if self.facts.get(key) != cached_facts.get(key):
-                return True
-        return False
+        def compare():
+            cached_facts = self._read_cache() or {}
+            for key in (set(self.facts) | set(cached_facts)) - set(self.graylist):
+                if self.facts.get(key) != cached_facts.get(key):
+                    return True
+            return False
+        return self._changed_from_digest(self.facts, compare)
+
+    def _digest_data(self, data):
+        # Same as the comparison in has_changed(), graylisted facts and
+        # facts without a value don't count:
+        return dict((key, value) for (key, value) in data.items()
+                    if key not in self.graylist and value is not None)
 
     def get_facts(self, refresh=False):
         if ((len(self.facts) == 0) or refresh):
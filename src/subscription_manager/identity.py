@@ -15,6 +15,7 @@
 
 import logging
 import os
+import stat
 
 from rhsm.certificate import create_from_pem
 from rhsm.config import initConfig
@@ -24,6 +25,9 @@ CFG = initConfig()
 
 log = logging.getLogger('rhsm-app.' + __name__)
 
+# Expected permissions for identity certificates:
+ID_CERT_PERMS = stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP
+
 
 class ConsumerIdentity:
     """Consumer info and certificate information.
@@ -91,16 +95,15 @@ class ConsumerIdentity:
     # TODO: we're using a Certificate which has it's own write/delete, no idea
     # why this landed in a parallel disjoint class wrapping the actual cert.
     def write(self):
-        from subscription_manager import managerlib
         self.__mkdir()
         f = open(self.keypath(), 'w')
         f.write(self.key)
         f.close()
-        os.chmod(self.keypath(), managerlib.ID_CERT_PERMS)
+        os.chmod(self.keypath(), ID_CERT_PERMS)
         f = open(self.certpath(), 'w')
         f.write(self.cert)
         f.close()
-        os.chmod(self.certpath(), managerlib.ID_CERT_PERMS)
+        os.chmod(self.certpath(), ID_CERT_PERMS)
 
     def delete(self):
         path = self.keypath()
@@ -170,3 +173,24 @@ class Identity(object):
         return "<%s, name=%s, uuid=%s, consumer=%s>" % \
                 (self.__class__.__name__,
                 self.name, self.uuid, self.consumer)
+
+
+def check_identity_cert_perms():
+    """
+    Ensure the identity certs on this system have the correct permissions, and
+    fix them if not.
+    """
+    certs = [ConsumerIdentity.keypath(), ConsumerIdentity.certpath()]
+    for cert in certs:
+        if not os.path.exists(cert):
+            # Only relevant if these files exist.
+            continue
+        statinfo = os.stat(cert)
+        if statinfo[stat.ST_UID] != 0 or statinfo[stat.ST_GID] != 0:
+            os.chown(cert, 0, 0)
+            log.warn("Corrected incorrect ownership of %s." % cert)
+
+        mode = stat.S_IMODE(statinfo[stat.ST_MODE])
+        if mode != ID_CERT_PERMS:
+            os.chmod(cert, ID_CERT_PERMS)
+            log.warn("Corrected incorrect permissions on %s." % cert)
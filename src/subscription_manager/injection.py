@@ -31,8 +31,11 @@ FACTS = "FACTS"
 PROFILE_MANAGER = "PROFILE_MANAGER"
 INSTALLED_PRODUCTS_MANAGER = "INSTALLED_PRODUCTS_MANAGER"
 
+import logging
 import types
 
+log = logging.getLogger('rhsm-app.' + __name__)
+
 
 class FeatureBroker:
     """
@@ -71,6 +74,17 @@ class FeatureBroker:
         except KeyError:
             raise KeyError("Unknown feature: %r" % feature)
 
+        if isinstance(provider, LazyProvider):
+            try:
+                provider = provider.load()
+            except ImportError:
+                if not provider.optional:
+                    raise
+                log.debug("Feature %r not available" % feature, exc_info=True)
+                del self.providers[feature]
+                raise KeyError("Unknown feature: %r" % feature)
+            self.providers[feature] = provider
+
         if isinstance(provider, (type, types.ClassType)):
             # Args should never be used with singletons, they are ignored
             self.providers[feature] = provider()
@@ -80,6 +94,28 @@ class FeatureBroker:
         return self.providers[feature]
 
 
+class LazyProvider(object):
+    """
+    Provides a class which is only imported the first time the feature
+    is required, so an entry point does not import what it never uses.
+
+    If optional, the feature goes away when the class can not be
+    imported, as if it was never provided.
+    """
+    def __init__(self, module_name, class_name, singleton=False, optional=False):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.singleton = singleton
+        self.optional = optional
+
+    def load(self):
+        module = __import__(self.module_name, {}, {}, [self.class_name])
+        provider = getattr(module, self.class_name)
+        if not self.singleton:
+            provider = nonSingleton(provider)
+        return provider
+
+
 def nonSingleton(other):
     """
     Creates a factory method for a class. Passes args to the constructor
@@ -107,3 +143,13 @@ def provide(feature, provider, singleton=False):
     if not singleton and isinstance(provider, (type, types.ClassType)):
         provider = nonSingleton(provider)
     return FEATURES.provide(feature, provider)
+
+
+def provide_lazy(feature, module_name, class_name, singleton=False, optional=False):
+    """
+    Like provide() for the class class_name of module module_name, which
+    is imported the first time the feature is required. See LazyProvider.
+    """
+    global FEATURES
+    return FEATURES.provide(feature, LazyProvider(module_name, class_name,
+                                                  singleton, optional))
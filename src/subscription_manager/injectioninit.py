@@ -15,62 +15,60 @@
 import subscription_manager.injection as inj
 
 
-from subscription_manager.cache import ProductStatusCache, EntitlementStatusCache, OverrideStatusCache, \
-    ProfileManager, InstalledProductsManager, PoolTypeCache
-
-from subscription_manager.cert_sorter import CertSorter
-from subscription_manager.certdirectory import EntitlementDirectory
-from subscription_manager.certdirectory import ProductDirectory
-from subscription_manager.facts import Facts
-from subscription_manager.identity import Identity
-from subscription_manager.validity import ValidProductDateRangeCalculator
-from subscription_manager.cp_provider import CPProvider
-from subscription_manager.plugins import PluginManager
-from subscription_manager.lock import ActionLock
-
-
 def init_dep_injection():
     """
     Initializes the default behaviour for all supported features.
 
     This needs to be called from any entry-point into subscription manager.
+
+    The implementations are only imported once a feature is required, so
+    an entry point only loads the modules it uses.
     """
     # Set up consumer identity as a singleton so we don't constantly re-load
     # it from disk. Call reload when anything changes and all references will be
     # updated.
-    inj.provide(inj.IDENTITY, Identity, singleton=True)
-
-    inj.provide(inj.PRODUCT_DATE_RANGE_CALCULATOR,
-            ValidProductDateRangeCalculator)
-
-    inj.provide(inj.ENT_DIR, EntitlementDirectory, singleton=True)
-    inj.provide(inj.PROD_DIR, ProductDirectory, singleton=True)
-
-    inj.provide(inj.ENTITLEMENT_STATUS_CACHE, EntitlementStatusCache, singleton=True)
-    inj.provide(inj.PROD_STATUS_CACHE, ProductStatusCache, singleton=True)
-    inj.provide(inj.OVERRIDE_STATUS_CACHE, OverrideStatusCache, singleton=True)
-    inj.provide(inj.PROFILE_MANAGER, ProfileManager, singleton=True)
-    inj.provide(inj.INSTALLED_PRODUCTS_MANAGER, InstalledProductsManager, singleton=True)
-
-    inj.provide(inj.CP_PROVIDER, CPProvider, singleton=True)
-
-    inj.provide(inj.CERT_SORTER, CertSorter, singleton=True)
+    inj.provide_lazy(inj.IDENTITY, 'subscription_manager.identity', 'Identity',
+            singleton=True)
+
+    inj.provide_lazy(inj.PRODUCT_DATE_RANGE_CALCULATOR,
+            'subscription_manager.validity', 'ValidProductDateRangeCalculator')
+
+    inj.provide_lazy(inj.ENT_DIR, 'subscription_manager.certdirectory',
+            'EntitlementDirectory', singleton=True)
+    inj.provide_lazy(inj.PROD_DIR, 'subscription_manager.certdirectory',
+            'ProductDirectory', singleton=True)
+
+    inj.provide_lazy(inj.ENTITLEMENT_STATUS_CACHE, 'subscription_manager.cache',
+            'EntitlementStatusCache', singleton=True)
+    inj.provide_lazy(inj.PROD_STATUS_CACHE, 'subscription_manager.cache',
+            'ProductStatusCache', singleton=True)
+    inj.provide_lazy(inj.OVERRIDE_STATUS_CACHE, 'subscription_manager.cache',
+            'OverrideStatusCache', singleton=True)
+    inj.provide_lazy(inj.PROFILE_MANAGER, 'subscription_manager.cache',
+            'ProfileManager', singleton=True)
+    inj.provide_lazy(inj.INSTALLED_PRODUCTS_MANAGER, 'subscription_manager.cache',
+            'InstalledProductsManager', singleton=True)
+
+    inj.provide_lazy(inj.CP_PROVIDER, 'subscription_manager.cp_provider',
+            'CPProvider', singleton=True)
+
+    inj.provide_lazy(inj.CERT_SORTER, 'subscription_manager.cert_sorter',
+            'CertSorter', singleton=True)
 
     # Set up plugin manager as a singleton.
     # FIXME: should we aggressively catch exceptions here? If we can't
     # create a PluginManager we should probably raise an exception all the way up
-    inj.provide(inj.PLUGIN_MANAGER, PluginManager, singleton=True)
+    inj.provide_lazy(inj.PLUGIN_MANAGER, 'subscription_manager.plugins',
+            'PluginManager', singleton=True)
 
-    inj.provide(inj.POOLTYPE_CACHE, PoolTypeCache, singleton=True)
-    inj.provide(inj.ACTION_LOCK, ActionLock)
+    inj.provide_lazy(inj.POOLTYPE_CACHE, 'subscription_manager.cache',
+            'PoolTypeCache', singleton=True)
+    inj.provide_lazy(inj.ACTION_LOCK, 'subscription_manager.lock', 'ActionLock')
 
     # see what happens with non singleton, callable
-    inj.provide(inj.FACTS, Facts)
+    inj.provide_lazy(inj.FACTS, 'subscription_manager.facts', 'Facts')
 
-    try:
-        # This catch fixes the product-id module on anaconda
-        # Anaconda does not have dbus module, which is imported in dbus_interface
-        from subscription_manager.dbus_interface import DbusIface
-        inj.provide(inj.DBUS_IFACE, DbusIface, singleton=True)
-    except ImportError:
-        pass
+    # Optional, as anaconda does not have the dbus module, which is
+    # imported in dbus_interface. This fixes the product-id module there.
+    inj.provide_lazy(inj.DBUS_IFACE, 'subscription_manager.dbus_interface',
+            'DbusIface', singleton=True, optional=True)
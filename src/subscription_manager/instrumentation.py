@@ -0,0 +1,282 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Timing of action runs: the wall and CPU time each lib of an action
+client took, and how often and how long the requests to the entitlement
+server took while they ran.
+
+Enabled with [rhsm] action_timing. Each run then appends a JSON record,
+one per line, to TIMING_LOG and the timing of each lib is added to its
+ActionReport. When disabled, nothing is timed and the connections are
+not wrapped.
+"""
+
+import logging
+import os
+import resource
+import threading
+import time
+
+from rhsm import ourjson as json
+from rhsm.config import initConfig
+
+from subscription_manager import injection as inj
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+cfg = initConfig()
+
+TIMING_LOG = '/var/log/rhsm/rhsm-timing.log'
+
+# Linux only, and not in the resource module before python 3.2:
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', 1)
+
+# The run being timed, see start_run():
+_current = None
+_current_mutex = threading.Lock()
+
+
+def timing_enabled():
+    if not cfg.has_option('rhsm', 'action_timing'):
+        return False
+    try:
+        return (cfg.get_int('rhsm', 'action_timing') or 0) > 0
+    except ValueError, e:
+        log.warn(e)
+        return False
+
+
+def cpu_time():
+    """
+    CPU seconds used by the calling thread, or by the whole process where
+    the thread's own are not known.
+    """
+    try:
+        usage = resource.getrusage(RUSAGE_THREAD)
+    except (ValueError, resource.error):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def start_run(name):
+    """
+    Start timing an action run called name. Returns its RunTiming, or
+    None if timing is disabled or a run is timed already, as when a lib
+    runs as part of an action client's run.
+    """
+    global _current
+    if not timing_enabled():
+        return None
+    call_stats = getattr(inj.require(inj.CP_PROVIDER), 'call_stats', None)
+    _current_mutex.acquire()
+    try:
+        if _current is not None:
+            return None
+        _current = RunTiming(name, call_stats)
+        return _current
+    finally:
+        _current_mutex.release()
+
+
+class CallStats(object):
+    """
+    Count and latency of the requests made through Restlib connections,
+    by request type and path, and the number of requests each thread
+    made.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calls = {}
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._calls = {}
+        finally:
+            self._lock.release()
+
+    def wrap(self, conn):
+        """
+        Time the requests of conn, the Restlib of a UEPConnection. Only
+        the requests which go to the server, responses reused from the
+        ResponseCache are not counted.
+
+        Requests through the request_response of conn, see
+        cp_provider.response_request(), are timed as well.
+        """
+        conn._request = self._timed(conn._request)
+        if 'request_response' in conn.__dict__:
+            conn.request_response = self._timed(conn.request_response)
+
+    def _timed(self, request):
+
+        def timed_request(request_type, method, *args, **kwargs):
+            start = time.time()
+            try:
+                return request(request_type, method, *args, **kwargs)
+            finally:
+                self.record(request_type, method, time.time() - start)
+
+        return timed_request
+
+    def record(self, request_type, method, seconds):
+        # Query strings can hold long lists of ids, they do not make the
+        # request a different one:
+        key = "%s %s" % (request_type, method.split('?')[0])
+        self._local.count = self.thread_count() + 1
+        self._lock.acquire()
+        try:
+            stats = self._calls.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        finally:
+            self._lock.release()
+
+    def thread_count(self):
+        """ The number of requests the calling thread made so far. """
+        return getattr(self._local, 'count', 0)
+
+    def to_list(self):
+        """ The requests made, those which took longest in total first. """
+        self._lock.acquire()
+        try:
+            calls = [{'request': key, 'count': stats[0],
+                      'total': stats[1], 'max': stats[2]}
+                     for (key, stats) in self._calls.items()]
+        finally:
+            self._lock.release()
+        calls.sort(key=lambda call: call['total'], reverse=True)
+        return calls
+
+
+class LibTiming(object):
+    """ The time one lib of an action run took. """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = None
+        self.cpu = None
+        # Requests to the server the lib made, None if not counted:
+        self.calls = None
+
+    def to_dict(self):
+        return {'lib': self.name, 'wall': self.wall, 'cpu': self.cpu,
+                'calls': self.calls}
+
+    def __str__(self):
+        s = "wall %.3fs, cpu %.3fs" % (self.wall, self.cpu)
+        if self.calls is not None:
+            s += ", %d requests" % self.calls
+        return s
+
+
+class RunTiming(object):
+    """
+    Timing of one action run, the libs it ran and the requests made to
+    the server by call_stats' connections while it did.
+
+    Libs running in threads of their own get their own CPU time, the CPU
+    time of the run is that of the whole process.
+    """
+
+    def __init__(self, name, call_stats=None):
+        self.name = name
+        self.call_stats = call_stats
+        self.libs = []
+        self.start = time.time()
+        self.wall = None
+        self.cpu = None
+        self.lock_wait = None
+        self.lock_hold = None
+        self._cpu_start = self._process_cpu_time()
+        if call_stats:
+            call_stats.reset()
+
+    def _process_cpu_time(self):
+        times = os.times()
+        return times[0] + times[1]
+
+    def time_lib(self, lib, func):
+        """
+        Call func, timing it as lib's part of the run. Returns what func
+        returns and the LibTiming.
+        """
+        lib_timing = LibTiming(lib.__class__.__name__)
+        calls_start = self.call_stats and self.call_stats.thread_count()
+        cpu_start = cpu_time()
+        start = time.time()
+        try:
+            return (func(), lib_timing)
+        finally:
+            lib_timing.wall = time.time() - start
+            lib_timing.cpu = cpu_time() - cpu_start
+            if self.call_stats:
+                lib_timing.calls = self.call_stats.thread_count() - calls_start
+            self.libs.append(lib_timing)
+
+    def finish(self, lock_wait=None, lock_hold=None):
+        """ End the run, log a summary and write its record to TIMING_LOG. """
+        global _current
+        self.wall = time.time() - self.start
+        self.cpu = self._process_cpu_time() - self._cpu_start
+        self.lock_wait = lock_wait
+        self.lock_hold = lock_hold
+        _current_mutex.acquire()
+        try:
+            if _current is self:
+                _current = None
+        finally:
+            _current_mutex.release()
+
+        log.info(self.format())
+        self.write()
+
+    def to_dict(self):
+        calls = None
+        if self.call_stats:
+            calls = self.call_stats.to_list()
+        return {'run': self.name,
+                'start': self.start,
+                'wall': self.wall,
+                'cpu': self.cpu,
+                'lock_wait': self.lock_wait,
+                'lock_hold': self.lock_hold,
+                'libs': [lib_timing.to_dict() for lib_timing in self.libs],
+                'calls': calls}
+
+    def format(self):
+        s = ["%s: wall %.3fs, cpu %.3fs" % (self.name, self.wall, self.cpu)]
+        for lib_timing in self.libs:
+            s.append("    %s: %s" % (lib_timing.name, lib_timing))
+        if self.call_stats:
+            for call in self.call_stats.to_list():
+                s.append("    %(request)s: %(count)d requests, "
+                         "%(total).3fs total, %(max).3fs max" % call)
+        return '\n'.join(s)
+
+    def write(self, path=None):
+        path = path or TIMING_LOG
+        try:
+            f = open(path, 'a')
+            try:
+                f.write(json.dumps(self.to_dict()) + '\n')
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            log.warn("Unable to write %s: %s" % (path, e))
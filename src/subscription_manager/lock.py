@@ -15,30 +15,179 @@
 # in this software or its documentation.
 #
 
+import errno
 import fcntl
+import logging
 import os
+import select
+import sys
+import threading
 from threading import RLock as Mutex
 import time
 
+from rhsm.config import initConfig
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+cfg = initConfig()
+
+# Seconds between checks on a holder which does not keep the file locked,
+# ie. a subscription-manager from before the holder kept the flock:
+UNLOCKED_HOLDER_WAIT = 0.5
+
+# Waiters queue up on this file before waiting for the lock itself:
+TURNSTILE_SUFFIX = '.wait'
+
+
+class LockTimeout(Exception):
+    """
+    Raised when a lock could not be acquired within its timeout.
+    """
+
+    def __init__(self, path, timeout):
+        Exception.__init__(self, "Timed out after %ss waiting for lock %s" %
+                           (timeout, path))
+        self.path = path
+        self.timeout = timeout
+
+
+def _open_locked(path, blocking=True):
+    """
+    Open path, creating it if needed, and wait for an exclusive flock
+    on it. If not blocking, return None at once if it is locked.
+    """
+    operation = fcntl.LOCK_EX
+    if not blocking:
+        operation |= fcntl.LOCK_NB
+    while True:
+        fp = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0644), 'r+')
+        try:
+            fcntl.flock(fp.fileno(), operation)
+        except IOError, e:
+            fp.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+        # The file may have been removed while we waited, in which case
+        # the lock we got guards nothing:
+        try:
+            if os.stat(path).st_ino == os.fstat(fp.fileno()).st_ino:
+                return fp
+        except OSError:
+            pass
+        fp.close()
+
+
+def _open_locked_within(path, timeout):
+    """
+    Like _open_locked, but give up and return None after timeout
+    seconds.
+
+    flock cannot time out, so the wait happens in a thread, which tells
+    us it has the lock through a pipe we can select on. If we gave up by
+    then, it lets go of the lock again.
+    """
+    (read_fd, write_fd) = os.pipe()
+    mutex = Mutex()
+    state = {'abandoned': False, 'fp': None, 'error': None}
+
+    def wait():
+        try:
+            try:
+                fp = _open_locked(path)
+            except Exception:
+                fp = None
+                error = sys.exc_info()
+            mutex.acquire()
+            try:
+                if state['abandoned']:
+                    if fp is not None:
+                        fp.close()
+                    return
+                state['fp'] = fp
+                if fp is None:
+                    state['error'] = error
+                os.write(write_fd, 'x')
+            finally:
+                mutex.release()
+        finally:
+            os.close(write_fd)
+
+    waiter = threading.Thread(target=wait, name="LockWaiter")
+    waiter.setDaemon(True)
+    waiter.start()
+    try:
+        try:
+            select.select([read_fd], [], [], timeout)
+        except select.error:
+            pass
+        mutex.acquire()
+        try:
+            if state['error'] is not None:
+                error = state['error']
+                raise error[0], error[1], error[2]
+            if state['fp'] is None:
+                state['abandoned'] = True
+            return state['fp']
+        finally:
+            mutex.release()
+    finally:
+        os.close(read_fd)
+
+
+def open_locked(path, timeout=None):
+    """
+    Open path holding an exclusive flock on it, waiting at most timeout
+    seconds for it if timeout is not None. Returns None on timeout.
+    """
+    if timeout is None:
+        return _open_locked(path)
+    fp = _open_locked(path, blocking=False)
+    if fp is None and timeout > 0:
+        fp = _open_locked_within(path, timeout)
+    return fp
+
 
 class LockFile:
+    """
+    A lock file holding the pid of the process which has the lock.
+
+    The holder keeps the file flocked for as long as it has the lock, so
+    waiters block in the kernel and the first of them is woken as soon as
+    it is released. Waiters first queue up on a turnstile file, which
+    they hold until they have the lock file, so a holder which lets go
+    and tries again straight away gets in line behind the waiter already
+    there instead of taking the lock back.
+    """
 
     def __init__(self, path):
         self.path = path
         self.pid = None
         self.fp = None
 
-    def open(self):
-        if self.notcreated():
-            self.fp = open(self.path, 'w')
-            self.setpid()
-            self.close()
-        self.fp = open(self.path, 'r+')
-        fd = self.fp.fileno()
-        fcntl.flock(fd, fcntl.LOCK_EX)
+    def open(self, timeout=None):
+        """
+        Wait for the lock file, at most timeout seconds if not None.
+        Returns False if it timed out.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        turnstile = open_locked(self.path + TURNSTILE_SUFFIX, timeout)
+        if turnstile is None:
+            return False
+        try:
+            if deadline is not None:
+                timeout = deadline - time.time()
+            self.pid = None
+            self.fp = open_locked(self.path, timeout)
+        finally:
+            turnstile.close()
+        return self.fp is not None
 
     def getpid(self):
         if self.pid is None:
+            self.fp.seek(0)
             content = self.fp.read().strip()
             if content:
                 self.pid = int(content)
@@ -46,9 +195,17 @@ class LockFile:
 
     def setpid(self):
         self.fp.seek(0)
+        self.fp.truncate()
         content = str(os.getpid())
         self.fp.write(content)
         self.fp.flush()
+        self.pid = os.getpid()
+
+    def clearpid(self):
+        self.fp.seek(0)
+        self.fp.truncate()
+        self.fp.flush()
+        self.pid = None
 
     def mypid(self):
         return (os.getpid() == self.getpid())
@@ -84,13 +241,40 @@ class LockFile:
         self.close()
 
 
+class LockSession:
+    """
+    This process' hold on a lock file. Taken by the first Lock which
+    acquires the file, any other Lock on the same path in this process
+    joins it instead of going back to the file, until the last of them
+    releases it.
+    """
+
+    def __init__(self, path, lock_file=None):
+        self.path = path
+        self.lock_file = lock_file
+        self.holders = 0
+        # Set once the first Lock is done waiting for the file, which
+        # it does without holding _session_mutex:
+        self.ready = threading.Event()
+        self.timed_out = False
+
+
+# The LockSession for each lock file this process holds, by path:
+_sessions = {}
+# Held while looking up, adding or dropping a session:
+_session_mutex = Mutex()
+
+
 class Lock:
 
     mutex = Mutex()
 
-    def __init__(self, path):
+    def __init__(self, path, timeout=None):
         self.depth = 0
         self.path = path
+        # Seconds to wait for the lock file before raising LockTimeout,
+        # None waits for as long as it takes:
+        self.timeout = timeout
         self.lockdir = None
         lock_dir, fn = os.path.split(self.path)
         try:
@@ -103,26 +287,67 @@ class Lock:
     def acquire(self):
         if self.lockdir is None:
             return
-        f = LockFile(self.path)
+        _session_mutex.acquire()
         try:
+            session = _sessions.get(self.path)
+            owner = session is None
+            if owner:
+                session = LockSession(self.path)
+                _sessions[self.path] = session
+            session.holders += 1
+        finally:
+            _session_mutex.release()
+
+        if owner:
             try:
-                while True:
-                    f.open()
-                    f.getpid()
-                    if f.mypid():
-                        self.P()
-                        return
-                    if f.valid():
-                        f.close()
-                        time.sleep(0.5)
-                    else:
-                        break
-                self.P()
-                f.setpid()
-            except OSError:
+                session.lock_file = self._acquire_file()
+            except LockTimeout:
+                session.timed_out = True
+                raise
+            except (IOError, OSError):
                 print "could not create lock"
+            finally:
+                if session.lock_file is None:
+                    self._drop_session(session)
+                session.ready.set()
+        else:
+            session.ready.wait()
+
+        if session.lock_file is None:
+            if session.timed_out and not owner:
+                raise LockTimeout(self.path, self.timeout)
+            return
+        self.P()
+
+    def _drop_session(self, session):
+        _session_mutex.acquire()
+        try:
+            if _sessions.get(self.path) is session:
+                del _sessions[self.path]
         finally:
+            _session_mutex.release()
+
+    def _acquire_file(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        f = LockFile(self.path)
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+            if not f.open(timeout):
+                raise LockTimeout(self.path, self.timeout)
+            # Whoever had the lock before let go of the flock, so any pid
+            # left in the file is stale unless that process still runs
+            # without keeping the file locked:
+            if f.getpid() is None or f.mypid() or not f.valid():
+                f.setpid()
+                return f
             f.close()
+            if deadline is not None and time.time() + UNLOCKED_HOLDER_WAIT > deadline:
+                raise LockTimeout(self.path, self.timeout)
+            time.sleep(UNLOCKED_HOLDER_WAIT)
 
     def release(self):
         if self.lockdir is None:
@@ -130,14 +355,22 @@ class Lock:
         if not self.acquired():
             return
         self.V()
-        if self.acquired():
-            return
-        f = LockFile(self.path)
+        _session_mutex.acquire()
         try:
-            f.open()
-            f.delete()
+            session = _sessions.get(self.path)
+            if session is None or session.lock_file is None:
+                return
+            session.holders -= 1
+            if session.holders > 0:
+                return
+            del _sessions[self.path]
+            # The file stays for the next holder, who is woken on close:
+            try:
+                session.lock_file.clearpid()
+            finally:
+                session.lock_file.close()
         finally:
-            f.close()
+            _session_mutex.release()
 
     def acquired(self):
         if self.lockdir is None:
@@ -178,9 +411,23 @@ class Lock:
             pass
 
 
+def get_action_lock_timeout():
+    """
+    Seconds to wait for the action lock, or None to wait for as long as
+    it takes.
+    """
+    if not cfg.has_option('rhsm', 'action_lock_timeout'):
+        return None
+    try:
+        return cfg.get_int('rhsm', 'action_lock_timeout') or None
+    except ValueError, e:
+        log.warn(e)
+        return None
+
+
 class ActionLock(Lock):
 
     PATH = '/var/run/rhsm/cert.pid'
 
     def __init__(self):
-        Lock.__init__(self, self.PATH)
+        Lock.__init__(self, self.PATH, timeout=get_action_lock_timeout())
@@ -13,6 +13,7 @@ import logging
 from logging.handlers import RotatingFileHandler
 import os
 import sys
+import threading
 
 RHSM_LOG = '/var/log/rhsm/rhsm.log'
 CERT_LOG = '/var/log/rhsm/rhsmcertd.log'
@@ -93,6 +94,68 @@ class ContextLoggingFilter(object):
         return True
 
 
+class DeferredThreadLogging(object):
+    """
+    Holds back the records logged by the threads added to it, for the
+    thread which created it to log with flush(). Logging from other
+    threads can cause a segfault, BZ 988861 and 988430.
+
+    Only holds anything back between start() and stop().
+    """
+
+    def __init__(self):
+        self._threads = set()
+        self._records = []
+        self._lock = threading.Lock()
+        self._handlers = []
+
+    def add_thread(self, thread):
+        self._threads.add(thread)
+
+    def filter(self, record):
+        if threading.currentThread() not in self._threads:
+            return True
+        # Each record goes through the handlers of every logger it
+        # propagates to, only keep it once:
+        if not getattr(record, 'deferred', False):
+            record.deferred = True
+            self._lock.acquire()
+            try:
+                self._records.append(record)
+            finally:
+                self._lock.release()
+        return False
+
+    def start(self):
+        loggers = [logging.getLogger()] + \
+                [logger for logger in logging.Logger.manager.loggerDict.values()
+                 if isinstance(logger, logging.Logger)]
+        for logger in loggers:
+            for log_handler in logger.handlers:
+                if log_handler not in self._handlers:
+                    log_handler.addFilter(self)
+                    self._handlers.append(log_handler)
+
+    def flush(self):
+        """
+        Log what the threads logged so far.
+        """
+        self._lock.acquire()
+        try:
+            records = self._records
+            self._records = []
+        finally:
+            self._lock.release()
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+
+    def stop(self):
+        for log_handler in self._handlers:
+            log_handler.removeFilter(self)
+        self._handlers = []
+        self.flush()
+
+
 def init_logger():
 
     handler = _get_handler()
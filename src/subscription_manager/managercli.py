@@ -38,11 +38,13 @@ from subscription_manager.entcertlib import EntCertActionInvoker
 from subscription_manager.action_client import ActionClient, UnregisterActionClient
 from subscription_manager.cert_sorter import ComplianceManager, FUTURE_SUBSCRIBED, \
         SUBSCRIBED, NOT_SUBSCRIBED, EXPIRED, PARTIALLY_SUBSCRIBED, UNKNOWN
-from subscription_manager.cli import AbstractCLICommand, CLI, system_exit
+from subscription_manager.cli import AbstractCLICommand, system_exit
 from subscription_manager import rhelentbranding
 from subscription_manager.hwprobe import ClassicCheck
 import subscription_manager.injection as inj
 from subscription_manager.jsonwrapper import PoolWrapper
+from subscription_manager.lock import LockTimeout
+from subscription_manager.managercommands import ManagerCLI
 from subscription_manager import managerlib
 from subscription_manager.managerlib import valid_quantity
 from subscription_manager.release import ReleaseBackend
@@ -50,10 +52,11 @@ from subscription_manager.repolib import RepoActionInvoker, RepoFile
 from subscription_manager.utils import parse_server_info, \
         parse_baseurl_info, format_baseurl, is_valid_server_info, \
         MissingCaCertException, get_client_versions, get_server_versions, \
-        restart_virt_who, get_terminal_width
+        restart_virt_who
 from subscription_manager.overrides import Overrides, Override
-from subscription_manager.exceptions import ExceptionMapper
-from subscription_manager.printing_utils import columnize, format_name, _none_wrap, _echo
+from subscription_manager.exceptions import ExceptionMapper, LOCK_TIMEOUT_MESSAGE
+from subscription_manager.printing_utils import columnize, format_name, \
+        get_terminal_width, _none_wrap, _echo
 
 _ = gettext.gettext
 
@@ -414,6 +417,7 @@ class CliCommand(AbstractCLICommand):
 
         self.cp_provider = inj.require(inj.CP_PROVIDER)
         self.cp_provider.set_connection_info(**connection_info)
+        self.cp_provider.cache_responses()
 
         self.log_client_version()
 
@@ -447,6 +451,9 @@ class CliCommand(AbstractCLICommand):
         except X509.X509Error, e:
             log.error(e)
             print _('System certificates corrupted. Please reregister.')
+        except LockTimeout, e:
+            log.error(e)
+            system_exit(-1, LOCK_TIMEOUT_MESSAGE)
 
 
 class UserPassCommand(CliCommand):
@@ -554,6 +561,11 @@ class RefreshCommand(CliCommand):
         self.assert_should_be_registered()
         try:
             self.entcertlib.update()
+            # Don't answer the next status check from a cache that
+            # is still within its freshness window:
+            inj.require(inj.ENTITLEMENT_STATUS_CACHE).expire()
+            inj.require(inj.PROD_STATUS_CACHE).expire()
+            inj.require(inj.OVERRIDE_STATUS_CACHE).expire()
             log.info("Refreshed local data")
             print (_("All local data refreshed"))
         except connection.RestlibException, re:
@@ -1582,12 +1594,16 @@ class RemoveCommand(CliCommand):
                     print (_("%s subscriptions removed from this system.") % total)
                 else:
                     count = 0
-                    for ent in self.entitlement_dir.list():
-                        if str(ent.serial) in self.options.serials:
-                            ent.delete()
-                            print _("Subscription with serial number %s removed from this system") \
-                                    % str(ent.serial)
-                            count = count + 1
+                    removed = set()
+                    for serial in self.options.serials:
+                        ent = self.entitlement_dir.find(long(serial))
+                        if ent is None or ent.serial in removed:
+                            continue
+                        ent.delete()
+                        removed.add(ent.serial)
+                        print _("Subscription with serial number %s removed from this system") \
+                                % str(ent.serial)
+                        count = count + 1
                     if count == 0:
                         return_code = 1
             except Exception, e:
@@ -2395,22 +2411,5 @@ class StatusCommand(CliCommand):
             print ''
 
 
-class ManagerCLI(CLI):
-
-    def __init__(self):
-        commands = [RegisterCommand, UnRegisterCommand, ConfigCommand, ListCommand,
-                    SubscribeCommand, UnSubscribeCommand, FactsCommand,
-                    IdentityCommand, OwnersCommand, RefreshCommand, CleanCommand,
-                    RedeemCommand, ReposCommand, ReleaseCommand, StatusCommand,
-                    EnvironmentsCommand, ImportCertCommand, ServiceLevelCommand,
-                    VersionCommand, RemoveCommand, AttachCommand, PluginsCommand,
-                    AutohealCommand, OverrideCommand]
-        CLI.__init__(self, command_classes=commands)
-
-    def main(self):
-        managerlib.check_identity_cert_perms()
-        return CLI.main(self)
-
-
 if __name__ == "__main__":
     ManagerCLI().main()
@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+The commands of subscription-manager, by name.
+
+The commands themselves are in managercli, which imports most of
+subscription_manager. It is only imported once a command runs, so
+--help or a mistyped command do not pay for it. The names, short
+descriptions and primary flags here have to match the command classes,
+test_managercommands checks they do.
+"""
+
+import gettext
+import sys
+
+from subscription_manager.branding import get_branding
+from subscription_manager.cli import CLI, LazyCommand
+
+_ = gettext.gettext
+
+COMMANDS_MODULE = 'subscription_manager.managercli'
+
+
+def manager_commands():
+    """ LazyCommands for all subscription-manager commands. """
+    def command(name, class_name, shortdesc, primary=False):
+        return LazyCommand(name, COMMANDS_MODULE, class_name, shortdesc, primary)
+
+    return [
+        command("register", "RegisterCommand", get_branding().CLI_REGISTER, True),
+        command("unregister", "UnRegisterCommand", get_branding().CLI_UNREGISTER, True),
+        command("config", "ConfigCommand",
+                _("List, set, or remove the configuration parameters in use by this system")),
+        command("list", "ListCommand",
+                _("List subscription and product information for this system"), True),
+        command("subscribe", "SubscribeCommand", _("Deprecated, see attach")),
+        command("unsubscribe", "UnSubscribeCommand", _("Deprecated, see remove")),
+        command("facts", "FactsCommand",
+                _("View or update the detected system information")),
+        command("identity", "IdentityCommand",
+                _("Display the identity certificate for this system or "
+                  "request a new one")),
+        command("orgs", "OwnersCommand",
+                _("Display the organizations against which a user can register a system")),
+        command("refresh", "RefreshCommand",
+                _("Pull the latest subscription data from the server"), True),
+        command("clean", "CleanCommand",
+                _("Remove all local system and subscription data without affecting the server")),
+        command("redeem", "RedeemCommand",
+                _("Attempt to redeem a subscription for a preconfigured system")),
+        command("repos", "ReposCommand",
+                _("List the repositories which this system is entitled to use")),
+        command("release", "ReleaseCommand",
+                _("Configure which operating system release to use"), True),
+        command("status", "StatusCommand",
+                _("Show status information for this system's subscriptions and products"), True),
+        command("environments", "EnvironmentsCommand",
+                _("Display the environments available for a user")),
+        command("import", "ImportCertCommand",
+                _("Import certificates which were provided outside of the tool")),
+        command("service-level", "ServiceLevelCommand",
+                _("Manage service levels for this system")),
+        command("version", "VersionCommand", _("Print version information")),
+        command("remove", "RemoveCommand",
+                _("Remove all or specific subscriptions from this system"), True),
+        command("attach", "AttachCommand",
+                _("Attach a specified subscription to the registered system"), True),
+        command("plugins", "PluginsCommand",
+                _("View and configure subscription-manager plugins")),
+        command("auto-attach", "AutohealCommand",
+                _("Set if subscriptions are attached on a schedule (default of daily)")),
+        command("repo-override", "OverrideCommand",
+                _("Manage custom content repository settings")),
+    ]
+
+
+class ManagerCLI(CLI):
+
+    def __init__(self):
+        CLI.__init__(self, commands=manager_commands())
+
+    def main(self):
+        if self._find_best_match(sys.argv):
+            # Only once a command runs, identity imports the certificate
+            # and connection modules:
+            from subscription_manager import identity
+            identity.check_identity_cert_perms()
+        return CLI.main(self)
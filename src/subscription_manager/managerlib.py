@@ -20,7 +20,6 @@ import logging
 import os
 import re
 import shutil
-import stat
 import syslog
 
 from rhsm.config import initConfig
@@ -50,9 +49,6 @@ _ = gettext.gettext
 cfg = initConfig()
 ENT_CONFIG_DIR = cfg.get('rhsm', 'entitlementCertDir')
 
-# Expected permissions for identity certificates:
-ID_CERT_PERMS = stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP
-
 
 def system_log(message, priority=syslog.LOG_NOTICE):
     utils.system_log(message, priority)
@@ -804,28 +800,6 @@ def unregister(uep, consumer_uuid):
     clean_all_data(backup=False)
 
 
-# FIXME: move me to identity.py
-def check_identity_cert_perms():
-    """
-    Ensure the identity certs on this system have the correct permissions, and
-    fix them if not.
-    """
-    certs = [identity.ConsumerIdentity.keypath(), identity.ConsumerIdentity.certpath()]
-    for cert in certs:
-        if not os.path.exists(cert):
-            # Only relevant if these files exist.
-            continue
-        statinfo = os.stat(cert)
-        if statinfo[stat.ST_UID] != 0 or statinfo[stat.ST_GID] != 0:
-            os.chown(cert, 0, 0)
-            log.warn("Corrected incorrect ownership of %s." % cert)
-
-        mode = stat.S_IMODE(statinfo[stat.ST_MODE])
-        if mode != ID_CERT_PERMS:
-            os.chmod(cert, ID_CERT_PERMS)
-            log.warn("Corrected incorrect permissions on %s." % cert)
-
-
 def clean_all_data(backup=True):
     consumer_dir = cfg.get('rhsm', 'consumerCertDir')
     if backup:
@@ -863,12 +837,14 @@ def clean_all_data(backup=True):
 
     cache.ProfileManager.delete_cache()
     cache.InstalledProductsManager.delete_cache()
+    cache.UpdateRunCache.delete_cache()
     Facts.delete_cache()
 
     # Must also delete in-memory cache
     require(ENTITLEMENT_STATUS_CACHE).delete_cache()
     require(PROD_STATUS_CACHE).delete_cache()
     require(OVERRIDE_STATUS_CACHE).delete_cache()
+    require(POOLTYPE_CACHE).delete_cache()
     RepoActionInvoker.delete_repo_file()
     log.info("Cleaned local data")
 
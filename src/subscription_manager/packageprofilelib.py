@@ -11,9 +11,13 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 #
 
+import logging
+
 from subscription_manager import injection as inj
 from subscription_manager import certlib
 
+log = logging.getLogger('rhsm-app.' + __name__)
+
 
 class PackageProfileActionInvoker(certlib.BaseActionInvoker):
     """Used by rhsmcertd to update the profile
@@ -36,6 +40,11 @@ class PackageProfileActionCommand(object):
 
     def perform(self):
         profile_mgr = inj.require(inj.PROFILE_MANAGER)
+        if profile_mgr.rpmdb_unchanged():
+            log.debug("rpmdb unchanged, skipping package profile check.")
+            self.report._status = 0
+            return self.report
+
         consumer_identity = inj.require(inj.IDENTITY)
         ret = profile_mgr.update_check(self.uep, consumer_identity.uuid)
         self.report._status = ret
@@ -14,12 +14,63 @@
 #
 
 import gettext
-
-from yum.i18n import utf8_width
-from subscription_manager.utils import get_terminal_width
+import os
 
 _ = gettext.gettext
 
+# yum.i18n.utf8_width, see utf8_width():
+_yum_utf8_width = None
+
+
+def utf8_width(msg):
+    """
+    The number of columns msg takes on a terminal. Importing yum.i18n
+    imports all of yum, so it is only done once something is measured.
+    """
+    global _yum_utf8_width
+    if _yum_utf8_width is None:
+        from yum.i18n import utf8_width as _yum_utf8_width
+    return _yum_utf8_width(msg)
+
+
+# This code was modified by from
+# http://stackoverflow.com/questions/566746/how-to-get-console-window-width-in-python
+def get_terminal_width():
+    """
+    Attempt to determine the current terminal size.
+    """
+    dim = None
+    try:
+        def ioctl_gwinsz(fd):
+            try:
+                import fcntl
+                import struct
+                import termios
+                cr = struct.unpack('hh',
+                                fcntl.ioctl(fd,
+                                    termios.TIOCGWINSZ,
+                                    '1234'))
+            except Exception:
+                return
+            return cr
+
+        dim = ioctl_gwinsz(0) or ioctl_gwinsz(1) or ioctl_gwinsz(2)
+        if not dim:
+            try:
+                fd = os.open(os.ctermid(), os.O_RDONLY)
+                dim = ioctl_gwinsz(fd)
+                os.close(fd)
+            except Exception:
+                pass
+    except Exception:
+        pass
+
+    if dim:
+        return int(dim[1])
+    else:
+        # This allows tests to run
+        return 1000
+
 
 def ljust_wide(in_str, padding):
     return in_str + ' ' * (padding - utf8_width(in_str))
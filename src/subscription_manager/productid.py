@@ -18,7 +18,6 @@
 import gettext
 from gzip import GzipFile
 import logging
-import os
 import types
 import yum
 # for labelCompare
@@ -26,6 +25,7 @@ import rpm
 
 from rhsm.certificate import create_from_pem
 
+from subscription_manager import cachestore
 from subscription_manager.certdirectory import Directory
 from subscription_manager.injection import PLUGIN_MANAGER, require
 
@@ -56,38 +56,58 @@ class ProductIdRepoMap(DefaultDict):
 
 
 class ProductDatabase:
+    """
+    Map of product ids to the repos their packages were installed from,
+    in productid.js.
+
+    The map is loaded at most once per instance, the first time it is
+    used. Unlike the caches it cannot be fetched from the server again,
+    so it always stays in its own JSON file, whatever cache_backend is
+    configured.
+    """
 
     def __init__(self):
         self.dir = DatabaseDirectory()
         self.content = ProductIdRepoMap()
+        self._loaded = False
+        self._store = cachestore.FileStore()
         self.create()
 
     def add(self, product, repo):
+        self._load()
         self.content[product].append(repo)
 
     # TODO: need way to delete one prod->repo map
     def delete(self, product):
+        self._load()
         try:
             del self.content[product]
         except Exception:
             pass
 
     def find_repos(self, product):
+        self._load()
         return self.content.get(product, None)
 
     def create(self):
-        if not os.path.exists(self.__fn()):
+        if not self._store.exists(self.__fn()):
             self.write()
 
+    def _load(self):
+        if not self._loaded:
+            self.read()
+
     def read(self):
-        f = open(self.__fn())
+        self._loaded = True
         try:
-            d = json.load(f)
+            contents = self._store.read(self.__fn())
+            if contents is None:
+                return
+            d = json.loads(contents)
             # munge old format to new if need be
             self.populate_content(d)
         except Exception:
             pass
-        f.close()
 
     def populate_content(self, db_dict):
         """Populate map with info from a productid -> [repoids] map.
@@ -102,12 +122,13 @@ class ProductDatabase:
                 self.content[productid] = repo_data
 
     def write(self):
-        f = open(self.__fn(), 'w')
+        # Don't replace what is on disk with just our changes:
+        self._load()
         try:
-            json.dump(self.content, f, indent=2)
-        except Exception:
-            pass
-        f.close()
+            self._store.write(self.__fn(), json.dumps(self.content, indent=2))
+        except Exception, e:
+            log.error("Unable to write product database %s: %s" %
+                      (self.__fn(), e))
 
     def __fn(self):
         return self.dir.abspath('productid.js')
@@ -325,7 +346,6 @@ class ProductManager:
         if not product_db:
             self.db = ProductDatabase()
 
-        self.db.read()
         self.meta_data_errors = []
 
         self.plugin_manager = require(PLUGIN_MANAGER)
@@ -449,7 +469,7 @@ class ProductManager:
                         # desktop product cert is installed,
                         # delete the desktop product cert
                         pc.delete()
-                        self.pdir.refresh()  # must refresh to see the removal of the cert
+                        self.pdir.refresh(incremental=True)  # must refresh to see the removal of the cert
                         self.db.delete(pc.products[0].id)
                         self.db.write()
 
@@ -565,7 +585,7 @@ class ProductManager:
             fn = '%s.pem' % product.id
             path = self.pdir.abspath(fn)
             cert.write(path)
-            self.pdir.refresh()
+            self.pdir.refresh(incremental=True)
             log.info("Installed product cert %s: %s %s" % (product.id, product.name, cert.path))
             products_installed.append(cert)
         return products_installed
@@ -684,7 +704,7 @@ class ProductManager:
         for (product, cert) in certs_to_delete:
             log.info("product cert %s for %s is being deleted" % (product.id, product.id))
             cert.delete()
-            self.pdir.refresh()
+            self.pdir.refresh(incremental=True)
             #TODO: plugin hook for post_product_id_delete
 
             # it should be safe to delete it's entry now, we either dont
@@ -118,6 +118,8 @@ class RepoUpdateActionCommand(object):
 
         self.release = None
         self.overrides = {}
+        # Tags provided by installed products, see _get_provided_tags:
+        self._provided_tags = None
         self.override_supported = bool(self.uep and self.uep.supports_resource('content_overrides'))
         self.written_overrides = WrittenOverrideCache()
 
@@ -181,15 +183,19 @@ class RepoUpdateActionCommand(object):
 
         # Iterate content from entitlement certs, and create/delete each section
         # in the RepoFile as appropriate:
-        for cont in self.get_unique_content():
-            valid.add(cont.id)
+        for section in self.get_unique_sections():
+            valid.add(section.id)
+            # Most sections are already up to date, don't bother building
+            # a Repo for those to compare them property by property:
+            if not repo_file.needs_update(section):
+                continue
+            cont = section.to_repo()
             existing = repo_file.section(cont.id)
             if existing is None:
                 repo_file.add(cont)
                 self.report_add(cont)
-            else:
-                # Updates the existing repo with new content
-                self.update_repo(existing, cont)
+            # Updates the existing repo with new content
+            elif self.update_repo(existing, cont):
                 repo_file.update(existing)
                 self.report_update(existing)
 
@@ -208,18 +214,35 @@ class RepoUpdateActionCommand(object):
         return self.report
 
     def get_unique_content(self):
-        unique = set()
+        return set([section.to_repo() for section in self.get_unique_sections()])
+
+    def get_unique_sections(self):
+        """
+        A RepoSection for each repo id in the valid entitlement
+        certificates, the first one found for ids in more than one.
+        """
+        unique = {}
         if not self.manage_repos:
-            return unique
+            return []
         ent_certs = self.ent_dir.list_valid()
         baseurl = CFG.get('rhsm', 'baseurl')
         ca_cert = CFG.get('rhsm', 'repo_ca_cert')
         for ent_cert in ent_certs:
-            for r in self.get_content(ent_cert, baseurl, ca_cert):
-                unique.add(r)
-        return unique
+            for section in self.get_sections(ent_cert, baseurl, ca_cert):
+                unique.setdefault(section.id, section)
+        return unique.values()
+
+    def _get_provided_tags(self):
+        if self._provided_tags is None:
+            self._provided_tags = self.prod_dir.get_provided_tags()
+        return self._provided_tags
 
     def matching_content(self, ent_cert=None):
+        """
+        Returns a set of RepoContent for the yum content in ent_cert, or
+        all valid entitlement certificates, that this system has the
+        required tags for.
+        """
         if ent_cert:
             certs = [ent_cert]
         else:
@@ -231,7 +254,7 @@ class RepoUpdateActionCommand(object):
             if not cert.content:
                 continue
 
-            tags_we_have = self.prod_dir.get_provided_tags()
+            tags_we_have = self._get_provided_tags()
 
             for content in cert.content:
                 if not content.content_type in ALLOWED_CONTENT_TYPES:
@@ -246,16 +269,23 @@ class RepoUpdateActionCommand(object):
                             tag, content.label))
                         all_tags_found = False
                 if all_tags_found:
-                    lst.add(content)
+                    lst.add(RepoContent(content))
 
         return lst
 
     def get_content(self, ent_cert, baseurl, ca_cert):
+        return [section.to_repo() for section in
+                self.get_sections(ent_cert, baseurl, ca_cert)]
+
+    def get_sections(self, ent_cert, baseurl, ca_cert):
+        """
+        A RepoSection for each yum content set in ent_cert this system
+        has the required tags for.
+        """
         lst = []
 
         for content in self.matching_content(ent_cert):
-            content_id = content.label
-            repo = Repo(content_id)
+            repo = RepoSection(content.label)
             repo['name'] = content.name
             if content.enabled:
                 repo['enabled'] = "1"
@@ -400,6 +430,102 @@ class RepoUpdateActionCommand(object):
         self.report.repo_deleted.append(section)
 
 
+def _intern(value):
+    """
+    Intern strings which are repeated across many content sets, ie. the
+    same label and URLs appear in every entitlement for a product.
+    """
+    if isinstance(value, unicode):
+        try:
+            value = str(value)
+        except UnicodeEncodeError:
+            return value
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+
+def clean_repo_id(repo_id):
+    """
+    Format the config file id to contain only characters that yum expects
+    (we'll just replace 'bad' chars with -)
+    """
+    new_id = ""
+    valid_chars = string.ascii_letters + string.digits + "-_.:"
+    for byte in repo_id:
+        if byte not in valid_chars:
+            new_id += '-'
+        else:
+            new_id += byte
+
+    return new_id
+
+
+def _as_string(value):
+    # Sometimes we end up with ints, but values must be strings to compare
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+
+class RepoContent(object):
+    """
+    The parts of a certificate content set needed to generate its yum
+    repo. Much smaller than the certificate Content, as there can be
+    thousands of these when generating redhat.repo.
+    """
+    __slots__ = ('label', 'name', 'enabled', 'url', 'gpg', 'metadata_expire')
+
+    def __init__(self, content):
+        self.label = _intern(content.label)
+        self.name = content.name
+        self.enabled = content.enabled
+        self.url = _intern(content.url)
+        self.gpg = _intern(content.gpg)
+        self.metadata_expire = content.metadata_expire
+
+    def __eq__(self, other):
+        return isinstance(other, RepoContent) and (self.label == other.label)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.label)
+
+
+class RepoSection(object):
+    """
+    The values generated for a yum repo section, to compare with the
+    section in redhat.repo. Only turned into a Repo when the section has
+    to be added or updated.
+    """
+    __slots__ = ('id', 'values')
+
+    def __init__(self, repo_id, values=None):
+        self.id = clean_repo_id(repo_id)
+        # Like a Repo, starts out with the default of every property:
+        self.values = dict((key, default) for (key, (mutable, default))
+                           in Repo.PROPERTIES.items())
+        self.values.update(values or {})
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+    def items(self):
+        """ The values which would be written, as Repo.items(). """
+        return [(k, v) for (k, v) in self.values.items() if v]
+
+    def to_repo(self):
+        repo = Repo(self.id)
+        for (key, value) in self.values.items():
+            repo[key] = value
+        return repo
+
+
 class RepoActionReport(ActionReport):
     """Report class for reporting yum repo updates."""
     name = "Repo Updates"
@@ -446,6 +572,8 @@ class RepoActionReport(ActionReport):
         s.append(_('Deleted'))
         # deleted are former repo sections, but they are the same type
         s.append(self.format_sections(self.repo_deleted))
+        if self.timing:
+            s.append('Timing: %s' % self.format_timing())
         return '\n'.join(s)
 
 
@@ -490,19 +618,7 @@ class Repo(dict):
                 self[k] = d
 
     def _clean_id(self, repo_id):
-        """
-        Format the config file id to contain only characters that yum expects
-        (we'll just replace 'bad' chars with -)
-        """
-        new_id = ""
-        valid_chars = string.ascii_letters + string.digits + "-_.:"
-        for byte in repo_id:
-            if byte not in valid_chars:
-                new_id += '-'
-            else:
-                new_id += byte
-
-        return new_id
+        return clean_repo_id(repo_id)
 
     def items(self):
         """
@@ -665,6 +781,18 @@ class RepoFile(ConfigParser):
         if self.has_section(section):
             return Repo(section, self.items(section))
 
+    def needs_update(self, repo):
+        """
+        False if the section for repo, a Repo or RepoSection, already has
+        exactly the values repo would write, True if it differs or does
+        not exist yet.
+        """
+        if not self.has_section(repo.id):
+            return True
+        # Empty values are never written:
+        current = dict((k, _as_string(v)) for (k, v) in self.items(repo.id) if v)
+        return current != dict((k, _as_string(v)) for (k, v) in repo.items())
+
     def create(self):
         if os.path.exists(self.path) or not self.manage_repos:
             return
@@ -128,7 +128,7 @@ class RHELBrandPicker(entbranding.BrandPicker):
         if self.ent_certs:
             return self.ent_certs
         ent_dir = inj.require(inj.ENT_DIR)
-        ent_dir.refresh()
+        ent_dir.refresh(incremental=True)
         return ent_dir.list_valid()
 
     def _get_installed_branded_products(self, products):
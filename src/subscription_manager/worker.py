@@ -0,0 +1,468 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+The updates rhsmcertd runs, either in a new rhsmcertd-worker process
+each time, or in a resident worker which rhsmcertd starts once and then
+triggers over a local socket.
+
+The resident worker keeps its injected singletons, connections and
+certificate listings between updates. Before each update it compares a
+fingerprint of the consumer, entitlement and product certificate
+directories with the last one it took, and refreshes only what changed.
+
+With the adaptive schedule enabled, see UpdateSchedule, each update also
+tells rhsmcertd when to run the next one.
+"""
+
+from calendar import timegm
+import errno
+import gettext
+import hashlib
+import logging
+import os
+import socket
+import time
+
+from rhsm import connection
+from rhsm.config import initConfig
+
+from subscription_manager import action_client
+from subscription_manager import managerlib
+import subscription_manager.injection as inj
+from subscription_manager.cache import UpdateRunCache, rpmdb_fingerprint
+from subscription_manager.cert_sorter import CertSorter
+from subscription_manager.certdirectory import Path
+from subscription_manager.certindex import file_stat_key
+from subscription_manager.identity import ConsumerIdentity
+from subscription_manager.isodate import parse_date
+from subscription_manager.lock import LockTimeout
+
+_ = gettext.gettext
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+cfg = initConfig()
+
+SOCKET_PATH = '/var/run/rhsm/rhsmcertd-worker.sock'
+
+# The kinds of update, as rhsmcertd names them:
+CERT_CHECK = 'cert_check'
+AUTO_ATTACH = 'auto_attach'
+
+# Once an update is done, rhsmcertd reads the seconds until the next one
+# of the same kind from here:
+NEXT_RUN_PATH = '/var/run/rhsm/next_%s'
+
+# Requests the resident worker takes, one per connection and line:
+UPDATE = 'update'
+AUTOHEAL = 'autoheal'
+PING = 'ping'
+
+
+def update(autoheal=False, interval=None):
+    """
+    Update entitlement certificates and repositories, and attach
+    subscriptions first if autoheal and the system needs them.
+
+    interval is the number of seconds rhsmcertd waits between updates of
+    this kind. If given and the adaptive schedule is enabled, the update
+    is skipped when nothing can have changed, and the delay until the
+    next one is written for rhsmcertd.
+
+    Returns False if the system is not registered.
+    """
+    if not ConsumerIdentity.existsAndValid():
+        log.error('Either the consumer is not registered or the certificates' +
+                  ' are corrupted. Certificate update using daemon failed.')
+        return False
+
+    schedule = None
+    if interval and adaptive_schedule_enabled():
+        schedule = UpdateSchedule(autoheal, interval)
+        if schedule.can_skip():
+            log.info("Nothing changed since the last %s, skipping it" %
+                     schedule.kind)
+            schedule.write_next_delay()
+            return True
+
+    print _('Updating entitlement certificates & repositories')
+
+    # Every action reads the consumer and its status, only ask once:
+    inj.require(inj.CP_PROVIDER).cache_responses()
+
+    try:
+        if autoheal:
+            actionclient = action_client.HealingActionClient()
+        else:
+            actionclient = action_client.ActionClient()
+
+        actionclient.update(autoheal)
+
+        for update_report in actionclient.update_reports:
+            # FIXME: make sure we don't get None reports
+            if update_report:
+                print update_report
+
+        if actionclient.timing:
+            print actionclient.timing.format()
+
+    except connection.ExpiredIdentityCertException, e:
+        log.critical(_("Your identity certificate has expired"))
+        raise e
+    except connection.GoneException, ge:
+        uuid = ConsumerIdentity.read().getConsumerId()
+        if ge.deleted_id == uuid:
+            log.critical(_("This consumer's profile has been deleted from the server. Its local certificates will now be archived"))
+            managerlib.clean_all_data()
+            log.critical(_("Certificates archived to '/etc/pki/consumer.old'. Contact your system administrator if you need more information."))
+
+        raise ge
+
+    if schedule:
+        schedule.record_run()
+        schedule.write_next_delay()
+    return True
+
+
+def adaptive_schedule_enabled():
+    if not cfg.has_option('rhsmcertd', 'adaptiveSchedule'):
+        return False
+    try:
+        return (cfg.get_int('rhsmcertd', 'adaptiveSchedule') or 0) > 0
+    except ValueError, e:
+        log.warn(e)
+        return False
+
+
+def host_jitter(seconds, seed):
+    """
+    A number of seconds below seconds, always the same for seed but
+    spread evenly over hosts with different seeds.
+    """
+    if seconds < 1:
+        return 0
+    return int(hashlib.sha256(seed).hexdigest()[:8], 16) % int(seconds)
+
+
+def _epoch(date):
+    return timegm(date.utctimetuple())
+
+
+class UpdateSchedule(object):
+    """
+    Decides if an update of one kind can be skipped, and when the next
+    should run, from the entitlement status fetched last and what the
+    certificate directories looked like after the last update that ran.
+
+    An update is skipped if nothing in the certificate directories
+    changed since the last one ran, the system was compliant then, and
+    neither compliance nor any entitlement certificate runs out before
+    the update after this one. The last update which ran has to be less
+    than MAX_SKIPPED_INTERVALS intervals ago, so whatever changed on the
+    server is still picked up.
+
+    The next update is due an interval from now, plus up to
+    JITTER_FRACTION of it depending on the host, so the systems of a
+    fleet started together spread out over time. If compliance or an
+    entitlement certificate runs out before then, the next update is
+    brought forward to LEAD seconds ahead of it.
+    """
+
+    LEAD = 15 * 60
+    MIN_DELAY = 5 * 60
+    JITTER_FRACTION = 0.1
+    MAX_SKIPPED_INTERVALS = 4
+
+    def __init__(self, autoheal, interval):
+        self.kind = autoheal and AUTO_ATTACH or CERT_CHECK
+        self.interval = interval
+        self.identity = inj.require(inj.IDENTITY)
+        self.ent_dir = inj.require(inj.ENT_DIR)
+        self.prod_dir = inj.require(inj.PROD_DIR)
+        self.status_cache = inj.require(inj.ENTITLEMENT_STATUS_CACHE)
+        self.runs = UpdateRunCache()
+
+    def _fingerprints(self):
+        return [fingerprint(Path.abs(ConsumerIdentity.PATH)),
+                fingerprint(self.ent_dir.path),
+                fingerprint(self.prod_dir.path)]
+
+    def _compliance(self):
+        """
+        Whether the system was compliant as of the last status fetched,
+        and until when, in seconds since the epoch, if known.
+        """
+        status = None
+        if self.status_cache._cache_exists():
+            status = self.status_cache._read_cache()
+        if not status:
+            return (False, None)
+        until = None
+        if status.get('compliantUntil'):
+            until = _epoch(parse_date(status['compliantUntil']))
+        return (bool(status.get('compliant')), until)
+
+    def horizon(self, now):
+        """
+        When, after now, compliance or the first entitlement certificate
+        runs out, in seconds since the epoch. None if neither does.
+        """
+        ends = [_epoch(cert.valid_range.end()) for cert in self.ent_dir.list()]
+        ends.append(self._compliance()[1])
+        ends = [end for end in ends if end is not None and end > now]
+        if not ends:
+            return None
+        return min(ends)
+
+    def can_skip(self):
+        now = time.time()
+        last = self.runs.runs.get(self.kind)
+        if not last:
+            return False
+        since = now - last['time']
+        if since < 0 or since >= self.MAX_SKIPPED_INTERVALS * self.interval:
+            return False
+        if last['fingerprints'] != self._fingerprints():
+            return False
+        if not self._compliance()[0]:
+            return False
+        horizon = self.horizon(now)
+        return horizon is None or horizon - now >= self.interval + self.LEAD
+
+    def record_run(self):
+        """ Remember an update of this kind just ran. """
+        self.runs.runs[self.kind] = {'time': time.time(),
+                                     'fingerprints': self._fingerprints()}
+        self.runs.write_cache(debug=False)
+
+    def _seed(self):
+        if self.identity.is_valid():
+            return self.identity.uuid
+        return socket.gethostname()
+
+    def next_delay(self):
+        """ Seconds until the next update of this kind. """
+        now = time.time()
+        seed = self._seed()
+        delay = self.interval + host_jitter(self.interval * self.JITTER_FRACTION, seed)
+        horizon = self.horizon(now)
+        if horizon is not None:
+            early = horizon - now - self.LEAD + host_jitter(self.LEAD / 2, seed)
+            delay = min(delay, max(self.MIN_DELAY, early))
+        return int(delay)
+
+    def write_next_delay(self):
+        delay = self.next_delay()
+        path = NEXT_RUN_PATH % self.kind
+        try:
+            f = open(path, 'w')
+            try:
+                f.write("%d" % delay)
+            finally:
+                f.close()
+        except IOError, e:
+            log.warn("Unable to write %s: %s" % (path, e))
+            return
+        log.info("Next %s in %d seconds" % (self.kind, delay))
+
+
+def fingerprint(path):
+    """
+    A cheap summary of the files in the directory at path, which changes
+    whenever one is added, removed or rewritten. None if there is no
+    such directory.
+    """
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return None
+    result = []
+    for name in names:
+        try:
+            file_stat = os.stat(os.path.join(path, name))
+        except OSError:
+            # Removed since we listed the directory.
+            continue
+        result.append([name, file_stat_key(file_stat)])
+    return result
+
+
+class ResidentWorker(object):
+    """
+    Runs updates as rhsmcertd asks for them over a unix socket, until
+    rhsmcertd goes away.
+
+    A request is a single line, UPDATE or AUTOHEAL followed by the
+    interval in seconds between updates of that kind, or PING. It is
+    answered with a line holding the status rhsmcertd-worker would have
+    exited with: 0 on success, -1 otherwise.
+    """
+
+    # Seconds between checks that rhsmcertd is still there while idle:
+    IDLE_CHECK = 60
+    # Seconds to wait for a request once connected:
+    REQUEST_TIMEOUT = 30
+
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.socket_path = socket_path
+        self.identity = inj.require(inj.IDENTITY)
+        self.ent_dir = inj.require(inj.ENT_DIR)
+        self.prod_dir = inj.require(inj.PROD_DIR)
+        self.cp_provider = inj.require(inj.CP_PROVIDER)
+        self.parent_pid = os.getppid()
+        self.running = False
+        # The fingerprint taken at the last refresh, by directory:
+        self.fingerprints = {}
+
+        # Compliance has to be fetched again for every update, but a new
+        # CertSorter every time would also mean a new file monitor:
+        self._sorter = None
+        self._sorter_stale = False
+        inj.provide(inj.CERT_SORTER, self._get_sorter)
+
+    def _get_sorter(self):
+        if self._sorter is None:
+            self._sorter = CertSorter()
+        elif self._sorter_stale:
+            self._sorter.update_product_manager()
+            self._sorter.load()
+        self._sorter_stale = False
+        return self._sorter
+
+    def _changed(self, path):
+        # Fingerprint before refreshing, so anything changed while we
+        # refresh shows up next time:
+        current = fingerprint(path)
+        if path in self.fingerprints and self.fingerprints[path] == current:
+            return False
+        self.fingerprints[path] = current
+        return True
+
+    def refresh(self):
+        """
+        Pick up whatever changed on disk since the last update, and drop
+        what only holds for a single update.
+        """
+        if self._changed(Path.abs(ConsumerIdentity.PATH)):
+            log.debug("Consumer identity changed, reloading")
+            self.identity.reload()
+            self.cp_provider.clean()
+        if self._changed(self.ent_dir.path):
+            log.debug("Entitlement certificates changed, refreshing")
+            self.ent_dir.refresh(incremental=True)
+        if self._changed(self.prod_dir.path):
+            log.debug("Product certificates changed, refreshing")
+            self.prod_dir.refresh(incremental=True)
+        self._refresh_profile()
+        self.cp_provider.response_cache.clear()
+        self._sorter_stale = True
+
+    def _refresh_profile(self):
+        # The profile manager keeps the package profile it read last,
+        # which is stale once packages changed:
+        profile_mgr = inj.require(inj.PROFILE_MANAGER)
+        if profile_mgr._current_profile is None:
+            return
+        fingerprint = rpmdb_fingerprint()
+        if fingerprint is None or fingerprint != profile_mgr._rpmdb_fingerprint:
+            log.debug("rpmdb changed, reading the package profile again")
+            profile_mgr.current_profile = None
+            profile_mgr._rpmdb_fingerprint = None
+
+    def run(self, autoheal=False, interval=None):
+        """ Run an update, returning the worker's exit status. """
+        self.refresh()
+        try:
+            if update(autoheal, interval):
+                return 0
+        except LockTimeout, e:
+            # Another subscription-manager operation holds the action lock:
+            log.error(e)
+        except Exception, e:
+            log.error("Error while updating certificates using daemon")
+            log.exception(e)
+        return -1
+
+    def handle(self, conn):
+        """ Answer the request on the connection conn. """
+        conn.settimeout(self.REQUEST_TIMEOUT)
+        try:
+            request = conn.makefile('r').readline().split()
+            if request == [PING]:
+                status = 0
+            elif request and request[0] in (UPDATE, AUTOHEAL) and \
+                    self._valid_interval(request[1:]):
+                log.info("Resident worker running %s" % request[0])
+                interval = None
+                if request[1:]:
+                    interval = int(request[1])
+                status = self.run(request[0] == AUTOHEAL, interval)
+            else:
+                log.warn("Resident worker got unknown request: %r" % request)
+                status = -1
+            conn.sendall("%d\n" % status)
+        except socket.error, e:
+            log.warn("Resident worker lost its connection: %s" % e)
+
+    def _valid_interval(self, args):
+        return not args or (len(args) == 1 and args[0].isdigit())
+
+    def _listen(self):
+        if os.path.exists(self.socket_path):
+            # Left behind by a worker which did not get to clean up.
+            os.unlink(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0600)
+        sock.listen(5)
+        sock.settimeout(self.IDLE_CHECK)
+        return sock
+
+    def serve(self):
+        """
+        Take requests until stop() is called or rhsmcertd exits.
+        """
+        sock = self._listen()
+        log.info("Resident worker listening on %s" % self.socket_path)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    conn, addr = sock.accept()
+                except socket.timeout:
+                    if os.getppid() != self.parent_pid:
+                        log.info("rhsmcertd exited, stopping the resident worker")
+                        break
+                    continue
+                except socket.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.handle(conn)
+                finally:
+                    conn.close()
+        finally:
+            self.running = False
+            sock.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def stop(self):
+        """ Stop serving once the current request, if any, is done. """
+        self.running = False
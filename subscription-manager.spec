@@ -230,12 +230,15 @@ rm -rf %{buildroot}
 %{_datadir}/rhsm/subscription_manager/base_plugin.py*
 %{_datadir}/rhsm/subscription_manager/branding
 %{_datadir}/rhsm/subscription_manager/cache.py*
+%{_datadir}/rhsm/subscription_manager/cachestore.py*
 %{_datadir}/rhsm/subscription_manager/certdirectory.py*
+%{_datadir}/rhsm/subscription_manager/certindex.py*
 %{_datadir}/rhsm/subscription_manager/certlib.py*
 %{_datadir}/rhsm/subscription_manager/content_action_client.py*
 %{_datadir}/rhsm/subscription_manager/action_client.py*
 %{_datadir}/rhsm/subscription_manager/cert_sorter.py*
 %{_datadir}/rhsm/subscription_manager/cli.py*
+%{_datadir}/rhsm/subscription_manager/dateindex.py*
 %{_datadir}/rhsm/subscription_manager/dbus_interface.py*
 
 %{_datadir}/rhsm/subscription_manager/dmiinfo.py*
@@ -252,6 +255,7 @@ rm -rf %{buildroot}
 %{_datadir}/rhsm/subscription_manager/identitycertlib.py*
 %{_datadir}/rhsm/subscription_manager/injection.py*
 %{_datadir}/rhsm/subscription_manager/injectioninit.py*
+%{_datadir}/rhsm/subscription_manager/instrumentation.py*
 %{_datadir}/rhsm/subscription_manager/__init__.py*
 %{_datadir}/rhsm/subscription_manager/installedproductslib.py*
 %{_datadir}/rhsm/subscription_manager/jsonwrapper.py*
@@ -259,6 +263,7 @@ rm -rf %{buildroot}
 %{_datadir}/rhsm/subscription_manager/lock.py*
 %{_datadir}/rhsm/subscription_manager/logutil.py*
 %{_datadir}/rhsm/subscription_manager/managercli.py*
+%{_datadir}/rhsm/subscription_manager/managercommands.py*
 %{_datadir}/rhsm/subscription_manager/managerlib.py*
 %{_datadir}/rhsm/subscription_manager/models.py*
 %{_datadir}/rhsm/subscription_manager/packageprofilelib.py*
@@ -271,6 +276,7 @@ rm -rf %{buildroot}
 %{_datadir}/rhsm/subscription_manager/utils.py*
 %{_datadir}/rhsm/subscription_manager/printing_utils.py*
 %{_datadir}/rhsm/subscription_manager/validity.py*
+%{_datadir}/rhsm/subscription_manager/worker.py*
 %{_datadir}/rhsm/subscription_manager/reasons.py*
 %{_datadir}/rhsm/subscription_manager/cp_provider.py*
 %{_datadir}/rhsm/subscription_manager/file_monitor.py*
@@ -0,0 +1,170 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+A local HTTP server standing in for the entitlement server, for tests
+which need real requests and responses to go through python-rhsm.
+"""
+
+import BaseHTTPServer
+import httplib
+import threading
+
+from mock import patch
+
+from rhsm import connection
+from rhsm import ourjson as json
+
+
+class _PlainConnection(httplib.HTTPConnection):
+    """
+    Takes the place of HTTPSConnection, the stand-in server speaks
+    plain HTTP.
+    """
+
+    def __init__(self, host, port=None, context=None, **kwargs):
+        httplib.HTTPConnection.__init__(self, host, port, **kwargs)
+
+
+class StandInServer(object):
+    """
+    Serves the JSON resources set with put() on GET, along with an ETag
+    and a Last-Modified header, and answers 304 Not Modified to requests
+    carrying either of them if the resource did not change. Any POST, PUT
+    or DELETE is answered with 204 No Content.
+
+    Every request is recorded in requests as (method, path, headers,
+    response status), with the header names in lower case.
+
+    While started, the [server] configuration python-rhsm connections
+    use by default points at it.
+    """
+
+    HANDLER = "/candlepin"
+
+    def __init__(self):
+        self.resources = {}
+        self.requests = []
+        self._versions = 0
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                               self._handler_class())
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+        self._https_patcher = patch.object(connection.httplib,
+                                           'HTTPSConnection', _PlainConnection)
+        self._config_patcher = patch.object(connection.config, 'get',
+                                            self._config_get(connection.config.get))
+
+    def _config_get(self, config_get):
+        server_config = {
+            'hostname': '127.0.0.1',
+            'port': str(self.port),
+            'prefix': self.HANDLER,
+            'insecure': '1',
+        }
+
+        def get(section, option):
+            if section == 'server' and option in server_config:
+                return server_config[option]
+            return config_get(section, option)
+        return get
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                server._handle(self)
+
+            def do_POST(self):
+                server._handle_write(self)
+
+            do_PUT = do_POST
+            do_DELETE = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def put(self, path, data):
+        """
+        Create or replace the resource at path, relative to HANDLER.
+        """
+        self._versions += 1
+        last_modified = "Mon, 01 Dec 2014 00:00:%02d GMT" % (self._versions % 60)
+        self.resources[self.HANDLER + path] = (json.dumps(data),
+                '"%s"' % self._versions, last_modified)
+
+    def requested(self, path):
+        """ The requests for path, relative to HANDLER. """
+        return [request for request in self.requests
+                if request[1] == self.HANDLER + path]
+
+    def _handle_write(self, request):
+        headers = dict((name.lower(), value)
+                       for (name, value) in request.headers.items())
+        request.rfile.read(int(headers.get('content-length', 0)))
+        self.requests.append((request.command, request.path, headers, 204))
+        request.send_response(204)
+        request.end_headers()
+
+    def _handle(self, request):
+        headers = dict((name.lower(), value)
+                       for (name, value) in request.headers.items())
+
+        if request.path not in self.resources:
+            self.requests.append(('GET', request.path, headers, 404))
+            request.send_response(404)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+
+        (body, etag, last_modified) = self.resources[request.path]
+        if headers.get('if-none-match') == etag or \
+                headers.get('if-modified-since') == last_modified:
+            self.requests.append(('GET', request.path, headers, 304))
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.end_headers()
+            return
+
+        self.requests.append(('GET', request.path, headers, 200))
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.send_header('ETag', etag)
+        request.send_header('Last-Modified', last_modified)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self):
+        self._https_patcher.start()
+        self._config_patcher.start()
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+        self._config_patcher.stop()
+        self._https_patcher.stop()
+
+    def uep(self):
+        """ A connection to this server. """
+        return connection.UEPConnection()
@@ -15,10 +15,13 @@
 
 import StringIO
 from rhsm import config
+from rhsm.connection import RestlibException
 import random
+import re
 import mock
 import simplejson as json
 import tempfile
+import threading
 
 from subscription_manager.cert_sorter import CertSorter
 from subscription_manager.cache import EntitlementStatusCache, ProductStatusCache, \
@@ -288,6 +291,9 @@ class StubCertificateDirectory(EntitlementDirectory):
         if certificates is None:
             self.certs = []
         self.list_called = False
+        self._listing = None
+        self._loaded = {}
+        self._lock = threading.RLock()
 
     def list(self):
         self.list_called = True
@@ -448,6 +454,46 @@ class StubUEP:
         return []
 
 
+class StubPackageProfileServer(object):
+    """
+    Local stand-in for the package profile endpoints of a UEPConnection,
+    including the delta endpoint. Keeps the profile of each consumer so
+    tests can check what the server ends up with.
+    """
+    def __init__(self, supports_delta=True):
+        self.resources = ['packages']
+        if supports_delta:
+            self.resources.append('packages_delta')
+        self.profiles = {}
+        self.full_uploads = 0
+        self.delta_uploads = 0
+        # update_package_profile_delta() posts through uep.conn:
+        self.conn = self
+
+    def supports_resource(self, resource):
+        return resource in self.resources
+
+    def sanitize(self, url_param, plus=False):
+        return str(url_param)
+
+    def updatePackageProfile(self, uuid, pkg_dicts):
+        self.profiles[uuid] = list(pkg_dicts)
+        self.full_uploads += 1
+
+    def request_post(self, method, params=None, headers=None):
+        match = re.match("^/consumers/([^/]+)/packages/delta$", method)
+        if not match or not self.supports_resource('packages_delta'):
+            raise RestlibException(404, "Not found: %s" % method)
+        uuid = match.group(1)
+        if uuid not in self.profiles:
+            raise RestlibException(409, "No package profile for %s" % uuid)
+
+        profile = [pkg for pkg in self.profiles[uuid]
+                   if pkg not in params['removed']]
+        self.profiles[uuid] = profile + params['added']
+        self.delta_uploads += 1
+
+
 class StubBackend:
     def __init__(self, uep=StubUEP()):
         self.cp_provider = StubCPProvider()
@@ -574,6 +620,9 @@ class StubCPProvider(object):
     def clean(self):
         pass
 
+    def cache_responses(self):
+        pass
+
     def get_consumer_auth_cp(self):
         return self.consumer_auth_cp
 
@@ -589,30 +638,39 @@ class StubCPProvider(object):
 
 class StubEntitlementStatusCache(EntitlementStatusCache):
 
-    def write_cache(self):
+    def write_cache(self, debug=True):
         pass
 
     def delete_cache(self):
         self.server_status = None
 
+    def expire(self):
+        pass
+
 
 class StubProductStatusCache(ProductStatusCache):
 
-    def write_cache(self):
+    def write_cache(self, debug=True):
         pass
 
     def delete_cache(self):
         self.server_status = None
 
+    def expire(self):
+        pass
+
 
 class StubOverrideStatusCache(OverrideStatusCache):
 
-    def write_cache(self):
+    def write_cache(self, debug=True):
         pass
 
     def delete_cache(self):
         self.server_status = None
 
+    def expire(self):
+        pass
+
 
 class StubPool(object):
 
@@ -18,18 +18,27 @@ import shutil
 import socket
 import tempfile
 import threading
-from mock import Mock
+import time
+from mock import Mock, patch
 
 # used to get a user readable cfg class for test cases
 from stubs import StubProduct, StubProductCertificate, StubCertificateDirectory, \
-        StubEntitlementCertificate, StubPool, StubEntitlementDirectory
+        StubEntitlementCertificate, StubPool, StubEntitlementDirectory, \
+        StubPackageProfileServer
 from fixture import SubManFixture
+from standin import StandInServer
 
 from rhsm import ourjson as json
 from subscription_manager.cache import ProfileManager, \
         InstalledProductsManager, EntitlementStatusCache, \
-        PoolTypeCache
+        ProductStatusCache, OverrideStatusCache, \
+        PoolTypeCache, CacheWriter, WrittenOverrideCache, cache_writer, \
+        content_digest, DIGEST_SUFFIX, package_profile_delta, \
+        rpmdb_fingerprint, RPMDB_SUFFIX, finish_revalidations
 import subscription_manager.injection as inj
+from subscription_manager import cachestore
+from subscription_manager import cp_provider
+from subscription_manager.cp_provider import response_request
 from rhsm.profile import Package, RPMProfile
 
 from rhsm.connection import RestlibException, UnauthorizedException
@@ -308,16 +317,7 @@ class TestEntitlementStatusCache(SubManFixture):
         cache_file = os.path.join(cache_dir, 'status_cache.json')
         status_cache.CACHE_FILE = cache_file
         status_cache.write_cache()
-
-        def threadActive(name):
-            for thread in threading.enumerate():
-                if thread.getName() == name:
-                    return True
-            return False
-
-        # If the file exists, and the thread that writes it does not, we know writing has completed
-        while not (os.path.exists(cache_file) and not threadActive("WriteCacheEntitlementStatusCache")):
-            pass
+        cache_writer.flush()
         try:
             new_status_buf = open(cache_file).read()
             new_status = json.loads(new_status_buf)
@@ -331,6 +331,273 @@ class TestEntitlementStatusCache(SubManFixture):
         self.assertEquals(None, self.status_cache.load_status(uep, "aaa"))
 
 
+class TestStatusCacheFreshness(SubManFixture):
+
+    def setUp(self):
+        super(TestStatusCacheFreshness, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.status_cache = EntitlementStatusCache()
+        self.status_cache.CACHE_FILE = os.path.join(self.cache_dir, 'status.json')
+        self.status_cache.ttl = 60
+        self.status_cache.stale = 0
+        self.uep = Mock()
+        self.uep.getCompliance = Mock(return_value={"status": "new"})
+
+    def tearDown(self):
+        super(TestStatusCacheFreshness, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+
+    def _write_cache(self, age):
+        f = open(self.status_cache.CACHE_FILE, 'w')
+        f.write(json.dumps({"status": "cached"}))
+        f.close()
+        mtime = time.time() - age
+        os.utime(self.status_cache.CACHE_FILE, (mtime, mtime))
+
+    def test_disabled_by_default(self):
+        status_cache = EntitlementStatusCache()
+        self.assertEquals(0, status_cache.ttl)
+        self.assertEquals(0, status_cache.stale)
+
+    def test_fresh_cache_used(self):
+        self._write_cache(10)
+        status = self.status_cache.load_status(self.uep, "SOMEUUID")
+        self.assertEquals({"status": "cached"}, status)
+        self.assertFalse(self.uep.getCompliance.called)
+        self.assertEquals(None, self.status_cache._revalidating)
+
+    def test_old_cache_not_used(self):
+        self._write_cache(120)
+        status = self.status_cache.load_status(self.uep, "SOMEUUID")
+        self.assertEquals({"status": "new"}, status)
+        self.assertEquals(1, self.uep.getCompliance.call_count)
+        cache_writer.flush()
+
+    def test_no_cache(self):
+        status = self.status_cache.load_status(self.uep, "SOMEUUID")
+        self.assertEquals({"status": "new"}, status)
+        cache_writer.flush()
+
+    def test_force(self):
+        self._write_cache(10)
+        status = self.status_cache.load_status(self.uep, "SOMEUUID", force=True)
+        self.assertEquals({"status": "new"}, status)
+        cache_writer.flush()
+
+    def test_stale_cache_revalidated(self):
+        self.status_cache.stale = 60
+        self._write_cache(90)
+        status = self.status_cache.load_status(self.uep, "SOMEUUID")
+        self.assertEquals({"status": "cached"}, status)
+
+        self.status_cache._revalidating.join()
+        self.assertEquals(1, self.uep.getCompliance.call_count)
+        self.assertTrue(self.status_cache._cache_age() < 60)
+        self.assertEquals({"status": "new"}, self.status_cache._read_cache())
+
+    def test_revalidation_finished_at_exit(self):
+        self.status_cache.stale = 60
+        self._write_cache(90)
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def get_compliance(uuid):
+            started.set()
+            proceed.wait()
+            return {"status": "new"}
+        self.uep.getCompliance = Mock(side_effect=get_compliance)
+
+        status = self.status_cache.load_status(self.uep, "SOMEUUID")
+        started.wait()
+        # The status in use does not change under the main thread:
+        self.assertEquals({"status": "cached"}, status)
+        self.assertEquals({"status": "cached"}, self.status_cache._read_cache())
+
+        proceed.set()
+        finish_revalidations()
+        self.assertFalse(self.status_cache._revalidating.isAlive())
+        self.assertEquals({"status": "new"}, self.status_cache._read_cache())
+        self.assertTrue(cache_writer.is_pending(self.status_cache.CACHE_FILE))
+        cache_writer.flush()
+
+    def test_revalidation_abandoned_at_exit(self):
+        self.status_cache.stale = 60
+        self._write_cache(90)
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def get_compliance(uuid):
+            started.set()
+            proceed.wait()
+            raise socket.error("timed out")
+        self.uep.getCompliance = Mock(side_effect=get_compliance)
+
+        self.status_cache.load_status(self.uep, "SOMEUUID")
+        started.wait()
+        start = time.time()
+        finish_revalidations(0.1)
+        self.assertTrue(time.time() - start < 5)
+        self.assertTrue(self.status_cache._revalidating.isAlive())
+        self.assertEquals({"status": "cached"}, self.status_cache._read_cache())
+
+        proceed.set()
+        finish_revalidations()
+        self.assertFalse(self.status_cache._revalidating.isAlive())
+
+    def test_revalidation_after_fetch_discarded(self):
+        self.status_cache.stale = 60
+        self._write_cache(90)
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def get_compliance(uuid):
+            started.set()
+            proceed.wait()
+            return {"status": "old"}
+        self.uep.getCompliance = Mock(side_effect=get_compliance)
+        self.status_cache.load_status(self.uep, "SOMEUUID")
+        started.wait()
+
+        self.uep.getCompliance = Mock(return_value={"status": "new"})
+        status = self.status_cache.load_status(self.uep, "SOMEUUID", force=True)
+        proceed.set()
+        finish_revalidations()
+        self.assertEquals({"status": "new"}, status)
+        self.assertEquals({"status": "new"}, self.status_cache._read_cache())
+        cache_writer.flush()
+
+    def test_expire(self):
+        self._write_cache(10)
+        self.status_cache.expire()
+        status = self.status_cache.load_status(self.uep, "SOMEUUID")
+        self.assertEquals({"status": "new"}, status)
+        self.assertEquals(1, self.uep.getCompliance.call_count)
+        cache_writer.flush()
+
+    def test_expire_pending_write(self):
+        self.status_cache.server_status = {"status": "cached"}
+        self.status_cache.write_cache()
+        self.status_cache.expire()
+        self.assertFalse(cache_writer.is_pending(self.status_cache.CACHE_FILE))
+        self.assertTrue(self.status_cache._cache_age() > 60)
+
+    def test_expired_cache_used_when_disconnected(self):
+        self._write_cache(10)
+        self.status_cache.expire()
+        self.uep.getCompliance = Mock(side_effect=socket.error("boom"))
+        status = self.status_cache.load_status(self.uep, "SOMEUUID")
+        self.assertEquals({"status": "cached"}, status)
+
+
+class TestConditionalRequests(SubManFixture):
+
+    def setUp(self):
+        super(TestConditionalRequests, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.server = StandInServer()
+        self.server.start()
+        self.uep = self.server.uep()
+
+    def tearDown(self):
+        cache_writer.flush()
+        self.server.stop()
+        shutil.rmtree(self.cache_dir)
+        super(TestConditionalRequests, self).tearDown()
+
+    def _load_status(self, cache_class):
+        # A new cache each time, like a new process would have:
+        status_cache = cache_class()
+        status_cache.CACHE_FILE = os.path.join(self.cache_dir, 'status.json')
+        return status_cache.load_status(self.uep, 'abc')
+
+    def _statuses(self, path):
+        return [request[3] for request in self.server.requested(path)]
+
+    def test_not_modified(self):
+        self.server.put('/consumers/abc/compliance', {'status': 'valid'})
+        self.assertEquals({'status': 'valid'},
+                          self._load_status(EntitlementStatusCache))
+        self.assertEquals({'status': 'valid'},
+                          self._load_status(EntitlementStatusCache))
+
+        requests = self.server.requested('/consumers/abc/compliance')
+        self.assertEquals([200, 304], self._statuses('/consumers/abc/compliance'))
+        self.assertFalse('if-none-match' in requests[0][2])
+        self.assertEquals('"1"', requests[1][2]['if-none-match'])
+        self.assertEquals('Mon, 01 Dec 2014 00:00:01 GMT',
+                          requests[1][2]['if-modified-since'])
+
+    def test_modified(self):
+        self.server.put('/consumers/abc/content_overrides', [{'name': 'a'}])
+        self._load_status(OverrideStatusCache)
+        self.server.put('/consumers/abc/content_overrides', [{'name': 'b'}])
+
+        self.assertEquals([{'name': 'b'}], self._load_status(OverrideStatusCache))
+        self.assertEquals([{'name': 'b'}], self._load_status(OverrideStatusCache))
+        self.assertEquals([200, 200, 304],
+                          self._statuses('/consumers/abc/content_overrides'))
+
+    def test_product_status(self):
+        installed = [{'productId': '69', 'status': 'green'}]
+        self.server.put('/consumers/abc', {'uuid': 'abc',
+                                           'installedProducts': installed})
+        self.assertEquals(installed, self._load_status(ProductStatusCache))
+        self.assertEquals(installed, self._load_status(ProductStatusCache))
+        self.assertEquals([200, 304], self._statuses('/consumers/abc'))
+
+    def test_through_connection(self):
+        self.server.put('/consumers/abc/compliance', {'status': 'valid'})
+        request_response = response_request(self.uep.conn)
+        self.uep.conn.request_response = Mock(side_effect=request_response)
+        self._load_status(EntitlementStatusCache)
+        self.assertEquals(1, self.uep.conn.request_response.call_count)
+
+    def test_no_request_headers(self):
+        # python-rhsm which cannot send extra headers:
+        argspec = (['self', 'request_type', 'method', 'info'], None, None, None)
+        self.server.put('/consumers/abc/compliance', {'status': 'valid'})
+        with patch.object(cp_provider.inspect, 'getargspec',
+                          return_value=argspec):
+            self.assertEquals({'status': 'valid'},
+                              self._load_status(EntitlementStatusCache))
+            self.assertEquals({'status': 'valid'},
+                              self._load_status(EntitlementStatusCache))
+        self.assertEquals([200, 200], self._statuses('/consumers/abc/compliance'))
+        requests = self.server.requested('/consumers/abc/compliance')
+        self.assertFalse('if-none-match' in requests[1][2])
+
+    def test_deleted_cache(self):
+        self.server.put('/consumers/abc/compliance', {'status': 'valid'})
+        self._load_status(EntitlementStatusCache)
+        cache_writer.flush()
+        cachestore.get_store().delete(os.path.join(self.cache_dir, 'status.json'))
+
+        self.assertEquals({'status': 'valid'},
+                          self._load_status(EntitlementStatusCache))
+        self.assertEquals([200, 200], self._statuses('/consumers/abc/compliance'))
+
+    def test_pool_type_cache(self):
+        self._inject_mock_valid_consumer('abc')
+        self.set_consumer_auth_cp(self.uep)
+        path = '/consumers/abc/entitlements' \
+                '?exclude=certificates.key&exclude=certificates.cert'
+        self.server.put(path, [{'pool': {'id': 'poolid',
+                'calculatedAttributes': {'compliance_type': 'some type'}}}])
+
+        with patch.object(PoolTypeCache, 'CACHE_FILE',
+                          os.path.join(self.cache_dir, 'pool_types.json')):
+            pooltype_cache = PoolTypeCache()
+        pooltype_cache._do_update()
+        pooltype_cache._do_update()
+        self.assertEquals('some type', pooltype_cache.get('poolid'))
+        self.assertEquals([200, 304], self._statuses(path))
+
+        pooltype_cache.clear()
+        pooltype_cache._do_update()
+        self.assertEquals('some type', pooltype_cache.get('poolid'))
+        self.assertEquals([200, 304, 200], self._statuses(path))
+
+
 class TestPoolTypeCache(SubManFixture):
 
     def setUp(self):
@@ -341,6 +608,17 @@ class TestPoolTypeCache(SubManFixture):
         certs = [StubEntitlementCertificate(StubProduct('pid1'), pool=StubPool('someid'))]
         self.ent_dir = StubEntitlementDirectory(certificates=certs)
 
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file_patcher = patch.object(PoolTypeCache, 'CACHE_FILE',
+                os.path.join(self.cache_dir, 'pool_types.json'))
+        self.cache_file_patcher.start()
+
+    def tearDown(self):
+        cache_writer.flush()
+        self.cache_file_patcher.stop()
+        shutil.rmtree(self.cache_dir)
+        super(TestPoolTypeCache, self).tearDown()
+
     def test_empty_cache(self):
         pooltype_cache = PoolTypeCache()
         result = pooltype_cache.get("some id")
@@ -368,17 +646,59 @@ class TestPoolTypeCache(SubManFixture):
     def test_update(self):
         pooltype_cache = PoolTypeCache()
         pooltype_cache.ent_dir = self.ent_dir
+        self.cp.getPool.return_value = self._build_pool_json('someid', 'some type')
+
+        # Only the missing pool is looked up:
+        pooltype_cache.update()
+
+        self.cp.getPool.assert_called_once_with('someid', 'fixture_identity_mock_uuid')
+        self.assertFalse(self.cp.getEntitlementList.called)
+        self.assertEquals({'someid': 'some type'}, pooltype_cache.pooltype_map)
+
+    def test_update_many_missing(self):
+        pool_ids = ['poolid%s' % i for i in range(PoolTypeCache.POOL_LOOKUP_LIMIT + 1)]
+        self.ent_dir = StubEntitlementDirectory(certificates=[
+                StubEntitlementCertificate(StubProduct('pid1'), pool=StubPool(pool_id))
+                for pool_id in pool_ids])
         self.cp.getEntitlementList.return_value = [
-                self._build_ent_json('poolid', 'some type'),
-                self._build_ent_json('poolid2', 'some other type')]
+                self._build_ent_json(pool_id, 'some type') for pool_id in pool_ids]
+        pooltype_cache = PoolTypeCache()
+        pooltype_cache.ent_dir = self.ent_dir
 
-        # requires_update should be true, and should allow this method
-        # to generate a correct mapping
         pooltype_cache.update()
 
-        self.assertEquals(2, len(pooltype_cache.pooltype_map))
-        self.assertEquals('some type', pooltype_cache.get('poolid'))
-        self.assertEquals('some other type', pooltype_cache.get('poolid2'))
+        self.assertFalse(self.cp.getPool.called)
+        self.assertEquals(len(pool_ids), len(pooltype_cache.pooltype_map))
+
+    def test_update_evicts_detached(self):
+        pooltype_cache = PoolTypeCache()
+        pooltype_cache.ent_dir = self.ent_dir
+        pooltype_cache.pooltype_map = {'someid': 'some type', 'oldid': 'old type'}
+
+        pooltype_cache.update()
+
+        self.assertFalse(self.cp.getPool.called)
+        self.assertEquals({'someid': 'some type'}, pooltype_cache.pooltype_map)
+
+    def test_persisted(self):
+        inj.provide(inj.ENT_DIR, self.ent_dir)
+        self.cp.getPool.return_value = self._build_pool_json('someid', 'some type')
+        PoolTypeCache()
+        cache_writer.flush()
+
+        self.cp.getPool.reset_mock()
+        pooltype_cache = PoolTypeCache()
+        self.assertFalse(self.cp.getPool.called)
+        self.assertEquals('some type', pooltype_cache.get('someid'))
+
+    def test_delete_cache(self):
+        inj.provide(inj.ENT_DIR, self.ent_dir)
+        self.cp.getPool.return_value = self._build_pool_json('someid', 'some type')
+        pooltype_cache = PoolTypeCache()
+        pooltype_cache.delete_cache()
+
+        self.assertEquals('', pooltype_cache.get('someid'))
+        self.assertFalse(pooltype_cache._cache_exists())
 
     # This is populated when available subs are refreshed
     def test_update_from_pools(self):
@@ -414,3 +734,313 @@ class TestPoolTypeCache(SubManFixture):
 
     def _build_pool_json(self, pool_id, pool_type):
         return {'id': pool_id, 'calculatedAttributes': {'compliance_type': pool_type}}
+
+
+class TestCacheWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, 'cache.json')
+        # Long enough the background thread never writes during a test:
+        self.writer = CacheWriter(delay=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _read(self):
+        return json.loads(open(self.cache_file).read())
+
+    def test_write_deferred(self):
+        self.writer.write(self.cache_file, {'a': 1})
+        self.assertFalse(os.path.exists(self.cache_file))
+        self.assertTrue(self.writer.is_pending(self.cache_file))
+        self.writer.flush()
+        self.assertEquals({'a': 1}, self._read())
+        self.assertFalse(self.writer.is_pending(self.cache_file))
+
+    @patch('subscription_manager.cachestore.write_atomically')
+    def test_writes_coalesced(self, mock_write):
+        for i in range(5):
+            self.writer.write(self.cache_file, {'a': i})
+        self.writer.flush()
+        mock_write.assert_called_once_with(self.cache_file, json.dumps({'a': 4}))
+
+    def test_data_serialized_when_queued(self):
+        data = {'a': 1}
+        self.writer.write(self.cache_file, data)
+        data['a'] = 2
+        self.writer.flush()
+        self.assertEquals({'a': 1}, self._read())
+
+    def test_unserializable_data_raises(self):
+        self.assertRaises(TypeError, self.writer.write, self.cache_file,
+                          {'a': object()})
+        self.assertFalse(self.writer.is_pending(self.cache_file))
+
+    def test_flush_one_path(self):
+        other_file = os.path.join(self.cache_dir, 'other.json')
+        self.writer.write(self.cache_file, {'a': 1})
+        self.writer.write(other_file, {'b': 2})
+        self.writer.flush(self.cache_file)
+        self.assertEquals({'a': 1}, self._read())
+        self.assertTrue(self.writer.is_pending(other_file))
+
+    def test_discard(self):
+        self.writer.write(self.cache_file, {'a': 1})
+        self.writer.discard(self.cache_file)
+        self.writer.flush()
+        self.assertFalse(os.path.exists(self.cache_file))
+
+    def test_digest_written(self):
+        self.writer.write(self.cache_file, {'a': 1}, {DIGEST_SUFFIX: 'abc'})
+        self.writer.flush()
+        self.assertEquals('abc', open(self.cache_file + DIGEST_SUFFIX).read())
+
+    def test_stale_digest_removed(self):
+        open(self.cache_file + DIGEST_SUFFIX, 'w').write('abc')
+        self.writer.write(self.cache_file, {'a': 1})
+        self.writer.flush()
+        self.assertFalse(os.path.exists(self.cache_file + DIGEST_SUFFIX))
+
+    @patch('os.rename', side_effect=OSError("boom"))
+    def test_failed_write_leaves_old_cache(self, mock_rename):
+        open(self.cache_file, 'w').write('{"a": 1}')
+        self.writer.write(self.cache_file, {'a': 2})
+        self.writer.flush()
+        self.assertEquals({'a': 1}, self._read())
+        self.assertEquals(['cache.json'], os.listdir(self.cache_dir))
+
+    def test_background_write(self):
+        writer = CacheWriter(delay=0)
+        writer.write(self.cache_file, {'a': 1})
+        writer._thread.join(0.1)
+        for i in range(100):
+            if not writer.is_pending(self.cache_file):
+                break
+            writer._thread.join(0.1)
+        writer.flush()
+        self.assertEquals({'a': 1}, self._read())
+
+
+class TestCacheManagerWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+        class TempOverrideCache(WrittenOverrideCache):
+            CACHE_FILE = os.path.join(self.cache_dir, 'written_overrides.json')
+
+        self.cache = TempOverrideCache(overrides={'repo': {'enabled': '1'}})
+
+    def tearDown(self):
+        cache_writer.discard(self.cache.CACHE_FILE)
+        shutil.rmtree(self.cache_dir)
+
+    def test_read_sees_queued_write(self):
+        self.cache.write_cache()
+        self.assertTrue(self.cache._cache_exists())
+        self.assertEquals({'repo': {'enabled': '1'}}, self.cache._read_cache())
+
+    def test_delete_drops_queued_write(self):
+        self.cache.write_cache()
+        self.cache.delete_cache()
+        self.assertFalse(self.cache._cache_exists())
+        cache_writer.flush()
+        self.assertFalse(os.path.exists(self.cache.CACHE_FILE))
+
+
+class TestCacheDigests(SubManFixture):
+
+    def setUp(self):
+        super(TestCacheDigests, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        pkgs = [Package(name="package1", version="1.0.0", release=1, arch="x86_64"),
+                Package(name="package2", version="2.0.0", release=2, arch="x86_64")]
+        self.profile_mgr = self._profile_mgr(pkgs)
+
+    def tearDown(self):
+        super(TestCacheDigests, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+
+    def _profile_mgr(self, packages):
+        profile_mgr = ProfileManager(
+                current_profile=TestProfileManager._mock_pkg_profile(packages))
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        return profile_mgr
+
+    def test_content_digest_stable(self):
+        self.assertEquals(content_digest({'a': 1, 'b': [1, 2]}),
+                          content_digest({'b': [1, 2], 'a': 1}))
+        self.assertNotEquals(content_digest({'a': 1}), content_digest({'a': 2}))
+
+    def test_unchanged_without_reading_cache(self):
+        self.profile_mgr.write_cache()
+        self.profile_mgr._read_cache = Mock()
+        self.assertFalse(self.profile_mgr.has_changed())
+        self.assertFalse(self.profile_mgr._read_cache.called)
+
+    def test_package_order_ignored(self):
+        self.profile_mgr.write_cache()
+        reordered = self._profile_mgr([
+                Package(name="package2", version="2.0.0", release=2, arch="x86_64"),
+                Package(name="package1", version="1.0.0", release=1, arch="x86_64")])
+        self.assertFalse(reordered.has_changed())
+
+    def test_changed(self):
+        self.profile_mgr.write_cache()
+        updated = self._profile_mgr([
+                Package(name="package1", version="1.0.0", release=1, arch="x86_64"),
+                Package(name="package2", version="2.0.1", release=1, arch="x86_64")])
+        updated._read_cache = Mock()
+        self.assertTrue(updated.has_changed())
+        self.assertFalse(updated._read_cache.called)
+
+    def test_cache_without_digest(self):
+        self.profile_mgr.write_cache()
+        cache_writer.flush()
+        os.remove(self.profile_mgr.CACHE_FILE + DIGEST_SUFFIX)
+
+        self.assertFalse(self.profile_mgr.has_changed())
+        # The digest is stored for next time:
+        self.assertEquals(self.profile_mgr.digest(self.profile_mgr.to_dict()),
+                          self.profile_mgr._read_digest())
+
+    def test_delete_removes_digest(self):
+
+        class TempInstalledProductsManager(InstalledProductsManager):
+            CACHE_FILE = os.path.join(self.cache_dir, 'installed_products.json')
+
+        mgr = TempInstalledProductsManager()
+        mgr.write_cache()
+        cache_writer.flush()
+        self.assertFalse(mgr.has_changed())
+        mgr.delete_cache()
+        self.assertEquals([], os.listdir(self.cache_dir))
+
+
+PACKAGE1 = Package(name="package1", version="1.0.0", release=1, arch="x86_64")
+PACKAGE2 = Package(name="package2", version="2.0.0", release=2, arch="x86_64")
+PACKAGE2_UPDATE = Package(name="package2", version="2.0.1", release=1, arch="x86_64")
+PACKAGE3 = Package(name="package3", version="3.0.0", release=3, arch="x86_64")
+
+
+class TestProfileDeltaUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.server = StubPackageProfileServer()
+        self._upload([PACKAGE1, PACKAGE2, PACKAGE3], force=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _upload(self, packages, force=False):
+        profile_mgr = ProfileManager(
+                current_profile=TestProfileManager._mock_pkg_profile(packages))
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr.update_check(self.server, 'UUID', force)
+        cache_writer.flush()
+        return profile_mgr
+
+    def test_package_profile_delta(self):
+        (added, removed) = package_profile_delta(
+                [PACKAGE1.to_dict(), PACKAGE2.to_dict()],
+                [PACKAGE2_UPDATE.to_dict(), PACKAGE1.to_dict(), PACKAGE3.to_dict()])
+        self.assertEquals([PACKAGE2_UPDATE.to_dict(), PACKAGE3.to_dict()], added)
+        self.assertEquals([PACKAGE2.to_dict()], removed)
+
+    def test_delta_uploaded(self):
+        profile_mgr = self._upload([PACKAGE1, PACKAGE2_UPDATE, PACKAGE3])
+        self.assertEquals(1, self.server.full_uploads)
+        self.assertEquals(1, self.server.delta_uploads)
+        self.assertFalse(profile_mgr.has_changed())
+        self.assertEquals(
+                sorted(profile_mgr.to_dict()),
+                sorted(self.server.profiles['UUID']))
+
+    def test_full_upload_without_server_support(self):
+        self.server.resources.remove('packages_delta')
+        self._upload([PACKAGE1, PACKAGE2_UPDATE, PACKAGE3])
+        self.assertEquals(2, self.server.full_uploads)
+        self.assertEquals(0, self.server.delta_uploads)
+
+    def test_full_upload_when_delta_rejected(self):
+        # ie. the server lost the profile we are sending changes against:
+        del self.server.profiles['UUID']
+        self._upload([PACKAGE1, PACKAGE2_UPDATE, PACKAGE3])
+        self.assertEquals(2, self.server.full_uploads)
+        self.assertEquals(3, len(self.server.profiles['UUID']))
+
+    def test_full_upload_when_forced(self):
+        self._upload([PACKAGE1, PACKAGE2_UPDATE, PACKAGE3], force=True)
+        self.assertEquals(2, self.server.full_uploads)
+
+    def test_full_upload_when_smaller(self):
+        self._upload([PACKAGE2_UPDATE])
+        self.assertEquals(2, self.server.full_uploads)
+        self.assertEquals([PACKAGE2_UPDATE.to_dict()], self.server.profiles['UUID'])
+
+
+class TestRpmdbFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.rpmdb_dir = tempfile.mkdtemp()
+        self._write('Packages', 'packages')
+        self._write('Name', 'names')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.rpmdb_dir)
+
+    def _write(self, name, contents):
+        f = open(os.path.join(self.rpmdb_dir, name), 'w')
+        f.write(contents)
+        f.close()
+
+    def test_no_rpmdb(self):
+        self.assertEquals(None, rpmdb_fingerprint(os.path.join(self.rpmdb_dir, 'nope')))
+        shutil.rmtree(self.rpmdb_dir)
+        os.mkdir(self.rpmdb_dir)
+        self.assertEquals(None, rpmdb_fingerprint(self.rpmdb_dir))
+
+    def test_fingerprint(self):
+        fingerprint = rpmdb_fingerprint(self.rpmdb_dir)
+        self.assertEquals(fingerprint, rpmdb_fingerprint(self.rpmdb_dir))
+
+        # Touched by every rpm query:
+        self._write('__db.001', 'environment')
+        self.assertEquals(fingerprint, rpmdb_fingerprint(self.rpmdb_dir))
+
+        self._write('Packages', 'more packages')
+        self.assertNotEquals(fingerprint, rpmdb_fingerprint(self.rpmdb_dir))
+
+    def _profile_mgr(self):
+        profile_mgr = ProfileManager()
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr._get_profile = Mock(
+                return_value=TestProfileManager._mock_pkg_profile([PACKAGE1]))
+        return profile_mgr
+
+    def test_fingerprint_stored_with_profile(self):
+        fingerprint = rpmdb_fingerprint(self.rpmdb_dir)
+        profile_mgr = self._profile_mgr()
+        with patch('subscription_manager.cache.rpmdb_fingerprint',
+                   return_value=fingerprint):
+            self.assertFalse(profile_mgr.rpmdb_unchanged())
+            profile_mgr.current_profile
+            profile_mgr.write_cache()
+            self.assertTrue(profile_mgr.rpmdb_unchanged())
+        self.assertEquals(fingerprint, profile_mgr._read_sidecar(RPMDB_SUFFIX))
+
+        with patch('subscription_manager.cache.rpmdb_fingerprint',
+                   return_value='changed'):
+            self.assertFalse(self._profile_mgr().rpmdb_unchanged())
+
+    def test_given_profile_not_fingerprinted(self):
+        profile_mgr = ProfileManager(
+                current_profile=TestProfileManager._mock_pkg_profile([PACKAGE1]))
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr.write_cache()
+        cache_writer.flush()
+        self.assertFalse(os.path.exists(profile_mgr.CACHE_FILE + RPMDB_SUFFIX))
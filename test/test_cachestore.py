@@ -0,0 +1,213 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from rhsm import ourjson as json
+from subscription_manager import cachestore
+from subscription_manager.cachestore import FileStore, SqliteStore, \
+        DIGEST_SUFFIX
+from subscription_manager.cache import WrittenOverrideCache, cache_writer
+
+
+class StoreTests(object):
+    """
+    Tests every store has to pass, mixed into a TestCase per store.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, 'cache.json')
+        self.store = self._create_store()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_no_cache(self):
+        self.assertFalse(self.store.exists(self.path))
+        self.assertEquals(None, self.store.read(self.path))
+        self.assertEquals(None, self.store.read_sidecar(self.path, DIGEST_SUFFIX))
+        self.assertEquals(None, self.store.mtime(self.path))
+        self.assertFalse(self.store.delete(self.path))
+
+    def test_write_and_read(self):
+        self.store.write(self.path, json.dumps({'a': 1, 'b': [2]}),
+                         {DIGEST_SUFFIX: 'abc'})
+        self.assertTrue(self.store.exists(self.path))
+        self.assertEquals({'a': 1, 'b': [2]}, json.loads(self.store.read(self.path)))
+        self.assertEquals('abc', self.store.read_sidecar(self.path, DIGEST_SUFFIX))
+
+    def test_write_replaces_sidecars(self):
+        self.store.write(self.path, '{}', {DIGEST_SUFFIX: 'abc'})
+        self.store.write(self.path, '{}')
+        self.assertEquals(None, self.store.read_sidecar(self.path, DIGEST_SUFFIX))
+
+    def test_mtime(self):
+        self.store.write(self.path, '{}')
+        self.assertTrue(self.store.mtime(self.path) > 0)
+        self.store.set_mtime(self.path, 0)
+        self.assertEquals(0, self.store.mtime(self.path))
+
+    def test_delete(self):
+        self.store.write(self.path, '{}', {DIGEST_SUFFIX: 'abc'})
+        self.assertTrue(self.store.delete(self.path))
+        self.assertFalse(self.store.exists(self.path))
+        self.assertEquals(None, self.store.read_sidecar(self.path, DIGEST_SUFFIX))
+
+    def test_write_many(self):
+        other_path = os.path.join(self.cache_dir, 'other.json')
+        failed = self.store.write_many([(self.path, '{"a": 1}', {}),
+                                        (other_path, '{"b": 2}', None)])
+        self.assertEquals([], failed)
+        self.assertEquals({'a': 1}, json.loads(self.store.read(self.path)))
+        self.assertEquals({'b': 2}, json.loads(self.store.read(other_path)))
+
+
+class FileStoreTests(StoreTests, unittest.TestCase):
+
+    def _create_store(self):
+        return FileStore()
+
+    def test_files(self):
+        self.store.write(self.path, '{}', {DIGEST_SUFFIX: 'abc'})
+        self.assertEquals(['cache.json', 'cache.json.digest'],
+                          sorted(os.listdir(self.cache_dir)))
+
+    def test_synced_before_rename(self):
+        calls = []
+        fsync = os.fsync
+        rename = os.rename
+
+        def record_fsync(fd):
+            calls.append('fsync')
+            fsync(fd)
+
+        def record_rename(src, dst):
+            calls.append('rename')
+            rename(src, dst)
+
+        with patch.object(cachestore.os, 'fsync', record_fsync):
+            with patch.object(cachestore.os, 'rename', record_rename):
+                cachestore.write_atomically(self.path, '{}')
+        # The file before it is renamed, then the directory:
+        self.assertEquals(['fsync', 'rename', 'fsync'], calls)
+        self.assertEquals('{}', self.store.read(self.path))
+
+
+class SqliteStoreTests(StoreTests, unittest.TestCase):
+
+    def _create_store(self):
+        return SqliteStore(os.path.join(self.cache_dir, 'db', 'cache.db'))
+
+    def _write_file(self, path, contents):
+        f = open(path, 'w')
+        f.write(contents)
+        f.close()
+
+    def test_migrate(self):
+        self._write_file(self.path, '{"a": 1}')
+        self._write_file(self.path + DIGEST_SUFFIX, 'abc')
+        os.utime(self.path, (1000, 1000))
+
+        self.assertEquals({'a': 1}, json.loads(self.store.read(self.path)))
+        self.assertEquals('abc', self.store.read_sidecar(self.path, DIGEST_SUFFIX))
+        self.assertEquals(1000, self.store.mtime(self.path))
+        self.assertEquals(['db'], os.listdir(self.cache_dir))
+
+    def test_delete_unmigrated(self):
+        self._write_file(self.path, '{"a": 1}')
+        self.assertTrue(self.store.delete(self.path))
+        self.assertFalse(self.store.exists(self.path))
+
+    def test_write_many_is_atomic(self):
+        other_path = os.path.join(self.cache_dir, 'other.json')
+        self.store.write(self.path, '{"a": 1}')
+        failed = self.store.write_many([(self.path, '{"a": 2}', {}),
+                                        (other_path, '{}', {'.bad': None})])
+        self.assertEquals([self.path, other_path], [path for (path, e) in failed])
+        self.assertEquals({'a': 1}, json.loads(self.store.read(self.path)))
+        self.assertFalse(self.store.exists(other_path))
+
+    def test_shared_between_stores(self):
+        self.store.write(self.path, '{"a": 1}')
+        other_store = SqliteStore(self.store.db_path)
+        self.assertEquals({'a': 1}, json.loads(other_store.read(self.path)))
+
+
+class CacheManagerSqliteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.store = SqliteStore(os.path.join(self.cache_dir, 'cache.db'))
+        self.store_patcher = patch.object(cachestore, '_store', self.store)
+        self.store_patcher.start()
+
+        class TempOverrideCache(WrittenOverrideCache):
+            CACHE_FILE = os.path.join(self.cache_dir, 'written_overrides.json')
+        self.cache_class = TempOverrideCache
+
+    def tearDown(self):
+        self.store_patcher.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_write_and_read(self):
+        overrides = {'repo': {'enabled': '1'}, 'other': {'enabled': '0'}}
+        self.cache_class(overrides=overrides).write_cache()
+        cache_writer.flush()
+
+        cache = self.cache_class()
+        self.assertTrue(cache._cache_exists())
+        self.assertEquals(overrides, cache._read_cache())
+        self.assertEquals(['cache.db'], os.listdir(self.cache_dir))
+
+        self.cache_class.delete_cache()
+        self.assertFalse(cache._cache_exists())
+
+    def test_existing_cache_migrated(self):
+        f = open(self.cache_class.CACHE_FILE, 'w')
+        f.write('{"repo": {"enabled": "1"}}')
+        f.close()
+
+        self.assertEquals({'repo': {'enabled': '1'}},
+                          self.cache_class()._read_cache())
+        self.assertEquals(['cache.db'], os.listdir(self.cache_dir))
+
+
+class GetStoreTests(unittest.TestCase):
+
+    def _create_store(self, backend):
+        with patch.object(cachestore, 'cfg') as mock_cfg:
+            mock_cfg.has_option.return_value = backend is not None
+            mock_cfg.get.return_value = backend
+            return cachestore._create_store()
+
+    def test_default(self):
+        self.assertTrue(isinstance(self._create_store(None), FileStore))
+        self.assertTrue(isinstance(self._create_store('json'), FileStore))
+
+    def test_sqlite(self):
+        self.assertTrue(isinstance(self._create_store('sqlite'), SqliteStore))
+
+    def test_unknown(self):
+        self.assertTrue(isinstance(self._create_store('bogus'), FileStore))
+
+    @patch.object(cachestore, 'sqlite3', None)
+    def test_no_sqlite(self):
+        self.assertTrue(isinstance(self._create_store('sqlite'), FileStore))
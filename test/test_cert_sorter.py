@@ -236,6 +236,30 @@ class CertSorterTests(SubManFixture):
 
         self.assertEquals(3, len(sorter.valid_entitlement_certs))
 
+    def test_scan_on_date(self):
+        prod_dir = StubProductDirectory(pids=["a", "e"])
+        ent_dir = StubEntitlementDirectory([
+            StubEntitlementCertificate(StubProduct("a")),
+            StubEntitlementCertificate(StubProduct("e"),
+                start_date=datetime.now() + timedelta(days=365),
+                end_date=datetime.now() + timedelta(days=730)),
+            ])
+
+        inj.provide(inj.PROD_DIR, prod_dir)
+        inj.provide(inj.ENT_DIR, ent_dir)
+
+        sorter = StubCertSorter()
+        sorter.on_date = datetime.now() + timedelta(days=500)
+        sorter._scan_entitlement_certs()
+
+        self.assertEquals(["a"], sorter.expired_products.keys())
+        self.assertEquals([], sorter.future_products.keys())
+        self.assertEquals(1, len(sorter.valid_entitlement_certs))
+        self.assertFalse(sorter.in_warning_period())
+
+        sorter.on_date = datetime.now() + timedelta(days=700)
+        self.assertTrue(sorter.in_warning_period())
+
     def test_get_system_status(self):
         self.assertEquals('Invalid', self.sorter.get_system_status())
         self.sorter.system_status = 'valid'
@@ -15,13 +15,22 @@
 
 import unittest
 import os
+import shutil
+import tempfile
+import threading
+import time
 
-from mock import patch
+from mock import patch, Mock
 
+import certdata
 from stubs import StubProduct, StubEntitlementCertificate, \
     StubProductCertificate
+from rhsm.certificate import create_from_file
 from subscription_manager.certdirectory import Path, EntitlementDirectory, \
-    ProductDirectory
+    ProductDirectory, CertificateDirectory
+from subscription_manager import certindex
+from subscription_manager.certindex import CertificateIndex, \
+    parse_cert_files, cert_to_dict, is_decoded
 from subscription_manager.repolib import RepoFile
 from subscription_manager.productid import ProductDatabase
 
@@ -126,3 +135,328 @@ class ProductDirectoryTest(unittest.TestCase):
         pd.list = lambda: [StubProductCertificate(top_product, provided_products)]
         installed_products = pd.get_installed_products()
         self.assertTrue("top" in installed_products)
+
+
+class CertificateIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cert_dir_path = tempfile.mkdtemp(prefix='subman-certdir-')
+        self.index_path = os.path.join(tempfile.mkdtemp(prefix='subman-index-'),
+                                       'cert_index.json')
+
+        class TempCertificateDirectory(CertificateDirectory):
+            INDEX_PATH = self.index_path
+
+        self.dir_class = TempCertificateDirectory
+        self.write_cert('1.pem', certdata.ENTITLEMENT_CERT_V3_0)
+        self.write_cert('2.pem', certdata.PRODUCT_CERT_V1_0)
+
+    def tearDown(self):
+        shutil.rmtree(self.cert_dir_path)
+        shutil.rmtree(os.path.dirname(self.index_path))
+
+    def write_cert(self, filename, pem):
+        f = open(os.path.join(self.cert_dir_path, filename), 'w')
+        f.write(pem)
+        f.close()
+
+    def test_index_written(self):
+        self.dir_class(self.cert_dir_path).list()
+        self.assertTrue(os.path.exists(self.index_path))
+
+    def test_unchanged_certs_not_parsed(self):
+        parsed = self.dir_class(self.cert_dir_path).list()
+
+        with patch('subscription_manager.certdirectory.create_from_file') as mock_create:
+            indexed = self.dir_class(self.cert_dir_path).list()
+            self.assertEquals(0, mock_create.call_count)
+
+        self.assertEquals(len(parsed), len(indexed))
+        for (parsed_cert, indexed_cert) in zip(parsed, indexed):
+            self.assertEquals(parsed_cert.serial, indexed_cert.serial)
+            self.assertEquals(parsed_cert.valid_range.begin(),
+                              indexed_cert.valid_range.begin())
+            self.assertEquals(parsed_cert.valid_range.end(),
+                              indexed_cert.valid_range.end())
+            self.assertEquals([p.id for p in parsed_cert.products],
+                              [p.id for p in indexed_cert.products])
+
+    def test_entitlement_fields(self):
+        parsed = [c for c in self.dir_class(self.cert_dir_path).list()
+                  if hasattr(c, 'order')][0]
+        indexed = [c for c in self.dir_class(self.cert_dir_path).list()
+                   if hasattr(c, 'order')][0]
+
+        self.assertEquals(parsed.order.name, indexed.order.name)
+        self.assertEquals(parsed.order.stacking_id, indexed.order.stacking_id)
+        self.assertEquals(parsed.pool, indexed.pool)
+        self.assertEquals([c.label for c in parsed.content],
+                          [c.label for c in indexed.content])
+        self.assertEquals([c.enabled for c in parsed.content],
+                          [c.enabled for c in indexed.content])
+        self.assertEquals(parsed.key_path(), indexed.key_path())
+        # Raw data is read back from the file on demand:
+        self.assertEquals(parsed.pem, indexed.pem)
+
+    def test_content_decoded_on_demand(self):
+        parsed = [c for c in self.dir_class(self.cert_dir_path).list()
+                  if hasattr(c, 'order')][0]
+        cert_dir = self.dir_class(self.cert_dir_path)
+        cert_dir.list_valid()
+        cert_dir.list_expired()
+        indexed = [c for c in cert_dir.list() if hasattr(c, 'order')][0]
+        self.assertEquals(parsed.order.sku, indexed.order.sku)
+        self.assertFalse(is_decoded(indexed, 'content'))
+        self.assertFalse(is_decoded(indexed, 'products'))
+
+        self.assertEquals([c.label for c in parsed.content],
+                          [c.label for c in indexed.content])
+        self.assertTrue(is_decoded(indexed, 'content'))
+        self.assertFalse(is_decoded(indexed, 'products'))
+
+    def test_decoded_once_across_threads(self):
+        self.dir_class(self.cert_dir_path).list()
+        indexed = [c for c in self.dir_class(self.cert_dir_path).list()
+                   if hasattr(c, 'order')][0]
+        loads = certindex.json.loads
+
+        def slow_loads(*args, **kwargs):
+            time.sleep(0.05)
+            return loads(*args, **kwargs)
+
+        results = []
+
+        def read():
+            results.append(indexed.products)
+
+        with patch.object(certindex.json, 'loads', slow_loads):
+            threads = [threading.Thread(target=read) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEquals(4, len(results))
+        for products in results:
+            self.assertTrue(products)
+            self.assertTrue(products is results[0])
+
+    def test_find_by_serial_decodes_nothing(self):
+        self.dir_class(self.cert_dir_path).list()
+        cert_dir = self.dir_class(self.cert_dir_path)
+        for cert in cert_dir.list():
+            self.assertTrue(cert_dir.find(cert.serial) is cert)
+        for cert in cert_dir.list():
+            self.assertFalse(is_decoded(cert, 'products'))
+
+    def test_encoded_fields_not_decoded_to_save(self):
+        cert_dir = self.dir_class(self.cert_dir_path)
+        cert_dir.list()
+        indexed = self.dir_class(self.cert_dir_path).list()
+        for cert in indexed:
+            cert_to_dict(cert)
+            self.assertFalse(is_decoded(cert, 'products'))
+
+    def test_assigned_content_replaces_encoded(self):
+        self.dir_class(self.cert_dir_path).list()
+        indexed = [c for c in self.dir_class(self.cert_dir_path).list()
+                   if hasattr(c, 'order')][0]
+        indexed.content = []
+        self.assertTrue(is_decoded(indexed, 'content'))
+        self.assertEquals([], indexed.content)
+        self.assertEquals("[]", cert_to_dict(indexed)['content'])
+
+    def test_changed_cert_reparsed(self):
+        self.dir_class(self.cert_dir_path).list()
+        self.write_cert('2.pem', certdata.PRODUCT_CERT_WITH_OS_NAME_V1_0)
+
+        with patch('subscription_manager.certdirectory.create_from_file',
+                   side_effect=create_from_file) as mock_create:
+            certs = self.dir_class(self.cert_dir_path).list()
+            self.assertEquals(1, mock_create.call_count)
+        self.assertEquals(2, len(certs))
+
+    def test_removed_cert_pruned(self):
+        self.dir_class(self.cert_dir_path).list()
+        os.unlink(os.path.join(self.cert_dir_path, '2.pem'))
+
+        certs = self.dir_class(self.cert_dir_path).list()
+        self.assertEquals(1, len(certs))
+
+        index = CertificateIndex(self.index_path)
+        index._load()
+        self.assertEquals([os.path.join(self.cert_dir_path, '1.pem')],
+                          index._entries.keys())
+
+    def test_corrupt_index_ignored(self):
+        f = open(self.index_path, 'w')
+        f.write("this is not json")
+        f.close()
+
+        certs = self.dir_class(self.cert_dir_path).list()
+        self.assertEquals(2, len(certs))
+
+    def test_incremental_refresh_only_loads_new(self):
+        cert_dir = self.dir_class(self.cert_dir_path)
+        before = cert_dir.list()
+        self.write_cert('3.pem', certdata.ENTITLEMENT_CERT_V1_0)
+
+        with patch('subscription_manager.certdirectory.create_from_file',
+                   side_effect=create_from_file) as mock_create:
+            cert_dir.refresh(incremental=True)
+            after = cert_dir.list()
+            self.assertEquals(1, mock_create.call_count)
+
+        self.assertEquals(3, len(after))
+        # Untouched certificates keep the same objects:
+        after_ids = [id(cert) for cert in after]
+        for cert in before:
+            self.assertTrue(id(cert) in after_ids)
+
+    def test_incremental_refresh_drops_removed(self):
+        cert_dir = self.dir_class(self.cert_dir_path)
+        cert_dir.list()
+        os.unlink(os.path.join(self.cert_dir_path, '2.pem'))
+
+        cert_dir.refresh(incremental=True)
+        self.assertEquals(1, len(cert_dir.list()))
+
+    def test_incremental_refresh_before_list(self):
+        cert_dir = self.dir_class(self.cert_dir_path)
+        cert_dir.refresh(incremental=True)
+        self.assertEquals(None, cert_dir._listing)
+        self.assertEquals(2, len(cert_dir.list()))
+
+    def test_full_refresh_reloads(self):
+        cert_dir = self.dir_class(self.cert_dir_path)
+        before = cert_dir.list()
+        cert_dir.refresh()
+        after = cert_dir.list()
+        after_ids = [id(cert) for cert in after]
+        for cert in before:
+            self.assertFalse(id(cert) in after_ids)
+
+
+class ScanStubDirectory(EntitlementDirectory):
+    """
+    Uses the real listing cache, but scans a list of stub certs rather
+    than the filesystem.
+    """
+    def __init__(self, certs):
+        self.certs = certs
+        self._listing = None
+        self._loaded = {}
+        self._lookup_maps = None
+        self._serial_map = None
+        self._index = None
+        self._lock = threading.RLock()
+
+    def _scan(self):
+        return list(self.certs)
+
+
+class LookupMapTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stacked_1 = StubEntitlementCertificate('product1', stacking_id='stack1')
+        self.stacked_2 = StubEntitlementCertificate('product2', stacking_id='stack1')
+        self.unstacked = StubEntitlementCertificate('product3',
+                                                    provided_products=['product1'])
+        self.ent_dir = ScanStubDirectory([self.stacked_1, self.stacked_2, self.unstacked])
+
+    def test_find_by_product(self):
+        self.assertTrue(self.ent_dir.find_by_product('product1') is self.stacked_1)
+        self.assertTrue(self.ent_dir.find_by_product('product3') is self.unstacked)
+        self.assertEquals(None, self.ent_dir.find_by_product('notthere'))
+
+    def test_list_for_product(self):
+        certs = self.ent_dir.list_for_product('product1')
+        self.assertEquals(2, len(certs))
+        self.assertTrue(certs[0] is self.stacked_1)
+        self.assertTrue(certs[1] is self.unstacked)
+        self.assertEquals([], self.ent_dir.list_for_product('notthere'))
+
+    def test_find_all_by_product_completes_stack(self):
+        certs = self.ent_dir.find_all_by_product('product1')
+        self.assertEquals(3, len(certs))
+
+        certs = self.ent_dir.find_all_by_product('product2')
+        self.assertEquals(2, len(certs))
+        self.assertFalse(id(self.unstacked) in [id(c) for c in certs])
+
+    def test_find_by_serial(self):
+        self.assertTrue(self.ent_dir.find(self.stacked_2.serial) is self.stacked_2)
+        self.assertEquals(None, self.ent_dir.find(12345))
+
+    def test_serial_map(self):
+        serial_map = self.ent_dir.get_serial_map()
+        self.assertEquals(3, len(serial_map))
+        self.assertTrue(serial_map[self.unstacked.serial] is self.unstacked)
+
+    def test_maps_built_once_per_listing(self):
+        self.ent_dir._build_lookup_maps = Mock(wraps=self.ent_dir._build_lookup_maps)
+        self.ent_dir.find_by_product('product1')
+        self.ent_dir.list_for_product('product2')
+        self.ent_dir.find_all_by_product('product3')
+        self.ent_dir.find(self.unstacked.serial)
+        self.assertEquals(1, self.ent_dir._build_lookup_maps.call_count)
+
+    def test_serial_map_built_without_product_maps(self):
+        self.ent_dir._build_lookup_maps = Mock(wraps=self.ent_dir._build_lookup_maps)
+        self.ent_dir.find(self.unstacked.serial)
+        self.ent_dir.get_serial_map()
+        self.assertEquals(0, self.ent_dir._build_lookup_maps.call_count)
+
+    def test_refresh_updates_maps(self):
+        self.ent_dir.find_by_product('product1')
+        new_cert = StubEntitlementCertificate('product4')
+        self.ent_dir.certs.append(new_cert)
+        self.ent_dir.refresh(incremental=True)
+        self.assertTrue(self.ent_dir.find_by_product('product4') is new_cert)
+
+
+class ParallelParseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cert_dir_path = tempfile.mkdtemp(prefix='subman-certdir-')
+        pems = [certdata.ENTITLEMENT_CERT_V3_0, certdata.ENTITLEMENT_CERT_V1_0,
+                certdata.PRODUCT_CERT_V1_0]
+        for i in range(12):
+            f = open(os.path.join(self.cert_dir_path, '%s.pem' % i), 'w')
+            f.write(pems[i % len(pems)])
+            f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.cert_dir_path)
+
+    def test_parse_cert_files_keeps_order(self):
+        paths = sorted(os.path.join(self.cert_dir_path, fn)
+                       for fn in os.listdir(self.cert_dir_path))
+        certs = parse_cert_files(paths, 3)
+        self.assertEquals(paths, [c.path for c in certs])
+        for path, cert in zip(paths, certs):
+            self.assertEquals(create_from_file(path).serial, cert.serial)
+
+    @patch('subscription_manager.certdirectory.PARALLEL_PARSE_MIN', 1)
+    def test_directory_parallel_listing(self):
+        serial_dir = CertificateDirectory(self.cert_dir_path)
+        parallel_dir = CertificateDirectory(self.cert_dir_path)
+        parallel_dir.parse_workers = 2
+
+        with patch('subscription_manager.certdirectory.parse_cert_files',
+                   side_effect=parse_cert_files) as mock_parse:
+            parallel = parallel_dir.list()
+            self.assertEquals(1, mock_parse.call_count)
+
+        serial = serial_dir.list()
+        self.assertEquals([c.path for c in serial], [c.path for c in parallel])
+        self.assertEquals([c.serial for c in serial], [c.serial for c in parallel])
+        # Content sets come back from the workers still encoded:
+        for cert in parallel:
+            self.assertFalse(is_decoded(cert, 'products'))
+
+    def test_disabled_by_default(self):
+        cert_dir = CertificateDirectory(self.cert_dir_path)
+        with patch('subscription_manager.certdirectory.parse_cert_files') as mock_parse:
+            self.assertEquals(12, len(cert_dir.list()))
+            self.assertEquals(0, mock_parse.call_count)
@@ -39,6 +39,18 @@ class TestLocker(fixture.SubManFixture):
         res = l.run(return_four)
         self.assertEquals(4, res)
 
+    def test_run_times(self):
+        def return_report():
+            return certlib.ActionReport()
+
+        l = certlib.Locker()
+        report = l.run(return_report)
+        self.assertTrue(l.wait_time >= 0)
+        self.assertTrue(l.hold_time >= 0)
+        self.assertEquals(l.wait_time, report.lock_wait)
+        self.assertEquals(l.hold_time, report.lock_hold)
+        self.assertTrue("action lock: waited" in str(report))
+
 
 class TestBaseActionInvoker(fixture.SubManFixture):
     def test(self):
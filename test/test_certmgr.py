@@ -14,12 +14,23 @@
 #
 
 from datetime import datetime, timedelta
+import logging
+import os
+import shutil
+import tempfile
+import thread
+import threading
+import time
 
 import mock
+import certdata
 import stubs
 
 from rhsm import ourjson as json
 from subscription_manager import action_client
+from subscription_manager import base_action_client
+from subscription_manager import certlib
+from subscription_manager.certdirectory import CertificateDirectory
 from subscription_manager import content_action_client
 from subscription_manager import entcertlib
 from subscription_manager import identitycertlib
@@ -146,6 +157,236 @@ class TestContentActionClient(ActionClientTestBase):
         actionclient.update()
 
 
+class StubLib(object):
+    """
+    Records when it ran, and waits for release before finishing if it
+    was given an event.
+    """
+
+    def __init__(self, name, log, release=None, exception=None):
+        self.name = name
+        self.log = log
+        self.release = release
+        self.exception = exception
+
+    def update(self):
+        self.log.append(('start', self.name))
+        if self.release:
+            self.release.wait(5)
+        self.log.append(('end', self.name))
+        if self.exception:
+            raise self.exception
+        report = certlib.ActionReport()
+        report.name = self.name
+        return report
+
+
+class DirectoryLib(object):
+    """
+    Lists a certificate directory over and over, touching the certs so
+    they are parsed and indexed again, once all the libs sharing
+    started are running.
+    """
+
+    def __init__(self, name, cert_dir, started, touch=False):
+        self.name = name
+        self.cert_dir = cert_dir
+        self.started = started
+        self.touch = touch
+        self.listed = []
+
+    def update(self):
+        self.started[self.name].set()
+        for event in self.started.values():
+            event.wait(5)
+        for i in range(20):
+            if self.touch:
+                for fn in os.listdir(self.cert_dir.path):
+                    os.utime(os.path.join(self.cert_dir.path, fn), (i, i))
+            self.cert_dir.refresh(incremental=bool(i % 2))
+            self.listed.append(len(self.cert_dir.list()))
+        report = certlib.ActionReport()
+        report.name = self.name
+        return report
+
+
+class LoggingLib(StubLib):
+
+    def update(self):
+        logging.getLogger('rhsm-app.test_certmgr').info(self.name)
+        return super(LoggingLib, self).update()
+
+
+class StubDependencyActionClient(base_action_client.BaseActionClient):
+
+    def __init__(self, libs, dependencies):
+        self.libs = libs
+        self.dependencies = dependencies
+        super(StubDependencyActionClient, self).__init__()
+
+    def _get_libset(self):
+        return self.libs
+
+    def _get_dependencies(self):
+        return self.dependencies
+
+
+class TestConcurrentActionClient(SubManFixture):
+
+    def setUp(self):
+        super(TestConcurrentActionClient, self).setUp()
+        self.log = []
+
+    def _names(self, reports):
+        return [report and report.name for report in reports]
+
+    def test_independent_libs_run_together(self):
+        release = threading.Event()
+        first = StubLib('first', self.log, release=release)
+        # Only finishes if it runs while first is still waiting:
+        second = StubLib('second', self.log)
+        second.update = self._releasing(second.update, release)
+
+        client = StubDependencyActionClient([first, second], {})
+        client.update()
+
+        self.assertEquals(['first', 'second'], self._names(client.update_reports))
+        self.assertTrue(self.log.index(('end', 'second')) <
+                        self.log.index(('end', 'first')))
+
+    def test_dependencies_run_first(self):
+        release = threading.Event()
+        first = StubLib('first', self.log, release=release)
+        second = StubLib('second', self.log)
+        third = StubLib('third', self.log)
+        release.set()
+
+        client = StubDependencyActionClient([third, first, second],
+                                            {third: [first, second]})
+        client.update()
+
+        self.assertEquals(['third', 'first', 'second'], self._names(client.update_reports))
+        self.assertEquals(('start', 'third'), self.log[-2])
+
+    def test_gone_exception(self):
+        first = StubLib('first', self.log,
+                exception=GoneException(410, "bye bye", " 234234"))
+        second = StubLib('second', self.log)
+        client = StubDependencyActionClient([first, second], {second: [first]})
+        self.assertRaises(GoneException, client.update)
+        self.assertFalse(('start', 'second') in self.log)
+
+    def test_other_exceptions_logged(self):
+        first = StubLib('first', self.log, exception=ExceptionalException())
+        second = StubLib('second', self.log)
+        client = StubDependencyActionClient([first, second], {second: [first]})
+        client.update()
+        self.assertEquals([None, 'second'], self._names(client.update_reports))
+
+    def test_no_dependencies_in_order(self):
+        first = StubLib('first', self.log)
+        second = StubLib('second', self.log)
+        client = StubDependencyActionClient([first, second], None)
+        client.update()
+        self.assertEquals([('start', 'first'), ('end', 'first'),
+                           ('start', 'second'), ('end', 'second')], self.log)
+
+    def test_shared_directory(self):
+        cert_dir_path = tempfile.mkdtemp(prefix='subman-certdir-')
+        index_dir = tempfile.mkdtemp(prefix='subman-index-')
+        try:
+            for (fn, pem) in [('1.pem', certdata.ENTITLEMENT_CERT_V3_0),
+                              ('2.pem', certdata.PRODUCT_CERT_V1_0)]:
+                f = open(os.path.join(cert_dir_path, fn), 'w')
+                f.write(pem)
+                f.close()
+
+            scanning = []
+            overlapped = []
+
+            class TempCertificateDirectory(CertificateDirectory):
+                INDEX_PATH = os.path.join(index_dir, 'cert_index.json')
+
+                def _scan(self):
+                    scanning.append(True)
+                    overlapped.append(len(scanning) > 1)
+                    # Give the other lib a chance to get in:
+                    time.sleep(0.001)
+                    try:
+                        return CertificateDirectory._scan(self)
+                    finally:
+                        scanning.pop()
+            cert_dir = TempCertificateDirectory(cert_dir_path)
+
+            started = {'first': threading.Event(), 'second': threading.Event()}
+            first = DirectoryLib('first', cert_dir, started, touch=True)
+            second = DirectoryLib('second', cert_dir, started)
+            client = StubDependencyActionClient([first, second], {})
+            client.update()
+
+            self.assertEquals(['first', 'second'],
+                              self._names(client.update_reports))
+            self.assertEquals([2] * 20, first.listed)
+            self.assertEquals([2] * 20, second.listed)
+            self.assertEquals(2, len(cert_dir._index._entries))
+            self.assertFalse(True in overlapped)
+        finally:
+            shutil.rmtree(cert_dir_path)
+            shutil.rmtree(index_dir)
+
+    def test_logged_from_calling_thread(self):
+        emitted = []
+
+        class ThreadHandler(logging.Handler):
+            def emit(self, record):
+                emitted.append((record.getMessage(), threading.currentThread()))
+
+        handler = ThreadHandler()
+        logger = logging.getLogger('rhsm-app.test_certmgr')
+        logger.addHandler(handler)
+        try:
+            client = StubDependencyActionClient(
+                    [LoggingLib('first', self.log), LoggingLib('second', self.log)], {})
+            client.update()
+            # Nothing is held back once the libs are done:
+            logger.info('after')
+        finally:
+            logger.removeHandler(handler)
+
+        self.assertEquals(set(['first', 'second', 'after']),
+                          set(message for (message, thread) in emitted))
+        for (message, thread) in emitted:
+            self.assertTrue(thread is threading.currentThread())
+
+    def test_interrupted_while_libs_run(self):
+        release = threading.Event()
+
+        class InterruptingLib(StubLib):
+            def update(self):
+                # Once the calling thread waits for the libs:
+                time.sleep(0.2)
+                thread.interrupt_main()
+                release.wait(5)
+                return super(InterruptingLib, self).update()
+
+        client = StubDependencyActionClient(
+                [InterruptingLib('first', self.log), StubLib('second', self.log)], {})
+        start = time.time()
+        try:
+            self.assertRaises(KeyboardInterrupt, client.update)
+            # Not held off until the lib is done:
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            release.set()
+
+    def _releasing(self, update, release):
+        def releasing_update():
+            result = update()
+            release.set()
+            return result
+        return releasing_update
+
+
 class TestActionClient(ActionClientTestBase):
 
     def test_init(self):
@@ -0,0 +1,134 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from standin import StandInServer
+from subscription_manager.cache import ProductStatusCache, cache_writer
+from subscription_manager.cp_provider import CPProvider
+
+
+class CPProviderResponseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.server.start()
+        self.server.put('/consumers/abc', {'uuid': 'abc'})
+        self.server.put('/consumers/abc/owner', {'key': 'admin'})
+
+        self.cp_provider = CPProvider()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _methods(self):
+        return [request[0] for request in self.server.requests]
+
+    def test_disabled_by_default(self):
+        cp = self.cp_provider.get_consumer_auth_cp()
+        cp.getConsumer('abc')
+        cp.getConsumer('abc')
+        self.assertEquals(2, len(self.server.requested('/consumers/abc')))
+
+    def test_identical_gets_coalesced(self):
+        self.cp_provider.cache_responses()
+        cp = self.cp_provider.get_consumer_auth_cp()
+        consumer = cp.getConsumer('abc')
+        consumer['uuid'] = 'changed'
+
+        self.assertEquals({'uuid': 'abc'}, cp.getConsumer('abc'))
+        self.assertEquals({'key': 'admin'}, cp.getOwner('abc'))
+        self.assertEquals({'key': 'admin'}, cp.getOwner('abc'))
+        self.assertEquals(['GET', 'GET'], self._methods())
+        self.assertEquals(2, self.cp_provider.response_cache.hits)
+
+    def test_connections_kept_apart(self):
+        self.cp_provider.cache_responses()
+        self.cp_provider.get_consumer_auth_cp().getConsumer('abc')
+        self.cp_provider.get_no_auth_cp().getConsumer('abc')
+        self.assertEquals(2, len(self.server.requested('/consumers/abc')))
+
+    def test_write_invalidates(self):
+        self.cp_provider.cache_responses()
+        cp = self.cp_provider.get_consumer_auth_cp()
+        cp.getConsumer('abc')
+        cp.updateConsumer('abc', service_level='Premium')
+        cp.getConsumer('abc')
+        self.assertEquals(['GET', 'PUT', 'GET'], self._methods())
+
+    def test_clean_invalidates(self):
+        self.cp_provider.cache_responses()
+        self.cp_provider.get_consumer_auth_cp().getConsumer('abc')
+        self.cp_provider.clean()
+        self.cp_provider.get_consumer_auth_cp().getConsumer('abc')
+        self.assertEquals(2, len(self.server.requested('/consumers/abc')))
+
+    def test_errors_not_cached(self):
+        self.cp_provider.cache_responses()
+        cp = self.cp_provider.get_consumer_auth_cp()
+        for i in range(2):
+            self.assertRaises(Exception, cp.getConsumer, 'missing')
+        self.assertEquals(2, len(self.server.requested('/consumers/missing')))
+
+    def _product_status(self, cp):
+        with patch.object(ProductStatusCache, 'CACHE_FILE',
+                          os.path.join(self.cache_dir, 'product_status.json')):
+            status = ProductStatusCache().load_status(cp, 'abc')
+            cache_writer.flush()
+        return status
+
+    def test_status_caches_share_responses(self):
+        # The product status and the libs checking the consumer, ie.
+        # IdentityCertLib, all fetch it in an rhsmcertd run:
+        self.cache_dir = tempfile.mkdtemp()
+        try:
+            installed = [{'productId': '69'}]
+            self.server.put('/consumers/abc', {'uuid': 'abc',
+                                               'installedProducts': installed})
+            self.cp_provider.cache_responses()
+            cp = self.cp_provider.get_consumer_auth_cp()
+            self.assertEquals(installed, self._product_status(cp))
+            self.assertEquals('abc', cp.getConsumer('abc')['uuid'])
+            self.assertEquals(1, len(self.server.requested('/consumers/abc')))
+
+            # The next run, when the cache on disk has validators:
+            self.cp_provider.clean()
+            cp = self.cp_provider.get_consumer_auth_cp()
+            self.assertEquals('abc', cp.getConsumer('abc')['uuid'])
+            self.assertEquals(installed, self._product_status(cp))
+            self.assertEquals(2, len(self.server.requested('/consumers/abc')))
+        finally:
+            shutil.rmtree(self.cache_dir)
+
+    def test_not_modified_not_cached(self):
+        self.server.put('/consumers/abc', {'uuid': 'abc'})
+        self.cp_provider.cache_responses()
+        conn = self.cp_provider.get_consumer_auth_cp().conn
+        response = conn.request_response("GET", "/consumers/abc")
+        headers = {'If-None-Match': response['headers']['etag']}
+        self.cp_provider.clean()
+
+        conn = self.cp_provider.get_consumer_auth_cp().conn
+        self.assertEquals(304, conn.request_response("GET", "/consumers/abc",
+                                                     headers=headers)['status'])
+        self.assertEquals({'uuid': 'abc'}, conn.request_get("/consumers/abc"))
+        self.assertEquals([200, 304, 200],
+                          [request[3] for request in
+                           self.server.requested('/consumers/abc')])
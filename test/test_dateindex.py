@@ -0,0 +1,133 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+from datetime import datetime, timedelta
+import unittest
+
+from stubs import StubEntitlementCertificate, StubEntitlementDirectory
+from subscription_manager.dateindex import DateRangeIndex
+
+
+def ids(certs):
+    return [id(cert) for cert in certs]
+
+
+class DateRangeIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        now = datetime.utcnow()
+        self.expired = StubEntitlementCertificate('expired',
+                start_date=now - timedelta(days=365),
+                end_date=now - timedelta(days=2))
+        self.valid = StubEntitlementCertificate('valid',
+                start_date=now - timedelta(days=10),
+                end_date=now + timedelta(days=300))
+        # warning_period of stub certs is 42 days:
+        self.expiring = StubEntitlementCertificate('expiring',
+                start_date=now - timedelta(days=300),
+                end_date=now + timedelta(days=20))
+        self.future = StubEntitlementCertificate('future',
+                start_date=now + timedelta(days=365),
+                end_date=now + timedelta(days=730))
+        self.certs = [self.future, self.valid, self.expired, self.expiring]
+        self.index = DateRangeIndex(self.certs)
+
+    def test_now(self):
+        self.assertEquals(ids([self.valid, self.expiring]),
+                          ids(self.index.valid()))
+        self.assertEquals(ids([self.expired]), ids(self.index.expired()))
+        self.assertEquals(ids([self.future]), ids(self.index.future()))
+        self.assertEquals(ids([self.expiring]),
+                          ids(self.index.in_warning_period()))
+
+    def test_expiring_within(self):
+        self.assertEquals([], self.index.expiring_within(10))
+        self.assertEquals(ids([self.expiring]),
+                          ids(self.index.expiring_within(30)))
+        self.assertEquals(ids([self.valid, self.expiring]),
+                          ids(self.index.expiring_within(400)))
+
+    def test_on_date(self):
+        on_date = datetime.utcnow() + timedelta(days=400)
+        self.assertEquals(ids([self.future]), ids(self.index.valid(on_date)))
+        self.assertEquals(ids([self.valid, self.expired, self.expiring]),
+                          ids(self.index.expired(on_date)))
+        self.assertEquals([], self.index.future(on_date))
+
+    def test_matches_certificate_checks(self):
+        now = datetime.utcnow()
+        for days in range(-400, 800, 7):
+            on_date = now + timedelta(days=days)
+            self.assertEquals(
+                    ids([c for c in self.certs if c.is_valid(on_date)]),
+                    ids(self.index.valid(on_date)))
+            self.assertEquals(
+                    ids([c for c in self.certs if c.is_expired(on_date)]),
+                    ids(self.index.expired(on_date)))
+            self.assertEquals(
+                    ids([c for c in self.certs if c.is_valid(on_date) and
+                         c.is_expiring(on_date)]),
+                    ids(self.index.in_warning_period(on_date)))
+
+    def test_warning_period_checks_only_warned(self):
+        self.index._not_ended = self._counting(self.index._not_ended)
+        self.index.in_warning_period()
+        # Only the expired and expiring certs are past their warning date:
+        self.assertEquals([2], self.checked)
+
+    def test_valid_checks_fewer_side(self):
+        self.index._not_ended = self._counting(self.index._not_ended)
+        self.index._started = self._counting(self.index._started)
+        self.index.valid()
+        # 3 certs have not ended, 3 have started:
+        self.assertEquals([3], self.checked)
+
+        self.checked = []
+        self.index.valid(datetime.utcnow() + timedelta(days=400))
+        # 1 cert has not ended, 4 have started:
+        self.assertEquals([1], self.checked)
+
+    def _counting(self, check):
+        self.checked = []
+
+        def counting_check(positions, date):
+            positions = list(positions)
+            self.checked.append(len(positions))
+            return check(positions, date)
+        return counting_check
+
+    def test_empty(self):
+        index = DateRangeIndex([])
+        self.assertEquals([], index.valid())
+        self.assertEquals([], index.expired())
+        self.assertEquals([], index.future())
+        self.assertEquals([], index.expiring_within(30))
+        self.assertEquals([], index.in_warning_period())
+
+
+class DirectoryDateIndexTests(unittest.TestCase):
+
+    def test_list_valid_and_expired(self):
+        now = datetime.utcnow()
+        valid = StubEntitlementCertificate('valid')
+        expired = StubEntitlementCertificate('expired',
+                start_date=now - timedelta(days=365),
+                end_date=now - timedelta(days=2))
+        ent_dir = StubEntitlementDirectory([expired, valid])
+
+        self.assertEquals(ids([valid]), ids(ent_dir.list_valid()))
+        self.assertEquals(ids([expired]), ids(ent_dir.list_expired()))
+        self.assertEquals(ids([expired]),
+                          ids(ent_dir.list_valid(now - timedelta(days=100))))
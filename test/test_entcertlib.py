@@ -94,3 +94,33 @@ class UpdateActionTests(SubManFixture):
 
         exceptions = update_action.report.exceptions()
         self.assertEquals([], exceptions)
+
+    def test_status_caches_expired_on_change(self):
+        ent = StubEntitlementCertificate(StubProduct("Prod"))
+        mock_uep = Mock()
+        mock_uep.getCertificateSerials = Mock(return_value=[])
+        self.set_consumer_auth_cp(mock_uep)
+        inj.provide(inj.ENT_DIR, StubEntitlementDirectory([ent]))
+        ent_status_cache = inj.require(inj.ENTITLEMENT_STATUS_CACHE)
+        ent_status_cache.expire = Mock()
+        prod_status_cache = inj.require(inj.PROD_STATUS_CACHE)
+        prod_status_cache.expire = Mock()
+
+        update_action = TestingUpdateAction()
+        update_action.repo_hook = Mock()
+        update_action.branding_hook = Mock()
+        update_action.perform()
+
+        self.assertEquals(1, ent_status_cache.expire.call_count)
+        self.assertEquals(1, prod_status_cache.expire.call_count)
+
+    def test_status_caches_kept_without_change(self):
+        mock_uep = Mock()
+        mock_uep.getCertificateSerials = Mock(return_value=[])
+        self.set_consumer_auth_cp(mock_uep)
+        ent_status_cache = inj.require(inj.ENTITLEMENT_STATUS_CACHE)
+        ent_status_cache.expire = Mock()
+
+        TestingUpdateAction().perform()
+
+        self.assertFalse(ent_status_cache.expire.called)
@@ -12,7 +12,8 @@
 #
 
 import unittest
-from subscription_manager.exceptions import ExceptionMapper
+from subscription_manager.exceptions import ExceptionMapper, LOCK_TIMEOUT_MESSAGE
+from subscription_manager.lock import LockTimeout
 from rhsm.connection import RestlibException
 
 
@@ -95,3 +96,8 @@ class TestExceptionMapper(unittest.TestCase):
 
         err = OldStyleClass()
         self.assertEquals(expected_message, mapper.get_message(err))
+
+    def test_lock_timeout_message(self):
+        mapper = ExceptionMapper()
+        err = LockTimeout('/var/run/rhsm/cert.pid', 5)
+        self.assertEquals(LOCK_TIMEOUT_MESSAGE, mapper.get_message(err))
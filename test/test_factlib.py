@@ -55,6 +55,11 @@ class TestFactlib(fixture.SubManFixture):
         self.assertEquals(self.expected_facts, self.facts_passed_to_server)
         self.assertEquals(invalid_consumer.uuid, self.consumer_uuid_passed_to_server)
 
+    def test_report_str(self):
+        self._inject_mock_invalid_consumer()
+        update_report = self.fl.update()
+        self.assertTrue("timing:" in str(update_report))
+
 
 class ConsumerIdentityExistsStub(stubs.StubConsumerIdentity):
     def __init__(self, keystring, certstring):
@@ -1,10 +1,11 @@
 import tempfile
 import shutil
-from mock import patch
+from mock import Mock, patch
 
 import fixture
 from stubs import StubEntitlementDirectory, StubProductDirectory
 from subscription_manager import facts
+from subscription_manager.cache import cache_writer
 from rhsm import ourjson as json
 
 facts_buf = """
@@ -179,6 +180,23 @@ class TestFacts(fixture.SubManFixture):
         self.assertEquals(self.f.facts['cpu.cpu_socket(s)'], '16')
         self.assertTrue(changed)
 
+    @patch('subscription_manager.facts.Facts._load_custom_facts',
+           return_value={})
+    @patch('subscription_manager.facts.Facts._load_hw_facts')
+    def test_facts_has_changed_digest(self, mock_load_hw, mock_load_cf):
+        test_facts = json.loads(facts_buf)
+        mock_load_hw.return_value = test_facts
+        self.f.write_cache()
+        self.f._read_cache = Mock()
+
+        # Graylisted facts don't count as a change:
+        test_facts['cpu.cpu_mhz'] = '1234'
+        self.assertFalse(self.f.has_changed())
+
+        test_facts['cpu.cpu_socket(s)'] = '16'
+        self.assertTrue(self.f.has_changed())
+        self.assertFalse(self.f._read_cache.called)
+
     @patch('subscription_manager.facts.Facts._read_cache',
            return_value=None)
     @patch('subscription_manager.facts.Facts._load_custom_facts',
@@ -287,6 +305,7 @@ class TestFacts(fixture.SubManFixture):
         # mocking load_hw_facts and load_custom_facts neuters get_facts
         #self.f.get_facts = 'asdfadfasdfadf'
         self.f.write_cache()
+        cache_writer.flush()
 
         new_facts_buf = open(fact_cache).read()
         new_facts = json.loads(new_facts_buf)
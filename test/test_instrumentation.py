@@ -0,0 +1,227 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+import fixture
+from standin import StandInServer
+
+from rhsm import ourjson as json
+from subscription_manager import base_action_client
+from subscription_manager import certlib
+from subscription_manager.cache import EntitlementStatusCache, cache_writer
+from subscription_manager import instrumentation
+from subscription_manager.cp_provider import CPProvider
+
+
+class CallStatsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.server.start()
+        self.server.put('/consumers/abc', {'uuid': 'abc'})
+        self.server.put('/consumers/abc/owner', {'key': 'admin'})
+
+        self.patcher = patch.object(instrumentation, 'timing_enabled')
+        self.patcher.start().return_value = True
+        self.cp_provider = CPProvider()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.server.stop()
+
+    def test_disabled(self):
+        instrumentation.timing_enabled.return_value = False
+        self.assertEquals(None, CPProvider().call_stats)
+
+    def test_counted(self):
+        call_stats = self.cp_provider.call_stats
+        cp = self.cp_provider.get_consumer_auth_cp()
+        cp.getConsumer('abc')
+        cp.getConsumer('abc')
+        cp.getOwner('abc')
+
+        calls = dict((call['request'], call) for call in call_stats.to_list())
+        self.assertEquals(2, calls['GET /consumers/abc']['count'])
+        self.assertEquals(1, calls['GET /consumers/abc/owner']['count'])
+        self.assertTrue(calls['GET /consumers/abc']['total'] >=
+                        calls['GET /consumers/abc']['max'])
+        self.assertEquals(3, call_stats.thread_count())
+
+        call_stats.reset()
+        self.assertEquals([], call_stats.to_list())
+
+    def test_reused_responses_not_counted(self):
+        self.cp_provider.cache_responses()
+        cp = self.cp_provider.get_consumer_auth_cp()
+        cp.getConsumer('abc')
+        cp.getConsumer('abc')
+        self.assertEquals(1, self.cp_provider.call_stats.thread_count())
+
+    def test_status_cache_counted(self):
+        self.server.put('/consumers/abc/compliance', {'status': 'valid'})
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with patch.object(EntitlementStatusCache, 'CACHE_FILE',
+                              os.path.join(cache_dir, 'status.json')):
+                EntitlementStatusCache().load_status(
+                        self.cp_provider.get_consumer_auth_cp(), 'abc')
+                cache_writer.flush()
+        finally:
+            shutil.rmtree(cache_dir)
+        calls = self.cp_provider.call_stats.to_list()
+        self.assertEquals([('GET /consumers/abc/compliance', 1)],
+                          [(call['request'], call['count']) for call in calls])
+
+    def test_errors_counted(self):
+        cp = self.cp_provider.get_consumer_auth_cp()
+        self.assertRaises(Exception, cp.getConsumer, 'missing')
+        calls = self.cp_provider.call_stats.to_list()
+        self.assertEquals(['GET /consumers/missing'],
+                          [call['request'] for call in calls])
+
+    def test_query_ignored(self):
+        call_stats = instrumentation.CallStats()
+        call_stats.record('GET', '/pools?consumer=abc', 0.5)
+        call_stats.record('GET', '/pools?consumer=def', 1.5)
+        call_stats.record('PUT', '/consumers/abc', 0.1)
+        self.assertEquals([{'request': 'GET /pools', 'count': 2,
+                            'total': 2.0, 'max': 1.5},
+                           {'request': 'PUT /consumers/abc', 'count': 1,
+                            'total': 0.1, 'max': 0.1}],
+                          call_stats.to_list())
+
+
+class StubLib(object):
+
+    def __init__(self, report=True):
+        self.report = report
+
+    def update(self):
+        if self.report:
+            return certlib.ActionReport()
+
+
+class StubActionClient(base_action_client.BaseActionClient):
+
+    def __init__(self, libs):
+        self.libs = libs
+        super(StubActionClient, self).__init__()
+
+    def _get_libset(self):
+        return self.libs
+
+
+class StubActionInvoker(certlib.BaseActionInvoker):
+
+    def _do_update(self):
+        return certlib.ActionReport()
+
+
+class RunTimingTests(fixture.SubManFixture):
+
+    def setUp(self):
+        super(RunTimingTests, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'rhsm-timing.log')
+        self.patchers = [patch.object(instrumentation, 'timing_enabled'),
+                         patch.object(instrumentation, 'TIMING_LOG', self.log_path)]
+        for patcher in self.patchers:
+            patcher.start()
+        instrumentation.timing_enabled.return_value = True
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+        super(RunTimingTests, self).tearDown()
+
+    def _records(self):
+        f = open(self.log_path)
+        try:
+            return [json.loads(line) for line in f]
+        finally:
+            f.close()
+
+    def test_disabled(self):
+        instrumentation.timing_enabled.return_value = False
+        self.assertEquals(None, instrumentation.start_run('run'))
+
+        client = StubActionClient([StubLib()])
+        client.update()
+        self.assertEquals(None, client.timing)
+        self.assertEquals(None, client.update_reports[0].timing)
+        self.assertEquals(None, StubActionInvoker().update().timing)
+        self.assertFalse(os.path.exists(self.log_path))
+
+    def test_one_run_at_a_time(self):
+        timing = instrumentation.start_run('run')
+        self.assertEquals(None, instrumentation.start_run('nested'))
+        timing.finish()
+        second = instrumentation.start_run('second')
+        self.assertNotEquals(None, second)
+        second.finish()
+
+    def test_time_lib(self):
+        timing = instrumentation.RunTiming('run')
+        lib = StubLib()
+        (result, lib_timing) = timing.time_lib(lib, lambda: 4)
+        self.assertEquals(4, result)
+        self.assertEquals('StubLib', lib_timing.name)
+        self.assertTrue(lib_timing.wall >= 0)
+        self.assertTrue(lib_timing.cpu >= 0)
+        self.assertEquals(None, lib_timing.calls)
+
+        self.assertRaises(ZeroDivisionError, timing.time_lib, lib, lambda: 1 / 0)
+        self.assertEquals(2, len(timing.libs))
+
+    def test_action_client(self):
+        client = StubActionClient([StubLib(), StubLib(report=False)])
+        client.update()
+
+        report = client.update_reports[0]
+        self.assertTrue(report.timing is client.timing.libs[0])
+        self.assertTrue("timing: wall" in str(report))
+
+        [record] = self._records()
+        self.assertEquals('StubActionClient', record['run'])
+        self.assertEquals(['StubLib', 'StubLib'],
+                          [lib['lib'] for lib in record['libs']])
+        self.assertTrue(record['wall'] >= 0)
+        self.assertTrue(record['lock_hold'] >= 0)
+        self.assertTrue("StubLib: wall" in client.timing.format())
+
+    def test_action_invoker(self):
+        report = StubActionInvoker().update()
+        self.assertEquals('StubActionInvoker', report.timing.name)
+        [record] = self._records()
+        self.assertEquals('StubActionInvoker', record['run'])
+
+    def test_action_invoker_in_client(self):
+        StubActionClient([StubActionInvoker()]).update()
+        [record] = self._records()
+        self.assertEquals('StubActionClient', record['run'])
+        self.assertEquals(['StubActionInvoker'],
+                          [lib['lib'] for lib in record['libs']])
+
+    def test_unwritable_log(self):
+        timing = instrumentation.RunTiming('run')
+        timing.finish()
+        timing.write(os.path.join(self.tmp_dir, 'missing', 'rhsm-timing.log'))
@@ -1,5 +1,11 @@
+import os
+import shutil
 import unittest
 import tempfile
+import threading
+import time
+
+from mock import patch
 
 from subscription_manager import lock
 
@@ -9,6 +15,9 @@ class TestLock(unittest.TestCase):
     def setUp(self):
         self.tmp_dir = tempfile.mkdtemp()
 
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
     def test_lock(self):
         lock.Lock("%s/lock.file" % self.tmp_dir)
 
@@ -20,3 +29,204 @@ class TestLock(unittest.TestCase):
         lf = lock.Lock("%s/lock.file" % self.tmp_dir)
         lf.acquire()
         lf.release()
+
+    def _read(self, path):
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def _write(self, path, contents):
+        f = open(path, 'w')
+        f.write(contents)
+        f.close()
+
+    def test_lock_release_clears_pid(self):
+        path = "%s/lock.file" % self.tmp_dir
+        lf = lock.Lock(path)
+        lf.acquire()
+        self.assertEquals(str(os.getpid()), self._read(path))
+        lf.release()
+        self.assertEquals('', self._read(path))
+
+    def test_nested_locks_share_session(self):
+        path = "%s/lock.file" % self.tmp_dir
+        outer = lock.Lock(path)
+        inner = lock.Lock(path)
+        outer.acquire()
+        with patch.object(lock, 'LockFile') as mock_lock_file:
+            inner.acquire()
+            inner.release()
+            self.assertFalse(mock_lock_file.called)
+        self.assertEquals(str(os.getpid()), self._read(path))
+
+        outer.release()
+        self.assertEquals('', self._read(path))
+
+    def test_session_released_by_last_holder(self):
+        path = "%s/lock.file" % self.tmp_dir
+        outer = lock.Lock(path)
+        inner = lock.Lock(path)
+        outer.acquire()
+        inner.acquire()
+        outer.release()
+        self.assertEquals(str(os.getpid()), self._read(path))
+        self.assertTrue(path in lock._sessions)
+
+        inner.release()
+        self.assertEquals('', self._read(path))
+        self.assertFalse(path in lock._sessions)
+
+    def test_stale_pid(self):
+        path = "%s/lock.file" % self.tmp_dir
+        self._write(path, '999999999')
+        lf = lock.Lock(path, timeout=1)
+        lf.acquire()
+        self.assertTrue(lf.acquired())
+        self.assertEquals(str(os.getpid()), self._read(path))
+        lf.release()
+
+    def test_live_pid_without_flock(self):
+        path = "%s/lock.file" % self.tmp_dir
+        self._write(path, str(os.getppid()))
+        lf = lock.Lock(path, timeout=0.1)
+        self.assertRaises(lock.LockTimeout, lf.acquire)
+        self.assertFalse(lf.acquired())
+        self.assertFalse(path in lock._sessions)
+
+    def test_timeout(self):
+        path = "%s/lock.file" % self.tmp_dir
+        holder = lock.open_locked(path)
+        try:
+            lf = lock.Lock(path, timeout=0.2)
+            start = time.time()
+            self.assertRaises(lock.LockTimeout, lf.acquire)
+            self.assertTrue(time.time() - start >= 0.2)
+            self.assertFalse(lf.acquired())
+        finally:
+            holder.close()
+
+        # The waiter which timed out lets go once it gets the lock:
+        lf = lock.Lock(path, timeout=5)
+        lf.acquire()
+        self.assertTrue(lf.acquired())
+        lf.release()
+
+    def test_handoff(self):
+        path = "%s/lock.file" % self.tmp_dir
+        holder = lock.open_locked(path)
+        acquired = threading.Event()
+        lf = lock.Lock(path)
+
+        def wait():
+            lf.acquire()
+            acquired.set()
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        acquired.wait(0.2)
+        self.assertFalse(acquired.isSet())
+
+        holder.close()
+        waiter.join(5)
+        self.assertTrue(acquired.isSet())
+        self.assertEquals(str(os.getpid()), self._read(path))
+        lf.release()
+
+    def test_wait_without_session_mutex(self):
+        path = "%s/lock.file" % self.tmp_dir
+        other_path = "%s/other.file" % self.tmp_dir
+        holder = lock.open_locked(path)
+        lf = lock.Lock(path)
+        joined = lock.Lock(path)
+        waiter = threading.Thread(target=lf.acquire)
+        waiter.start()
+        try:
+            time.sleep(0.1)
+            # A Lock on another file is not held up meanwhile:
+            other = lock.Lock(other_path, timeout=1)
+            other.acquire()
+            self.assertTrue(other.acquired())
+            other.release()
+
+            # A second Lock on the same file waits for the pending session:
+            joiner = threading.Thread(target=joined.acquire)
+            joiner.start()
+            time.sleep(0.1)
+            self.assertFalse(joined.acquired())
+        finally:
+            holder.close()
+        waiter.join(5)
+        joiner.join(5)
+        self.assertTrue(lf.acquired())
+        self.assertTrue(joined.acquired())
+        self.assertEquals(2, lock._sessions[path].holders)
+        lf.release()
+        joined.release()
+        self.assertFalse(path in lock._sessions)
+
+    def test_joined_session_timeout(self):
+        path = "%s/lock.file" % self.tmp_dir
+        holder = lock.open_locked(path)
+        errors = []
+        joined = lock.Lock(path)
+
+        def join():
+            try:
+                joined.acquire()
+            except lock.LockTimeout, e:
+                errors.append(e)
+
+        try:
+            lf = lock.Lock(path, timeout=0.3)
+            waiter = threading.Thread(target=join)
+            timer = threading.Timer(0.1, waiter.start)
+            timer.start()
+            self.assertRaises(lock.LockTimeout, lf.acquire)
+            timer.join()
+            waiter.join(5)
+        finally:
+            holder.close()
+        self.assertEquals(1, len(errors))
+        self.assertFalse(joined.acquired())
+        self.assertFalse(path in lock._sessions)
+
+
+class TestOpenLocked(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'lock.file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_free(self):
+        fp = lock.open_locked(self.path, timeout=0)
+        self.assertTrue(fp is not None)
+        fp.close()
+
+    def test_held(self):
+        holder = lock.open_locked(self.path)
+        try:
+            self.assertEquals(None, lock.open_locked(self.path, timeout=0))
+            self.assertEquals(None, lock.open_locked(self.path, timeout=0.1))
+        finally:
+            holder.close()
+
+    def test_removed_while_waiting(self):
+        holder = lock.open_locked(self.path)
+        result = []
+        waiter = threading.Thread(
+                target=lambda: result.append(lock.open_locked(self.path)))
+        waiter.start()
+        time.sleep(0.1)
+        os.unlink(self.path)
+        holder.close()
+        waiter.join(5)
+
+        fp = result[0]
+        self.assertEquals(os.stat(self.path).st_ino,
+                          os.fstat(fp.fileno()).st_ino)
+        fp.close()
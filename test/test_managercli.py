@@ -7,7 +7,7 @@ import socket
 # for monkey patching config
 import stubs
 
-from subscription_manager import managercli, managerlib
+from subscription_manager import identity, lock, managercli
 from subscription_manager.printing_utils import format_name, columnize, \
         _echo, _none_wrap
 from subscription_manager.repolib import Repo
@@ -38,12 +38,23 @@ class TestCli(SubManFixture):
         cli = managercli.ManagerCLI()
         self.assertTrue('register' in cli.cli_commands)
 
-    @patch.object(managerlib, "check_identity_cert_perms")
-    def test_main_checks_identity_cert_perms(self, check_identity_cert_perms_mock):
+    @patch('sys.argv', ['subscription-manager', 'version'])
+    @patch.object(managercli.VersionCommand, "main")
+    @patch.object(identity, "check_identity_cert_perms")
+    def test_main_checks_identity_cert_perms(self, check_identity_cert_perms_mock,
+                                             version_main_mock):
+        cli = managercli.ManagerCLI()
+        cli.main()
+        check_identity_cert_perms_mock.assert_called_with()
+        version_main_mock.assert_called_with(None)
+
+    @patch('sys.argv', ['subscription-manager', '--help'])
+    @patch.object(identity, "check_identity_cert_perms")
+    def test_usage_skips_identity_cert_perms(self, check_identity_cert_perms_mock):
         cli = managercli.ManagerCLI()
         # Catch the expected SystemExit so that the test can continue.
         self.assertRaises(SystemExit, cli.main)
-        check_identity_cert_perms_mock.assert_called_with()
+        self.assertFalse(check_identity_cert_perms_mock.called)
 
     def test_main_empty(self):
         cli = managercli.ManagerCLI()
@@ -121,6 +132,25 @@ class TestCliCommand(SubManFixture):
         self._main_help(["--help"])
 
 
+class TestCliCommandLockTimeout(SubManFixture):
+
+    @patch('sys.argv', ['subscription-manager'])
+    def test_lock_timeout(self):
+        cc = managercli.CliCommand()
+        cc._do_command = Mock(side_effect=lock.LockTimeout('/tmp/lock', 5))
+        sys.stderr = MockStderr()
+        try:
+            try:
+                cc.main()
+                self.fail("Should have exited")
+            except SystemExit, e:
+                self.assertEquals(-1, e.code)
+            self.assertTrue('Another subscription-manager operation is in progress'
+                            in sys.stderr.buffer)
+        finally:
+            sys.stderr = sys.__stderr__
+
+
 # for command classes that expect proxy related cli args
 class TestCliProxyCommand(TestCliCommand):
     def test_main_proxy_url(self):
@@ -547,6 +577,33 @@ class TestRemoveCommand(TestCliProxyCommand):
         except SystemExit, e:
             self.assertEquals(e.code, 2)
 
+    def test_remove_serials_unregistered(self):
+        self._inject_mock_invalid_consumer()
+        ent1 = StubEntitlementCertificate('product1')
+        ent2 = StubEntitlementCertificate('product2')
+        self.ent_dir.certs.extend([ent1, ent2])
+
+        self.cc.main(["--serial", str(ent2.serial), "--serial", str(ent2.serial),
+                      "--serial", "12345"])
+        with Capture(silent=True):
+            return_code = self._orig_do_command()
+
+        self.assertEquals(0, return_code)
+        self.assertTrue(ent2.is_deleted)
+        self.assertFalse(ent1.is_deleted)
+
+    def test_remove_unknown_serial_unregistered(self):
+        self._inject_mock_invalid_consumer()
+        ent1 = StubEntitlementCertificate('product1')
+        self.ent_dir.certs.append(ent1)
+
+        self.cc.main(["--serial", "12345"])
+        with Capture(silent=True):
+            return_code = self._orig_do_command()
+
+        self.assertEquals(1, return_code)
+        self.assertFalse(ent1.is_deleted)
+
 
 class TestUnSubscribeCommand(TestRemoveCommand):
     command_class = managercli.UnSubscribeCommand
@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import subprocess
+import sys
+
+from mock import patch
+
+import fixture
+import stubs
+
+from subscription_manager import cli
+from subscription_manager import managercli
+from subscription_manager import managercommands
+
+
+class TestManagerCommands(fixture.SubManFixture):
+
+    def test_match_command_classes(self):
+        for lazy in managercommands.manager_commands():
+            command = lazy.load()
+            self.assertTrue(isinstance(command, managercli.CliCommand))
+            self.assertEquals(command.name, lazy.name)
+            self.assertEquals(command.shortdesc, lazy.shortdesc)
+            self.assertEquals(command.primary, lazy.primary)
+            self.assertEquals(command.aliases, lazy.aliases)
+
+    def test_all_commands(self):
+        names = set(lazy.class_name for lazy in managercommands.manager_commands())
+        classes = set(name for name in dir(managercli)
+                      if name.endswith('Command') and
+                      issubclass(getattr(managercli, name), managercli.CliCommand))
+        abstract = set(['CliCommand', 'UserPassCommand', 'OrgCommand'])
+        self.assertEquals(classes - abstract, names)
+
+
+# What a fresh process imports to find a command, like bin/subscription-manager
+# does before it runs one or prints the usage:
+FIND_COMMAND = """
+import sys
+from subscription_manager.injectioninit import init_dep_injection
+init_dep_injection()
+from subscription_manager.managercommands import ManagerCLI
+ManagerCLI()._find_best_match(['subscription-manager', 'status'])
+print '\\n'.join(sorted(name for name in sys.modules if sys.modules[name]))
+"""
+
+# None of which should be imported before a command runs:
+HEAVY_MODULES = ['subscription_manager.managercli',
+                 'subscription_manager.managerlib',
+                 'subscription_manager.cache',
+                 'subscription_manager.cert_sorter',
+                 'subscription_manager.repolib',
+                 'subscription_manager.hwprobe',
+                 'subscription_manager.plugins',
+                 'subscription_manager.identity',
+                 'rhsm.connection',
+                 'M2Crypto',
+                 'yum']
+
+
+class TestStartupBudget(fixture.SubManFixture):
+
+    def test_find_command_imports(self):
+        src = os.path.join(os.path.dirname(__file__), '..', 'src')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([src] + sys.path)
+        process = subprocess.Popen([sys.executable, '-c', FIND_COMMAND],
+                                   stdout=subprocess.PIPE, env=env)
+        modules = process.communicate()[0].split()
+        self.assertEquals(0, process.returncode)
+        self.assertTrue('subscription_manager.managercommands' in modules)
+        for module in HEAVY_MODULES:
+            self.assertFalse(module in modules, "%s imported" % module)
+
+
+class TestLazyCommand(fixture.SubManFixture):
+
+    def setUp(self):
+        super(TestLazyCommand, self).setUp()
+        self.lazy = cli.LazyCommand('version', managercommands.COMMANDS_MODULE,
+                                    'VersionCommand', 'Print', False)
+
+    def test_not_created_until_run(self):
+        manager_cli = managercommands.ManagerCLI()
+        for command in manager_cli.cli_commands.values():
+            self.assertEquals(None, command._command)
+
+    @patch.object(managercli.VersionCommand, 'main')
+    def test_main(self, main_mock):
+        main_mock.return_value = 3
+        self.assertEquals(3, self.lazy.main(['version']))
+        main_mock.assert_called_with(['version'])
+        self.assertTrue(self.lazy.load() is self.lazy.load())
+
+    @patch('sys.argv', ['subscription-manager', 'version'])
+    def test_found(self):
+        manager_cli = managercommands.ManagerCLI()
+        command = manager_cli._find_best_match(sys.argv)
+        self.assertEquals('version', command.name)
+
+    @patch('sys.argv', ['subscription-manager', '--help'])
+    def test_usage(self):
+        sys.stdout = stubs.MockStdout()
+        try:
+            self.assertRaises(SystemExit, managercommands.ManagerCLI().main)
+            output = sys.stdout.buffer
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertTrue("Print version information" in output)
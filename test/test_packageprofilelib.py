@@ -0,0 +1,43 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+from mock import Mock
+
+import fixture
+
+from subscription_manager import packageprofilelib
+from subscription_manager import injection as inj
+
+
+class TestPackageProfileActionCommand(fixture.SubManFixture):
+
+    def setUp(self):
+        super(TestPackageProfileActionCommand, self).setUp()
+        self.profile_mgr = inj.require(inj.PROFILE_MANAGER)
+        self.profile_mgr.update_check = Mock(return_value=1)
+
+    def test_rpmdb_changed(self):
+        self.profile_mgr.rpmdb_unchanged = Mock(return_value=False)
+        report = packageprofilelib.PackageProfileActionCommand().perform()
+        self.assertEquals(1, self.profile_mgr.update_check.call_count)
+        self.assertEquals(1, report._status)
+
+    def test_rpmdb_unchanged(self):
+        self.profile_mgr.rpmdb_unchanged = Mock(return_value=True)
+        self.profile_mgr._get_profile = Mock()
+        report = packageprofilelib.PackageProfileActionCommand().perform()
+        self.assertFalse(self.profile_mgr.update_check.called)
+        self.assertFalse(self.profile_mgr._get_profile.called)
+        self.assertEquals(0, report._status)
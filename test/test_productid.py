@@ -9,8 +9,10 @@ import yum
 import stubs
 from subscription_manager import productid
 from subscription_manager import certdirectory
+from subscription_manager import cachestore
 
 from rhsm.certificate2 import Product
+from rhsm import ourjson as json
 
 from mock import Mock, patch
 from fixture import SubManFixture
@@ -261,7 +263,7 @@ class TestProductDatabase(unittest.TestCase):
         self.pdb.add("product", "repo")
         self.pdb.write()
 
-    @patch('subscription_manager.productid.json.dump', side_effect=IOError)
+    @patch('subscription_manager.productid.json.dumps', side_effect=IOError)
     def test_write_exception(self, mock_dumps):
         self.pdb.add("product", "repo")
         # mostly looking for no exception here
@@ -280,7 +282,7 @@ class TestProductDatabase(unittest.TestCase):
         self.pdb.read()
         self.assertTrue("12345" in self.pdb.content)
 
-    @patch('subscription_manager.productid.json.load', side_effect=IOError)
+    @patch('subscription_manager.productid.json.loads', side_effect=IOError)
     def test_read_exception(self, mock_load):
         f = open(self.pdb.dir.abspath('productid.js'), 'w')
         buf = """{"12345": "rhel-6"}\n"""
@@ -299,6 +301,33 @@ class TestProductDatabase(unittest.TestCase):
         repo = self.pdb.find_repos("product")
         self.assertTrue("repo" in repo)
 
+    def _write_db(self, contents):
+        f = open(self.pdb.dir.abspath('productid.js'), 'w')
+        f.write(contents)
+        f.close()
+
+    def test_find_repos_reads_once(self):
+        self._write_db("""{"1": ["repo1"], "2": "repo2"}""")
+        pdb = productid.ProductDatabase()
+        pdb._store.read = Mock(side_effect=pdb._store.read)
+        self.assertEquals(["repo1"], pdb.find_repos("1"))
+        self.assertEquals(["repo2"], pdb.find_repos("2"))
+        self.assertEquals(None, pdb.find_repos("3"))
+        self.assertEquals(1, pdb._store.read.call_count)
+
+    def test_kept_as_file_with_sqlite_backend(self):
+        self._write_db("""{"1": ["repo1"]}""")
+        store = cachestore.SqliteStore(os.path.join(self.temp_dir, 'cache.db'))
+        with patch.object(cachestore, '_store', store):
+            pdb = productid.ProductDatabase()
+            self.assertEquals(["repo1"], pdb.find_repos("1"))
+            pdb.add("2", "repo2")
+            pdb.write()
+        f = open(pdb.dir.abspath('productid.js'))
+        self.assertEquals({"1": ["repo1"], "2": ["repo2"]}, json.load(f))
+        f.close()
+        self.assertFalse(os.path.exists(store.db_path))
+
     def test_find_repos_old_format(self):
         self.pdb.populate_content({'product': 'repo'})
         repo = self.pdb.find_repos("product")
@@ -24,7 +24,7 @@ from stubs import StubCertificateDirectory, StubProductCertificate, \
         StubProduct, StubEntitlementCertificate, StubContent, \
         StubProductDirectory, StubConsumerIdentity
 from subscription_manager.repolib import Repo, RepoUpdateActionCommand, \
-        TidyWriter, RepoFile
+        TidyWriter, RepoFile, RepoContent, RepoSection
 from subscription_manager import injection as inj
 
 from subscription_manager import repolib
@@ -143,16 +143,33 @@ class RepoUpdateActionTests(SubManFixture):
         mock_file.section.return_value = None
 
         def stub_content():
-            return [Repo('x', [('gpgcheck', 'original'), ('gpgkey', 'some_key')])]
+            return [RepoSection('x', {'gpgcheck': 'original', 'gpgkey': 'some_key'})]
 
         update_action = RepoUpdateActionCommand()
-        update_action.get_unique_content = stub_content
+        update_action.get_unique_sections = stub_content
         update_report = update_action.perform()
         written_repo = mock_file.add.call_args[0][0]
         self.assertEquals('original', written_repo['gpgcheck'])
         self.assertEquals('some_key', written_repo['gpgkey'])
         self.assertEquals(1, update_report.updates())
 
+    @patch("subscription_manager.repolib.RepoFile")
+    def test_unchanged_repo_not_updated(self, mock_file):
+        mock_file = mock_file.return_value
+        mock_file.needs_update.return_value = False
+
+        section = Mock(spec=RepoSection)
+        section.id = 'x'
+
+        update_action = RepoUpdateActionCommand()
+        update_action.get_unique_sections = lambda: [section]
+        update_report = update_action.perform()
+        # No Repo is built for a section which did not change:
+        self.assertFalse(section.to_repo.called)
+        self.assertFalse(mock_file.section.called)
+        self.assertFalse(mock_file.update.called)
+        self.assertEquals(0, update_report.updates())
+
     @patch("subscription_manager.repolib.RepoFile")
     def test_update_when_not_registered_and_existing_repo(self, mock_file):
         self._inject_mock_invalid_consumer()
@@ -160,10 +177,10 @@ class RepoUpdateActionTests(SubManFixture):
         mock_file.section.return_value = Repo('x', [('gpgcheck', 'original'), ('gpgkey', 'some_key')])
 
         def stub_content():
-            return [Repo('x', [('gpgcheck', 'new'), ('gpgkey', 'new_key'), ('name', 'test')])]
+            return [RepoSection('x', {'gpgcheck': 'new', 'gpgkey': 'new_key', 'name': 'test'})]
 
         update_action = RepoUpdateActionCommand()
-        update_action.get_unique_content = stub_content
+        update_action.get_unique_sections = stub_content
         update_action.perform()
 
         written_repo = mock_file.update.call_args[0][0]
@@ -206,6 +223,22 @@ class RepoUpdateActionTests(SubManFixture):
         content = update_action.get_unique_content()
         self.assertEquals(3, len(content))
 
+    def test_matching_content_records(self):
+        update_action = RepoUpdateActionCommand()
+        content = update_action.matching_content()
+        self.assertEquals(set(["c1", "c2", "c4"]), set(c.label for c in content))
+        for c in content:
+            self.assertTrue(isinstance(c, RepoContent))
+            self.assertFalse(hasattr(c, '__dict__'))
+
+    def test_provided_tags_looked_up_once(self):
+        update_action = RepoUpdateActionCommand()
+        update_action.prod_dir.get_provided_tags = Mock(
+                side_effect=update_action.prod_dir.get_provided_tags)
+        update_action.get_unique_content()
+        update_action.matching_content()
+        self.assertEquals(1, update_action.prod_dir.get_provided_tags.call_count)
+
     def test_join(self):
         base = "http://foo/bar"
         update_action = RepoUpdateActionCommand()
@@ -499,8 +532,49 @@ class TidyWriterTests(unittest.TestCase):
         self.assertEquals("test stuff\n\ntest\n", output.getvalue())
 
 
+class RepoContentTests(unittest.TestCase):
+
+    def test_same_label_is_equal(self):
+        c1 = RepoContent(StubContent("label"))
+        c2 = RepoContent(StubContent("label", url="/other"))
+        self.assertEquals(c1, c2)
+        self.assertEquals(1, len(set([c1, c2])))
+        self.assertNotEquals(c1, RepoContent(StubContent("other")))
+
+    def test_strings_interned(self):
+        c1 = RepoContent(StubContent(u"label", url=u"/some/path"))
+        c2 = RepoContent(StubContent("".join(["lab", "el"]),
+                                     url="".join(["/some", "/path"])))
+        self.assertTrue(c1.label is c2.label)
+        self.assertTrue(c1.url is c2.url)
+
+    def test_non_ascii_not_interned(self):
+        c = RepoContent(StubContent(u"l\xe4bel"))
+        self.assertEquals(u"l\xe4bel", c.label)
+
+
 class RepoFileTest(unittest.TestCase):
 
+    @patch("subscription_manager.repolib.RepoFile.create")
+    def test_needs_update(self, stub_create):
+        rf = RepoFile()
+        repo = Repo('test', [('name', 'test'), ('metadata_expire', 1)])
+        self.assertTrue(rf.needs_update(repo))
+        rf.add(repo)
+        self.assertFalse(rf.needs_update(repo))
+        repo['name'] = 'changed'
+        self.assertTrue(rf.needs_update(repo))
+
+    @patch("subscription_manager.repolib.RepoFile.create")
+    def test_section_needs_update(self, stub_create):
+        rf = RepoFile()
+        section = RepoSection('test', {'name': 'test', 'metadata_expire': 1})
+        self.assertTrue(rf.needs_update(section))
+        rf.add(section.to_repo())
+        self.assertFalse(rf.needs_update(section))
+        section['name'] = 'changed'
+        self.assertTrue(rf.needs_update(section))
+
     @patch("subscription_manager.repolib.RepoFile.create")
     @patch("subscription_manager.repolib.TidyWriter")
     def test_configparsers_equal(self, tidy_writer, stub_create):
@@ -0,0 +1,379 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from mock import Mock, NonCallableMock, patch
+
+import fixture
+from stubs import StubEntitlementCertificate
+
+from subscription_manager import injection as inj
+from subscription_manager import worker
+from subscription_manager.cache import ProfileManager, cache_writer
+from subscription_manager.packageprofilelib import PackageProfileActionCommand
+from subscription_manager.lock import LockTimeout
+
+
+def write(path, contents):
+    f = open(path, 'w')
+    f.write(contents)
+    f.close()
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_missing(self):
+        self.assertEquals(None, worker.fingerprint(os.path.join(self.path, 'none')))
+
+    def test_changes(self):
+        empty = worker.fingerprint(self.path)
+        self.assertEquals([], empty)
+        self.assertEquals(empty, worker.fingerprint(self.path))
+
+        write(os.path.join(self.path, '1.pem'), 'a')
+        added = worker.fingerprint(self.path)
+        self.assertNotEquals(empty, added)
+        self.assertEquals(added, worker.fingerprint(self.path))
+
+        write(os.path.join(self.path, '1.pem'), 'bb')
+        self.assertNotEquals(added, worker.fingerprint(self.path))
+
+        os.unlink(os.path.join(self.path, '1.pem'))
+        self.assertEquals(empty, worker.fingerprint(self.path))
+
+
+class TestResidentWorker(fixture.SubManFixture):
+
+    def setUp(self):
+        super(TestResidentWorker, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.consumer_path = self._mkdir('consumer')
+        self.ent_dir = NonCallableMock(path=self._mkdir('entitlement'))
+        self.prod_dir = NonCallableMock(path=self._mkdir('product'))
+        inj.provide(inj.ENT_DIR, self.ent_dir)
+        inj.provide(inj.PROD_DIR, self.prod_dir)
+        self.cp_provider = NonCallableMock()
+        inj.provide(inj.CP_PROVIDER, self.cp_provider)
+
+        self.identity_patcher = patch.object(worker.ConsumerIdentity, 'PATH',
+                                             self.consumer_path)
+        self.identity_patcher.start()
+        self.socket_path = os.path.join(self.tmp_dir, 'worker.sock')
+        self.worker = worker.ResidentWorker(self.socket_path)
+
+    def tearDown(self):
+        self.identity_patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+        super(TestResidentWorker, self).tearDown()
+
+    def _mkdir(self, name):
+        path = os.path.join(self.tmp_dir, name)
+        os.mkdir(path)
+        return path
+
+    def test_first_refresh(self):
+        self.worker.refresh()
+        self.assertTrue(inj.require(inj.IDENTITY).reload.called)
+        self.assertTrue(self.cp_provider.clean.called)
+        self.ent_dir.refresh.assert_called_once_with(incremental=True)
+        self.prod_dir.refresh.assert_called_once_with(incremental=True)
+
+    def test_refresh_only_changed(self):
+        self.worker.refresh()
+        self.ent_dir.reset_mock()
+        self.prod_dir.reset_mock()
+        self.cp_provider.reset_mock()
+
+        write(os.path.join(self.ent_dir.path, '1.pem'), 'a')
+        self.worker.refresh()
+        self.ent_dir.refresh.assert_called_once_with(incremental=True)
+        self.assertFalse(self.prod_dir.refresh.called)
+        self.assertFalse(self.cp_provider.clean.called)
+        # Responses are only good for one update:
+        self.assertTrue(self.cp_provider.response_cache.clear.called)
+
+    @patch.object(worker, 'CertSorter')
+    def test_sorter_reloaded_per_update(self, mock_sorter_class):
+        sorter = inj.require(inj.CERT_SORTER)
+        self.assertEquals(mock_sorter_class.return_value, sorter)
+        self.assertTrue(sorter is inj.require(inj.CERT_SORTER))
+        self.assertFalse(sorter.load.called)
+
+        self.worker.refresh()
+        self.assertTrue(sorter is inj.require(inj.CERT_SORTER))
+        self.assertEquals(1, sorter.load.call_count)
+        self.assertEquals(1, mock_sorter_class.call_count)
+
+    @patch.object(worker, 'update')
+    def test_run(self, mock_update):
+        mock_update.return_value = True
+        self.assertEquals(0, self.worker.run(True, 3600))
+        mock_update.assert_called_once_with(True, 3600)
+
+        mock_update.return_value = False
+        self.assertEquals(-1, self.worker.run())
+
+        mock_update.side_effect = Exception("boom")
+        self.assertEquals(-1, self.worker.run())
+
+        mock_update.side_effect = LockTimeout('/tmp/lock', 5)
+        self.assertEquals(-1, self.worker.run())
+
+    def test_changed_packages_uploaded(self):
+        profiles = {'a': [{'name': 'package1'}],
+                    'b': [{'name': 'package1'}, {'name': 'package2'}]}
+        rpmdb = ['a']
+
+        profile_mgr = ProfileManager()
+        profile_mgr.CACHE_FILE = os.path.join(self.tmp_dir, 'packages.json')
+        profile_mgr._report_package_profile = 1
+        profile_mgr._delta_upload = False
+        profile_mgr._get_profile = Mock(side_effect=lambda profile_type:
+                Mock(collect=Mock(return_value=profiles[rpmdb[0]])))
+        inj.provide(inj.PROFILE_MANAGER, profile_mgr)
+        uep = self.cp_provider.get_consumer_auth_cp.return_value
+
+        def update(autoheal, interval):
+            PackageProfileActionCommand().perform()
+            cache_writer.flush()
+            return True
+
+        with patch.object(worker, 'update', update):
+            with patch('subscription_manager.cache.rpmdb_fingerprint',
+                       lambda: rpmdb[0]):
+                with patch.object(worker, 'rpmdb_fingerprint', lambda: rpmdb[0]):
+                    self.assertEquals(0, self.worker.run())
+                    rpmdb[0] = 'b'
+                    self.assertEquals(0, self.worker.run())
+                    # Nothing to do while packages stay the same:
+                    self.assertTrue(profile_mgr.rpmdb_unchanged())
+                    self.assertEquals(0, self.worker.run())
+
+        self.assertEquals([profiles['a'], profiles['b']],
+                          [args[0][1] for args in
+                           uep.updatePackageProfile.call_args_list])
+
+    def _request(self, request):
+        (client, server) = socket.socketpair()
+        try:
+            client.sendall(request + "\n")
+            self.worker.handle(server)
+            server.close()
+            return client.makefile('r').readline()
+        finally:
+            client.close()
+
+    @patch.object(worker, 'update')
+    def test_handle(self, mock_update):
+        mock_update.return_value = True
+        self.assertEquals("0\n", self._request(worker.AUTOHEAL))
+        mock_update.assert_called_once_with(True, None)
+        self.assertEquals("0\n", self._request(worker.UPDATE + " 14400"))
+        mock_update.assert_called_with(False, 14400)
+
+        mock_update.reset_mock()
+        self.assertEquals("0\n", self._request(worker.PING))
+        self.assertEquals("-1\n", self._request("bogus"))
+        self.assertEquals("-1\n", self._request(worker.UPDATE + " soon"))
+        self.assertFalse(mock_update.called)
+
+    @patch.object(worker, 'update')
+    def test_serve(self, mock_update):
+        mock_update.return_value = True
+        self.worker.IDLE_CHECK = 0.1
+        # Left behind by an earlier worker:
+        write(self.socket_path, '')
+
+        server = threading.Thread(target=self.worker.serve)
+        server.start()
+        try:
+            for attempt in range(50):
+                if self.worker.running:
+                    break
+                server.join(0.1)
+            for request in (worker.UPDATE, worker.AUTOHEAL):
+                client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                client.connect(self.socket_path)
+                client.sendall(request + "\n")
+                self.assertEquals("0\n", client.makefile('r').readline())
+                client.close()
+        finally:
+            self.worker.stop()
+            server.join(5)
+
+        self.assertEquals(2, mock_update.call_count)
+        self.assertFalse(server.isAlive())
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+class TestHostJitter(unittest.TestCase):
+
+    def test_stable(self):
+        self.assertEquals(worker.host_jitter(600, 'a'),
+                          worker.host_jitter(600, 'a'))
+
+    def test_range(self):
+        jitters = [worker.host_jitter(600, str(seed)) for seed in range(200)]
+        self.assertTrue(min(jitters) >= 0)
+        self.assertTrue(max(jitters) < 600)
+        # Spread out, not all the same:
+        self.assertTrue(len(set(jitters)) > 100)
+
+    def test_no_range(self):
+        self.assertEquals(0, worker.host_jitter(0, 'a'))
+
+
+class TestUpdateSchedule(fixture.SubManFixture):
+
+    INTERVAL = 4 * 60 * 60
+
+    def setUp(self):
+        super(TestUpdateSchedule, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        for name in ('consumer', 'entitlement', 'product'):
+            os.mkdir(os.path.join(self.tmp_dir, name))
+        self.ent_dir.path = os.path.join(self.tmp_dir, 'entitlement')
+        self.prod_dir.path = os.path.join(self.tmp_dir, 'product')
+        identity = inj.require(inj.IDENTITY)
+        identity.is_valid.return_value = True
+
+        self.patchers = [
+            patch.object(worker.ConsumerIdentity, 'PATH',
+                         os.path.join(self.tmp_dir, 'consumer')),
+            patch.object(worker.UpdateRunCache, 'CACHE_FILE',
+                         os.path.join(self.tmp_dir, 'runs.json')),
+            patch.object(worker, 'NEXT_RUN_PATH',
+                         os.path.join(self.tmp_dir, 'next_%s')),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.status_cache = NonCallableMock()
+        self.status_cache._cache_exists.return_value = True
+        inj.provide(inj.ENTITLEMENT_STATUS_CACHE, self.status_cache)
+        self.set_status(True, None)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+        super(TestUpdateSchedule, self).tearDown()
+
+    def set_status(self, compliant, until):
+        status = {'compliant': compliant, 'compliantUntil': None}
+        if until is not None:
+            status['compliantUntil'] = until.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+        self.status_cache._read_cache.return_value = status
+
+    def schedule(self, autoheal=False):
+        return worker.UpdateSchedule(autoheal, self.INTERVAL)
+
+    def test_never_ran(self):
+        self.assertFalse(self.schedule().can_skip())
+
+    def test_skip_unchanged(self):
+        self.schedule().record_run()
+        self.assertTrue(self.schedule().can_skip())
+        # Each kind of update has its own record:
+        self.assertFalse(self.schedule(autoheal=True).can_skip())
+
+    def test_no_skip_after_change(self):
+        self.schedule().record_run()
+        write(os.path.join(self.ent_dir.path, '1.pem'), 'a')
+        self.assertFalse(self.schedule().can_skip())
+
+    def test_no_skip_not_compliant(self):
+        self.schedule().record_run()
+        self.set_status(False, None)
+        self.assertFalse(self.schedule().can_skip())
+
+    def test_no_skip_compliance_runs_out(self):
+        self.schedule().record_run()
+        self.set_status(True, datetime.utcnow() + timedelta(hours=4))
+        self.assertFalse(self.schedule().can_skip())
+        self.set_status(True, datetime.utcnow() + timedelta(days=5))
+        self.assertTrue(self.schedule().can_skip())
+
+    def test_no_skip_cert_expires(self):
+        self.ent_dir.certs.append(StubEntitlementCertificate('expiring',
+                end_date=datetime.utcnow() + timedelta(hours=1)))
+        self.schedule().record_run()
+        self.assertFalse(self.schedule().can_skip())
+
+    def test_no_skip_too_long(self):
+        schedule = self.schedule()
+        schedule.record_run()
+        schedule.runs.runs[schedule.kind]['time'] = \
+                time.time() - schedule.MAX_SKIPPED_INTERVALS * self.INTERVAL
+        self.assertFalse(schedule.can_skip())
+
+    def test_next_delay(self):
+        delay = self.schedule().next_delay()
+        self.assertTrue(self.INTERVAL <= delay < self.INTERVAL * 1.1)
+        self.assertEquals(delay, self.schedule().next_delay())
+
+    def test_next_delay_early(self):
+        self.set_status(True, datetime.utcnow() + timedelta(hours=2))
+        delay = self.schedule().next_delay()
+        lead = worker.UpdateSchedule.LEAD
+        self.assertTrue(2 * 3600 - lead - 5 <= delay <= 2 * 3600 - lead / 2)
+
+    def test_next_delay_not_too_early(self):
+        self.set_status(True, datetime.utcnow() + timedelta(minutes=1))
+        self.assertEquals(worker.UpdateSchedule.MIN_DELAY,
+                          self.schedule().next_delay())
+
+    def test_past_compliance_ignored(self):
+        self.set_status(False, datetime.utcnow() - timedelta(days=1))
+        self.assertTrue(self.schedule().next_delay() >= self.INTERVAL)
+
+    def test_write_next_delay(self):
+        schedule = self.schedule(autoheal=True)
+        schedule.write_next_delay()
+        f = open(os.path.join(self.tmp_dir, 'next_auto_attach'))
+        self.assertEquals(str(schedule.next_delay()), f.read())
+        f.close()
+
+    @patch.object(worker, 'adaptive_schedule_enabled')
+    @patch.object(worker, 'action_client')
+    @patch.object(worker.ConsumerIdentity, 'existsAndValid')
+    def test_update_skipped(self, mock_exists, mock_action_client, mock_enabled):
+        mock_exists.return_value = True
+        mock_enabled.return_value = True
+        mock_action_client.ActionClient.return_value.update_reports = []
+
+        self.assertTrue(worker.update(False, self.INTERVAL))
+        self.assertEquals(1, mock_action_client.ActionClient.call_count)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'next_cert_check')))
+
+        self.assertTrue(worker.update(False, self.INTERVAL))
+        self.assertEquals(1, mock_action_client.ActionClient.call_count)
+
+        # Without an interval nothing is skipped:
+        self.assertTrue(worker.update(False))
+        self.assertEquals(2, mock_action_client.ActionClient.call_count)